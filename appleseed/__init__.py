@@ -1,16 +1,12 @@
-import gzip
+import importlib
 import os
 import os.path
 import re
-import shutil
-import tarfile
 import urllib.parse
-import urllib.request
-import uuid
-
-from appleseed import apt_pkg
-from appleseed.deb822 import Deb822, Deb822Dict, TagSectionWrapper
 
+# The modules which take long to import (the parsers, chardet, tarfile, urllib.request and
+# so on) are imported where they are used, so that the scripts which only need a light
+# module, such as appleseed.debian_support, do not pay for them.
 
 ALLOWED_DISTROS = ('alpine', 'debian', 'devuan', 'raspberrypios', 'kali', 'ubuntu', )
 
@@ -26,10 +22,58 @@ _MAP = {
 }
 
 
+# The names this module used to import, imported on first access.
+_LAZY_ATTRIBUTES = {
+    'apt_pkg': ('appleseed.apt_pkg', None),
+    'Deb822': ('appleseed.deb822', 'Deb822'),
+    'Deb822Dict': ('appleseed.deb822', 'Deb822Dict'),
+    'TagSectionWrapper': ('appleseed.deb822', 'TagSectionWrapper'),
+    'Snapshot': ('appleseed.snapshot', 'Snapshot'),
+    'SnapshotError': ('appleseed.snapshot', 'SnapshotError'),
+    'SnapshotWriter': ('appleseed.snapshot', 'SnapshotWriter'),
+    'file_sha256': ('appleseed.snapshot', 'file_sha256'),
+    'snapshot_path': ('appleseed.snapshot', 'snapshot_path'),
+}
+
+
+def __getattr__(name):
+    try:
+        module_name, attribute = _LAZY_ATTRIBUTES[name]
+    except KeyError:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}') from None
+
+    module = importlib.import_module(module_name)
+    value = module if attribute is None else getattr(module, attribute)
+    globals()[name] = value
+    return value
+
+
+# The compressions of the Debian index files, from the preferred one, and the modules which
+# decompress them.
+_COMPRESSIONS = (('.xz', 'lzma'), ('.gz', 'gzip'), ('.bz2', 'bz2'), ('', None))
+
+
+def _opener(ext):
+    module = dict(_COMPRESSIONS)[ext]
+    return open if module is None else importlib.import_module(module).open
+
+
 class MirrorUrlNotSpecified(Exception):
     pass
 
 
+class ReleaseFileNotFound(Exception):
+    pass
+
+
+class IndexFileNotListed(Exception):
+    pass
+
+
+class IndexFileCorrupted(Exception):
+    pass
+
+
 class SectionNotSpecified(Exception):
     pass
 
@@ -47,6 +91,7 @@ class IndexFile:
             raise UnknownDistro
 
         self._url = None
+        self._sha256 = None  # of the downloaded file
         if os.path.exists(location):
             self._index_file_path = location
         else:
@@ -56,34 +101,110 @@ class IndexFile:
             if distro == 'alpine':
                 uri = f'v{suite}/{section}/{arch}/APKINDEX.tar.gz'
             else:
-                uri = f'dists/{suite}/{section}/binary-{arch}/Packages'
+                # The name of the index file in the Release file of the suite.
+                self._index_name = f'{section}/binary-{arch}/Packages'
+                self._dist_url = urllib.parse.urljoin(location, f'dists/{suite}/')
+                uri = f'dists/{suite}/{self._index_name}'
 
             self._index_file_path = None  # will be known later
             self._url = urllib.parse.urljoin(location, uri)
 
+    @property
+    def url(self):
+        return self._url
+
     def get_url(self):
         if not self._url:
             raise MirrorUrlNotSpecified
 
-    def iter_paragraphs(self):
+    def iter_paragraphs(self, predicate=None):
+        """Yields the paragraphs of the index file. If predicate is specified (see
+        appleseed.filter), only the paragraphs it accepts are yielded, and it is evaluated
+        before a paragraph is built.
+        """
+
         raise NotImplemented
 
+    def decompress(self):
+        """Decompresses the downloaded index file, so that iter_paragraphs does not have to,
+        and returns the size of the result.
+        """
+
+        return os.path.getsize(self._index_file_path)
+
+    def iter_cached_paragraphs(self, snapshot_dir, predicate=None):
+        """Yields the same paragraphs as iter_paragraphs, reading them from the snapshot of the
+        index file in snapshot_dir if there is one and making the snapshot otherwise. The
+        paragraphs read from a snapshot are read-only mappings which are only valid until the
+        iteration is over.
+        """
+
+        # pylint: disable=import-outside-toplevel
+        from appleseed.snapshot import (Snapshot, SnapshotError, SnapshotWriter, file_sha256,
+                                        snapshot_path)
+
+        # The SHA256 computed while downloading spares hashing the file again.
+        path = snapshot_path(snapshot_dir, self._sha256 or file_sha256(self._index_file_path))
+        try:
+            snapshot = Snapshot(path)
+        except (FileNotFoundError, SnapshotError):
+            # The snapshot has to hold every paragraph, whatever the predicate.
+            with SnapshotWriter(snapshot_dir) as writer:
+                for paragraph in self.iter_paragraphs():
+                    writer.add(paragraph)
+                    if predicate is None or predicate(paragraph):
+                        yield paragraph
+                writer.save(path)
+        else:
+            with snapshot:
+                for record in snapshot:
+                    if predicate is None or predicate(record):
+                        yield record
+
     def download(self):
+        """Downloads the index file and returns its size."""
+
         if not self._url:
             raise MirrorUrlNotSpecified
 
         self._index_file_path = os.path.join(self._temp_dir, os.path.basename(self._url))
-        with urllib.request.urlopen(self._url) as response:
-            with open(self._index_file_path, 'b+w') as outfile:
-                outfile.write(response.read())
+        size, self._sha256 = self._fetch(self._url)
+        return size
+
+    def _fetch(self, url, max_size=None):
+        """Streams url into the index file and returns the number of bytes written and their
+        SHA256. Raises IndexFileCorrupted as soon as more than max_size bytes have arrived.
+        """
+
+        # pylint: disable=import-outside-toplevel
+        import hashlib
+        import urllib.request
+
+        size = 0
+        digest = hashlib.sha256()
+        with urllib.request.urlopen(url) as response:
+            with open(self._index_file_path, 'wb') as outfile:
+                for chunk in iter(lambda: response.read(1 << 20), b''):
+                    size += len(chunk)
+                    if max_size is not None and size > max_size:
+                        raise IndexFileCorrupted(f'{url} is larger than the {max_size} bytes '
+                                                 f'its Release file says')
+                    digest.update(chunk)
+                    outfile.write(chunk)
+
+        return size, digest.hexdigest()
 
     def __enter__(self):
+        import uuid  # pylint: disable=import-outside-toplevel
+
         self._temp_dir = os.path.join(self._parent_temp_dir, str(uuid.uuid4()))
         os.mkdir(self._temp_dir, mode=0o700)
 
         return self
 
     def __exit__(self, exc_type, exc_value, exc_traceback):
+        import shutil  # pylint: disable=import-outside-toplevel
+
         shutil.rmtree(self._temp_dir)
 
 
@@ -93,20 +214,33 @@ class AlpineIndexFile(IndexFile):
 
         yield self._url
 
-    def iter_paragraphs(self):
-        index_file_path = self._index_file_path
-        if index_file_path.endswith('.tar.gz'):
-            with tarfile.open(index_file_path) as infile:
-                infile.extractall(path=os.path.dirname(index_file_path))
+    def decompress(self):
+        if self._index_file_path.endswith('.tar.gz'):
+            import tarfile  # pylint: disable=import-outside-toplevel
+
+            with tarfile.open(self._index_file_path) as infile:
+                infile.extractall(path=os.path.dirname(self._index_file_path))
+
+            self._index_file_path = self._index_file_path[:-len('.tar.gz')]
+
+        return super().decompress()
+
+    def iter_paragraphs(self, predicate=None):
+        from appleseed.deb822 import Deb822Dict  # pylint: disable=import-outside-toplevel
 
-            index_file_path = index_file_path[:-len('.tat.gz')]
+        self.decompress()
 
-        with open(index_file_path, encoding='utf-8') as infile:
-            paragraph = Deb822Dict()
+        wanted = getattr(predicate, 'fields', None)
+        with open(self._index_file_path, encoding='utf-8') as infile:
+            fields = []
             for line in infile.readlines():
                 if line == '\n':
-                    yield paragraph
-                    paragraph = Deb822Dict()
+                    if predicate is None or predicate({
+                            key.lower(): val for key, val in fields
+                            if wanted is None or key.lower() in wanted
+                    }):
+                        yield Deb822Dict(fields)
+                    fields = []
                     continue
 
                 _empty, key, val = re.split(r'^(\w):', line, flags=re.IGNORECASE)
@@ -116,32 +250,131 @@ class AlpineIndexFile(IndexFile):
                 except KeyError:
                     pass
 
-                paragraph[key] = val.strip()
+                fields.append((key, val.strip()))
 
 
 class DebianIndexFile(IndexFile):
+    """The Packages file of a suite, which is fetched in the compression the Release file of
+    the suite lists first in _COMPRESSIONS and verified against the size and SHA256 it
+    gives.
+    """
+
     def __init__(self, *args, **kwargs):
-        self._debian_packages_ext = {'.gz': gzip.open, }
-        self._ext = None  # index file extension (one of _debian_packages_ext)
+        self._ext = None  # index file extension (one of _COMPRESSIONS)
+        self._expected = None  # the SHA256 and size of the index file
+        self._index_name = self._dist_url = None
 
         super().__init__(*args, **kwargs)
 
+    def get_release(self):
+        """Downloads and parses the InRelease file of the suite, or its Release file if the
+        mirror has no InRelease file.
+        """
+
+        # pylint: disable=import-outside-toplevel
+        import urllib.request
+        from urllib.error import HTTPError
+
+        from appleseed.deb822 import Release
+
+        for name in ('InRelease', 'Release'):
+            try:
+                with urllib.request.urlopen(urllib.parse.urljoin(self._dist_url, name)) as response:
+                    # The signature of InRelease is skipped by the parser.
+                    return Release(response.read())
+            except HTTPError as exc:
+                if exc.code != 404:
+                    raise
+
+        raise ReleaseFileNotFound(f'neither InRelease nor Release found in {self._dist_url}')
+
     def get_url(self):
-        super().get_url()
+        """Yields the URLs of the variants of the index file the Release file lists, from the
+        preferred compression. The by-hash URLs are used when the suite supports them.
+        """
 
-        url_bck = self._url
-        for self._ext in list(self._debian_packages_ext.keys()) + ['']:
-            # An empty list means an uncompressed index file.
+        super().get_url()
 
-            self._url = url_bck + self._ext
+        release = self.get_release()
+        listed = release.checksums('SHA256') if 'SHA256' in release else {}
+        by_hash = release.get('Acquire-By-Hash', '').lower() == 'yes'
+        for self._ext, _module in _COMPRESSIONS:
+            self._expected = listed.get(self._index_name + self._ext)
+            if self._expected is None:
+                continue
+
+            if by_hash:
+                directory = os.path.dirname(self._index_name)
+                uri = f'{directory}/by-hash/SHA256/{self._expected[0]}'
+            else:
+                uri = self._index_name + self._ext
+            self._url = urllib.parse.urljoin(self._dist_url, uri)
             yield self._url
 
-    def iter_paragraphs(self):
-        func = self._debian_packages_ext[self._ext] if self._ext else open
-        kwargs = {'encoding': 'utf-8'} if func == open else {}
-        with func(self._index_file_path, **kwargs) as infile:
+    def download(self):
+        """Downloads the index file and verifies it, raising IndexFileCorrupted if its size
+        or SHA256 differs from what the Release file says.
+        """
+
+        from urllib.error import HTTPError  # pylint: disable=import-outside-toplevel
+
+        if not self._url:
+            raise MirrorUrlNotSpecified
+
+        for url in self.get_url():
+            # Named after the index file rather than the URL, which may be a by-hash one.
+            self._index_file_path = os.path.join(
+                self._temp_dir, os.path.basename(self._index_name) + self._ext)
+            expected_sha256, expected_size = self._expected
+            try:
+                size, sha256 = self._fetch(url, expected_size)
+            except HTTPError as exc:
+                # Release files list the uncompressed index files even when the mirror does
+                # not carry them.
+                if exc.code == 404:
+                    continue
+                raise
+
+            if size != expected_size:
+                raise IndexFileCorrupted(f'{url} has {size} bytes instead of {expected_size}')
+            if sha256 != expected_sha256:
+                raise IndexFileCorrupted(f'the SHA256 of {url} is {sha256} instead of '
+                                         f'{expected_sha256}')
+            self._sha256 = sha256
+            return size
+
+        raise IndexFileNotListed(f'no variant of {self._index_name} listed in the Release '
+                                 f'file of {self._dist_url} could be downloaded')
+
+    def decompress(self):
+        if self._ext:
+            import shutil  # pylint: disable=import-outside-toplevel
+
+            path = self._index_file_path[:-len(self._ext)]
+            with _opener(self._ext)(self._index_file_path) as infile:
+                with open(path, 'wb') as outfile:
+                    shutil.copyfileobj(infile, outfile, 1 << 20)
+
+            os.remove(self._index_file_path)
+            self._index_file_path = path
+            self._ext = ''
+
+        return super().decompress()
+
+    def iter_paragraphs(self, predicate=None):
+        # pylint: disable=import-outside-toplevel
+        from appleseed import apt_pkg
+        from appleseed.deb822 import Deb822, TagSectionWrapper, _AutoDecoder
+
+        # Like Deb822.iter_paragraphs, the paragraphs share a decoder instead of making two
+        # each.
+        decoder = _AutoDecoder()
+        with _opener(self._ext or '')(self._index_file_path, 'rt', encoding='utf-8') as infile:
             parser = apt_pkg.TagFile(infile, bytes=False)
             for section in parser:
-                paragraph = Deb822(_parsed=TagSectionWrapper(section))
+                parsed = TagSectionWrapper(section, decoder)
+                if predicate is not None and not predicate(parsed):
+                    continue
+                paragraph = Deb822(_parsed=parsed, _decoder=decoder)
                 if paragraph:
                     yield paragraph
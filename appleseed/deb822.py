@@ -219,7 +219,9 @@ Deb822 Classes
 
 from __future__ import absolute_import, print_function
 
+import codecs
 import collections
+import contextlib
 try:
     # Python 3
     import collections.abc as collections_abc
@@ -229,15 +231,15 @@ except ImportError:
     import collections as collections_abc    # type: ignore
 
 import datetime
-import email.utils
+import functools
 import io
 import re
-import subprocess
 import sys
 import warnings
 
-import chardet  # type: ignore
-import six
+# chardet, email.utils and subprocess are imported where they are needed,
+# since they take long to import and are only needed on uncommon paths
+# (undecodable values, Removals dates and GPG signatures respectively).
 
 
 try:
@@ -280,7 +282,6 @@ except ImportError:
     pass
 
 from appleseed.deprecation import function_deprecated_by
-import appleseed.debian_support
 
 try:
     from appleseed import apt_pkg
@@ -359,6 +360,36 @@ class TagSectionWrapper(collections_abc.Mapping):
         return data.lstrip(' \t').rstrip('\n')
 
 
+def _raw_fields(lines,          # type: List[bytes]
+                wanted,         # type: Optional[Set[bytes]]
+                decoder,        # type: _AutoDecoder
+                ):
+    # type: (...) -> Dict[str, str]
+    """Return the wanted fields of a paragraph given as raw lines
+
+    The keys are in lower case and the values are as Deb822 would have them.
+    Only the wanted fields, given as lower case bytes, are decoded (all of them
+    if wanted is None).
+    """
+    raw = {}    # type: Dict[bytes, List[bytes]]
+    current = None  # type: Optional[List[bytes]]
+    for line in lines:
+        if line[:1] in (b' ', b'\t'):
+            if current is not None:
+                current.append(line)
+            continue
+        current = None
+        key, sep, data = line.partition(b':')
+        if not sep:
+            continue
+        key = key.strip().lower()
+        if wanted is None or key in wanted:
+            current = raw[key] = [data.strip()]
+
+    return dict((decoder.decode(key), decoder.decode(b'\n'.join(parts)))
+                for key, parts in raw.items())
+
+
 class OrderedSet(object):
     """A set-like object that preserves order when iterating over it
 
@@ -428,6 +459,9 @@ class Deb822Dict(collections_abc.MutableMapping):
 
     If _parsed is not None, an optional _fields parameter specifies which keys
     in the _parsed dictionary are exposed.
+
+    The _decoder parameter lets the objects made from the same stream share
+    their _AutoDecoder, which remembers the encodings it has had to guess.
     """
 
     # See the end of the file for the definition of _strI
@@ -437,13 +471,14 @@ class Deb822Dict(collections_abc.MutableMapping):
                  _parsed=None,  # type: Optional[Union[Deb822, TagSectionWrapper]]
                  _fields=None,  # type: Optional[List[str]]
                  encoding="utf-8",  # type: str
+                 _decoder=None,  # type: Optional[_AutoDecoder]
                 ):
         # type: (...) -> None
         self.__dict = {}  # type: Dict[_CaseInsensitiveString, Deb822ValueType]
         self.__keys = OrderedSet()
         self.__parsed = None  # type: Optional[Union[Deb822, TagSectionWrapper]]
         self.encoding = encoding
-        self.decoder = _AutoDecoder(self.encoding)
+        self.decoder = _decoder or _AutoDecoder(self.encoding)
         super(Deb822Dict, self).__init__()
 
         if _dict is not None:
@@ -573,6 +608,8 @@ class Deb822(Deb822Dict):
 
     :param _parsed: internal parameter.
 
+    :param _decoder: internal parameter.
+
     :param encoding: When parsing strings, interpret them in this encoding.
         (All values are given back as unicode objects, so an encoding is
         necessary in order to properly interpret the strings.)
@@ -612,6 +649,7 @@ class Deb822(Deb822Dict):
                  _parsed=None,      # type: Optional[Union[Deb822, TagSectionWrapper]]
                  encoding="utf-8",  # type: str
                  strict=None,       # type: Optional[Dict]
+                 _decoder=None,     # type: Optional[_AutoDecoder]
                  ):
         # type: (...) -> None
 
@@ -623,7 +661,7 @@ class Deb822(Deb822Dict):
             iterable = sequence
 
         Deb822Dict.__init__(self, _dict=_dict, _parsed=_parsed, _fields=fields,
-                            encoding=encoding)
+                            encoding=encoding, _decoder=_decoder)
 
         if iterable is not None:
             try:
@@ -642,6 +680,7 @@ class Deb822(Deb822Dict):
                         shared_storage=False,    # type: bool
                         encoding="utf-8",        # type: str
                         strict=None,             # type: Optional[Dict]
+                        predicate=None,          # type: Optional[Callable[[Mapping[str, str]], bool]]
                        ):
         # type: (...) -> Iterator[Deb822]
         """Generator that yields a Deb822 object for each paragraph in sequence.
@@ -665,6 +704,12 @@ class Deb822(Deb822Dict):
             necessary in order to properly interpret the strings.)
         :param strict: dict of settings to tune the internal parser if that is
             being used. See the documentation for :class:`Deb822` for details.
+        :param predicate: a callable taking a mapping of field names to values
+            and returning whether the paragraph should be yielded, such as a
+            predicate made by :func:`appleseed.filter.compile_filter`.  If it
+            has a fields attribute, only these fields (in lower case) are
+            given to it.  It is evaluated before the Deb822 object is built,
+            so rejected paragraphs are cheap.
         """
         # pylint: disable=unused-argument
 
@@ -689,13 +734,19 @@ class Deb822(Deb822Dict):
             )
             warnings.warn(msg)
 
+        # All the paragraphs share a decoder, so that an encoding which has had
+        # to be guessed once is not guessed again for every paragraph.
+        decoder = _AutoDecoder(encoding)
+
         if _have_apt_pkg and apt_pkg_allowed:
             # pylint: disable=no-member
             parser = apt_pkg.TagFile(sequence, bytes=True)
             for section in parser:
-                paragraph = cls(fields=fields,
-                                _parsed=TagSectionWrapper(section, _AutoDecoder(encoding)),
-                                encoding=encoding)
+                parsed = TagSectionWrapper(section, decoder)
+                if predicate is not None and not predicate(parsed):
+                    continue
+                paragraph = cls(fields=fields, _parsed=parsed, encoding=encoding,
+                                _decoder=decoder)
                 if paragraph:
                     yield paragraph
 
@@ -703,15 +754,36 @@ class Deb822(Deb822Dict):
             # Split this into multiple conditionals so that type checking
             # can follow the types through
             iterable = [] # type: IterableDataSourceType
-            if isinstance(sequence, six.string_types):
+            if isinstance(sequence, str):
                 iterable = iter(sequence.splitlines())
-            elif isinstance(sequence, six.binary_type):
+            elif isinstance(sequence, bytes):
                 iterable = iter(sequence.splitlines())
             else:
                 # StringIO/list can be iterated directly
                 iterable = iter(sequence)  # type: ignore
+
+            if predicate is not None:
+                wanted = getattr(predicate, 'fields', None)
+                if wanted is not None:
+                    wanted = set(f.lower().encode('ascii', 'replace')
+                                 for f in wanted)
+                while True:
+                    try:
+                        lines = cls.gpg_stripped_paragraph(
+                            cls._skip_useless_lines(iterable), strict)
+                    except EOFError:
+                        break
+                    if not predicate(_raw_fields(lines, wanted, decoder)):
+                        continue
+                    x = cls(lines, fields, encoding=encoding, strict=strict,
+                            _decoder=decoder)
+                    if x:
+                        yield x
+                return
+
             while True:
-                x = cls(iterable, fields, encoding=encoding, strict=strict)
+                x = cls(iterable, fields, encoding=encoding, strict=strict,
+                        _decoder=decoder)
                 if not x:
                     break
                 yield x
@@ -763,7 +835,7 @@ class Deb822(Deb822Dict):
             # type: (str) -> bool
             return fields is None or f in fields
 
-        if isinstance(sequence, (six.string_types, bytes)):
+        if isinstance(sequence, (str, bytes)):
             sequence = sequence.splitlines()
 
         curkey = None
@@ -827,7 +899,7 @@ class Deb822(Deb822Dict):
         this can be overridden in subclasses (e.g. _multivalued) that can take
         special values.
         """
-        return six.text_type(self[key])
+        return str(self[key])
 
     def dump(self,
              fd=None,          # type: Optional[Union[IO[str], IO[bytes]]]
@@ -1176,12 +1248,12 @@ class GpgInfo(dict):
 
         n = cls()
 
-        if isinstance(out, six.string_types):
+        if isinstance(out, str):
             n.out = out.split('\n')
         else:
             n.out = out
 
-        if isinstance(err, six.string_types):
+        if isinstance(err, str):
             n.err = err.split('\n')
         else:
             n.err = err
@@ -1244,6 +1316,9 @@ class GpgInfo(dict):
         if "--keyring" not in args:
             raise IOError("cannot access any of the given keyrings")
 
+        # pylint: disable=import-outside-toplevel
+        import subprocess
+
         p = subprocess.Popen(args, stdin=subprocess.PIPE,
                              stdout=subprocess.PIPE, stderr=subprocess.PIPE,
                              universal_newlines=False)
@@ -1455,7 +1530,9 @@ class _lowercase_dict(dict):
 class _VersionAccessorMixin(object):
     """Give access to Version keys as debian_support.Version objects."""
     def get_version(self):
-        return debian.debian_support.Version(self['Version'])
+        # pylint: disable=import-outside-toplevel
+        from appleseed.debian_support import Version
+        return Version(self['Version'])
 
     def set_version(self, version):
         self['Version'] = str(version)
@@ -1603,28 +1680,43 @@ class _multivalued(Deb822):
     identifiers of the fields as the values.
     Please see :class:`Dsc`, :class:`Changes`, and :class:`PdiffIndex`
     as examples.
+
+    Subclasses which set _lazy_multivalued leave the multivalued fields
+    unparsed until they are first looked up; see :class:`Release`.
     """
     _multivalued_fields = {}   # type: Dict[str, List[str]]
+    _lazy_multivalued = False
 
     def __init__(self, *args, **kwargs):
         # type: (*Any, **Any) -> None
+        # The multivalued fields (in lower case) which are still strings.
+        self._unparsed = set()  # type: Set[str]
         Deb822.__init__(self, *args, **kwargs)
 
-        for field, fields in self._multivalued_fields.items():
-            try:
-                contents = self[field]
-            except KeyError:
+        for field in self._multivalued_fields:
+            if field not in self:
                 continue
-
-            if self.is_multi_line(contents):
-                self[field] = []    # type: ignore
-                updater_method = self[field].append
+            if self._lazy_multivalued:
+                self._unparsed.add(field)
             else:
-                self[field] = Deb822Dict()    # type: ignore
-                updater_method = self[field].update
+                self._parse_multivalued(field)
 
-            for line in filter(None, contents.splitlines()):   # type: str
-                updater_method(Deb822Dict(zip(fields, line.split())))
+    def _parse_multivalued(self, field):
+        # type: (str) -> None
+        """Replace the string value of the multivalued field with a list of
+        Deb822Dict (or a single Deb822Dict if the value is on one line)."""
+        fields = self._multivalued_fields[field]
+        contents = self[field]
+
+        if self.is_multi_line(contents):
+            self[field] = []    # type: ignore
+            updater_method = self[field].append
+        else:
+            self[field] = Deb822Dict()    # type: ignore
+            updater_method = self[field].update
+
+        for line in filter(None, contents.splitlines()):   # type: str
+            updater_method(Deb822Dict(zip(fields, line.split())))
 
     def validate_input(self, key, value):
         # type: (str, Union[List[Dict[str, str]], str]) -> None
@@ -1645,7 +1737,7 @@ class _multivalued(Deb822):
             if hasattr(self[key], 'keys'):   # single-line
                 array = [self[key]]
             else:   # multi-line
-                fd.write(six.u("\n"))
+                fd.write("\n")
                 array = self[key]
 
             order = self._multivalued_fields[keyl]
@@ -1656,7 +1748,7 @@ class _multivalued(Deb822):
                 pass
             for item in array:
                 for x in order:
-                    raw_value = six.text_type(item[x])
+                    raw_value = str(item[x])
                     try:
                         length = field_lengths[keyl][x]
                     except KeyError:
@@ -1666,8 +1758,8 @@ class _multivalued(Deb822):
                     if "\n" in value:
                         raise ValueError("'\\n' not allowed in component of "
                                          "multivalued field %s" % key)
-                    fd.write(six.u(" %s") % value)
-                fd.write(six.u("\n"))
+                    fd.write(" %s" % value)
+                fd.write("\n")
             return fd.getvalue().rstrip("\n")
 
         return Deb822.get_as_string(self, key)
@@ -1705,7 +1797,7 @@ class _gpg_multivalued(_multivalued):
                         or kwargs.get('encoding', 'utf-8') or 'utf-8')
             if isinstance(sequence, bytes):
                 self.raw_text = sequence
-            elif isinstance(sequence, six.string_types):
+            elif isinstance(sequence, str):
                 self.raw_text = sequence.encode(encoding)
             elif hasattr(sequence, "items"):
                 # sequence is actually a dict(-like) object, so we don't have
@@ -1746,7 +1838,7 @@ class _gpg_multivalued(_multivalued):
         """
         if isinstance(s, bytes):
             return s
-        if isinstance(s, six.string_types):
+        if isinstance(s, str):
             return s.encode(encoding)
         raise TypeError('bytes or unicode/string required, not %s' % type(s))
 
@@ -1850,8 +1942,86 @@ class Release(_multivalued):
         "sha512": ["sha512", "size", "name"],
     }
 
+    # Release files can list thousands of files, of which only a few are
+    # usually needed: the file lists are only parsed when they are looked up
+    # (dump() looks them all up), and lookup() finds a file without parsing
+    # them at all.
+    _lazy_multivalued = True
+
     __size_field_behavior = "apt-ftparchive"
 
+    def __init__(self, *args, **kwargs):
+        # type: (*Any, **Any) -> None
+        # field -> {name: (hash, size)}, see checksums()
+        self.__checksums = {}  # type: Dict[str, Dict[str, Tuple[str, int]]]
+        super(Release, self).__init__(*args, **kwargs)
+
+    def __getitem__(self, key):
+        # type: (str) -> Any
+        if self._unparsed:
+            keyl = key.lower()
+            if keyl in self._unparsed:
+                self._unparsed.discard(keyl)
+                self._parse_multivalued(keyl)
+        return super(Release, self).__getitem__(key)
+
+    def __setitem__(self, key, value):
+        # type: (str, Any) -> None
+        keyl = key.lower()
+        self._unparsed.discard(keyl)
+        self.__checksums.pop(keyl, None)
+        super(Release, self).__setitem__(key, value)
+
+    def __delitem__(self, key):
+        # type: (str) -> None
+        keyl = key.lower()
+        self._unparsed.discard(keyl)
+        self.__checksums.pop(keyl, None)
+        super(Release, self).__delitem__(key)
+
+    def checksums(self, field='sha256'):
+        # type: (str) -> Dict[str, Tuple[str, int]]
+        """Return a dict mapping the names of the files listed in field (one
+        of MD5Sum, SHA1, SHA256 and SHA512) to their (hash, size) pairs.
+
+        The dict is built on the first call for the field, straight from the
+        text of the field if it has not been parsed yet.
+        """
+        fieldl = field.lower()
+        try:
+            return self.__checksums[fieldl]
+        except KeyError:
+            pass
+
+        if fieldl not in self._multivalued_fields:
+            raise KeyError(field)
+        hash_key = self._multivalued_fields[fieldl][0]
+
+        index = {}  # type: Dict[str, Tuple[str, int]]
+        if fieldl in self._unparsed:
+            contents = super(Release, self).__getitem__(fieldl)
+            for line in contents.splitlines():
+                parts = line.split()
+                if len(parts) >= 3:
+                    index[parts[2]] = (parts[0], int(parts[1]))
+        else:
+            value = self.get(fieldl, [])
+            for item in [value] if hasattr(value, 'keys') else value:
+                index[item['name']] = (item[hash_key], int(item['size']))
+
+        self.__checksums[fieldl] = index
+        return index
+
+    def lookup(self, name, field='sha256'):
+        # type: (str, str) -> Tuple[str, int]
+        """Return the (hash, size) pair of the file name as listed in field,
+        raising KeyError if it is not listed.
+
+            >>> release.lookup('main/binary-amd64/Packages.xz')
+            ('b0c3...', 8384724)
+        """
+        return self.checksums(field)[name]
+
     def set_size_field_behavior(self, value):
         if value not in ["apt-ftparchive", "dak"]:
             raise ValueError("size_field_behavior must be either "
@@ -1905,6 +2075,7 @@ class Sources(Dsc, _PkgRelationMixin):
                         shared_storage=False,    # type: bool
                         encoding="utf-8",        # type: str
                         strict=None,             # type: Optional[Dict]
+                        predicate=None,          # type: Optional[Callable[[Mapping[str, str]], bool]]
                        ):
         # type: (...) -> Iterator
         """Generator that yields a Deb822 object for each paragraph in Sources.
@@ -1919,7 +2090,8 @@ class Sources(Dsc, _PkgRelationMixin):
                 'whitespace-separates-paragraphs': False,
             }
         return super(Sources, cls).iter_paragraphs(
-            sequence, fields, use_apt_pkg, shared_storage, encoding, strict)
+            sequence, fields, use_apt_pkg, shared_storage, encoding, strict,
+            predicate)
 
 
 class Packages(Deb822):
@@ -1946,6 +2118,7 @@ class Packages(Deb822):
                         shared_storage=False,  # type: bool
                         encoding="utf-8",      # type: str
                         strict=None,           # type: Optional[Dict]
+                        predicate=None,        # type: Optional[Callable[[Mapping[str, str]], bool]]
                        ):
         # type: (...) -> Iterator
         """Generator that yields a Deb822 object for each paragraph in Packages.
@@ -1960,7 +2133,8 @@ class Packages(Deb822):
                 'whitespace-separates-paragraphs': False,
             }
         return super(Packages, cls).iter_paragraphs(
-            sequence, fields, use_apt_pkg, shared_storage, encoding, strict)
+            sequence, fields, use_apt_pkg, shared_storage, encoding, strict,
+            predicate)
 
 
 class _ClassInitMeta(type):
@@ -2012,8 +2186,7 @@ class RestrictedField(collections.namedtuple(
             allow_none=allow_none)
 
 
-@six.add_metaclass(_ClassInitMeta)
-class RestrictedWrapper(object):
+class RestrictedWrapper(metaclass=_ClassInitMeta):
     """Base class to wrap a Deb822 object, restricting write access to some keys.
 
     The underlying data is hidden internally.  Subclasses may keep a reference
@@ -2169,6 +2342,8 @@ class Removals(Deb822):
     def date(self):
         # type: () -> datetime.datetime
         """ a datetime object for the removal action """
+        # pylint: disable=import-outside-toplevel
+        import email.utils
         timearray = email.utils.parsedate_tz(self['date'])
         if timearray is None:
             raise ValueError("No date specified")
@@ -2309,33 +2484,292 @@ class _CaseInsensitiveString(str):
 _strI = _CaseInsensitiveString
 
 
+# The codecs which decode ASCII as fast as a check that the data is ASCII.
+_FAST_CODECS = frozenset(['utf-8', 'ascii', 'iso8859-1'])
+_ASCII_BYTES = bytes(bytearray(range(128)))
+_NON_ASCII_RE = re.compile(b'[\x80-\xff]')
+
+
 class _AutoDecoder(object):
+    """Decode byte strings in the given encoding, falling back to guessing
+    the encoding with chardet for the values that are not in it.
+
+    A decoder is meant to be shared by all the paragraphs of a stream, so it
+    never gives up its encoding: the values which cannot be decoded with it
+    are decoded with the encoding guessed for them, and the guesses are cached
+    by the non-ASCII bytes of the values, since the same names (of
+    maintainers, typically) keep coming back in a file.
+    """
+
+    # The number of bytes chardet is given to guess an encoding.
+    DETECT_SAMPLE = 4096
+    # The number of guesses a decoder remembers.
+    FALLBACK_CACHE_SIZE = 256
 
     def __init__(self, encoding=None):
         # type: (Optional[str]) -> None
         self.encoding = encoding or 'UTF-8'
+        self._fallbacks = {}  # type: Dict[bytes, str]
+        try:
+            self._ascii_fast_path = \
+                codecs.lookup(self.encoding).name not in _FAST_CODECS \
+                and 'a'.encode(self.encoding) == b'a'
+        except LookupError:
+            self._ascii_fast_path = False
 
     def decode(self, value):
         # type: (Union[str, bytes]) -> str
         """If value is not already Unicode, decode it intelligently."""
         if isinstance(value, bytes):
+            if self._ascii_fast_path and value.isascii():
+                return value.decode('ascii')
             try:
                 return value.decode(self.encoding)
             except UnicodeDecodeError as e:
-                # Evidently, the value wasn't encoded with the encoding the
-                # user specified.  Try detecting it.
-                warnings.warn('decoding from %s failed; attempting to detect '
-                              'the true encoding' % self.encoding,
-                              UnicodeWarning)
-                result = chardet.detect(value)
-                try:
-                    return value.decode(result['encoding'])
-                except UnicodeDecodeError:
-                    raise e
-                else:
-                    # Assume the rest of the paragraph is in this encoding as
-                    # well (there's no sense in repeating this exercise for
-                    # every field).
-                    self.encoding = result['encoding']
+                return self._decode_fallback(value, e)
         else:
             return value
+
+    def _decode_fallback(self, value, error):
+        # type: (bytes, UnicodeDecodeError) -> str
+        """Decode value, which is not in the encoding of the decoder."""
+        pattern = value.translate(None, _ASCII_BYTES)[:self.DETECT_SAMPLE]
+        encoding = self._cached_fallback(pattern)
+        if encoding is not None:
+            try:
+                return value.decode(encoding)
+            except UnicodeDecodeError:
+                # The pattern leaves out the ASCII bytes, which multibyte
+                # encodings use too, and is cut at DETECT_SAMPLE bytes, so
+                # the cached guess may not fit this value.
+                pass
+
+        # Evidently, the value wasn't encoded with the encoding the
+        # user specified.  Try detecting it.
+        warnings.warn('decoding from %s failed; attempting to detect '
+                      'the true encoding' % self.encoding,
+                      UnicodeWarning)
+        encoding = self._detect(value)
+        try:
+            result = value.decode(encoding)
+        except (UnicodeDecodeError, LookupError, TypeError):
+            raise error
+        if pattern not in self._fallbacks and \
+                len(self._fallbacks) >= self.FALLBACK_CACHE_SIZE:
+            del self._fallbacks[next(iter(self._fallbacks))]
+        self._fallbacks[pattern] = encoding
+        return result
+
+    def _cached_fallback(self, pattern):
+        # type: (bytes) -> Optional[str]
+        return self._fallbacks.get(pattern)
+
+    @classmethod
+    def _detect(cls, value):
+        # type: (bytes) -> str
+        """Guess the encoding of value with chardet, looking at no more than
+        DETECT_SAMPLE bytes from a little before the first non-ASCII byte.
+        """
+        match = _NON_ASCII_RE.search(value)
+        start = max(0, match.start() - 64) if match else 0
+        sample = value[start:start + cls.DETECT_SAMPLE]
+        # pylint: disable=import-outside-toplevel
+        import chardet  # type: ignore
+        return chardet.detect(sample)['encoding']
+
+
+# Instrumentation
+# ===============
+#
+# The counters below tell how much work the parser does and how often it
+# takes its slow paths.  They are off by default: enable_instrumentation()
+# replaces the methods involved with counting wrappers and
+# disable_instrumentation() puts the original methods back, so the parser
+# pays nothing for the counters while they are off.  The counts are not
+# synchronised between threads, so they may be slightly off when several
+# threads parse at once.
+
+INSTRUMENTATION_COUNTERS = (
+    'paragraphs',           # paragraphs yielded by the iter_paragraphs methods
+    'lines',                # lines scanned by the internal parser
+    'apt_sections',         # sections read by apt_pkg and wrapped
+    'decodes',              # byte strings decoded
+    'bytes_decoded',        # bytes in those strings
+    'fallback_decodes',     # values not in the encoding of their decoder
+    'fallback_cache_hits',  # fallbacks which did not need chardet
+    'chardet_fallbacks',    # fallbacks which had to guess the encoding
+    'value_decodes',        # field values decoded by Deb822Dict lookups
+    'relation_parses',      # relationship fields parsed
+    'relation_cache_hits',  # relations lookups answered by the cache
+)
+
+_counters = dict.fromkeys(INSTRUMENTATION_COUNTERS, 0)  # type: Dict[str, int]
+_originals = []  # type: List[Tuple[type, str, Any]]
+
+
+def _counting(counter):
+    # type: (str) -> Callable[[Callable], Callable]
+    def wrap(func):
+        # type: (Callable) -> Callable
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            _counters[counter] += 1
+            return func(*args, **kwargs)
+        return wrapper
+    return wrap
+
+
+def _counting_items(counter):
+    # type: (str) -> Callable[[Callable], Callable]
+    def wrap(func):
+        # type: (Callable) -> Callable
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            for item in func(*args, **kwargs):
+                _counters[counter] += 1
+                yield item
+        return wrapper
+    return wrap
+
+
+def _counting_hits(counter):
+    # type: (str) -> Callable[[Callable], Callable]
+    def wrap(func):
+        # type: (Callable) -> Callable
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            result = func(*args, **kwargs)
+            if result is not None:
+                _counters[counter] += 1
+            return result
+        return wrapper
+    return wrap
+
+
+def _counting_decode(func):
+    # type: (Callable) -> Callable
+    @functools.wraps(func)
+    def wrapper(self, value):
+        if isinstance(value, bytes):
+            _counters['decodes'] += 1
+            _counters['bytes_decoded'] += len(value)
+        return func(self, value)
+    return wrapper
+
+
+def _counting_relations(func):
+    # type: (Callable) -> Callable
+    @functools.wraps(func)
+    def wrapper(self):
+        # pylint: disable=protected-access
+        if self._PkgRelationMixin__parsed_relations:
+            _counters['relation_cache_hits'] += 1
+        return func(self)
+    return wrapper
+
+
+_INSTRUMENTED = (
+    (Deb822, 'iter_paragraphs', _counting_items('paragraphs')),
+    (Deb822, '_skip_useless_lines', _counting_items('lines')),
+    (TagSectionWrapper, '__init__', _counting('apt_sections')),
+    (_AutoDecoder, 'decode', _counting_decode),
+    (_AutoDecoder, '_decode_fallback', _counting('fallback_decodes')),
+    (_AutoDecoder, '_cached_fallback', _counting_hits('fallback_cache_hits')),
+    (_AutoDecoder, '_detect', _counting('chardet_fallbacks')),
+    (Deb822Dict, '__getitem__', _counting('value_decodes')),
+    (PkgRelation, 'parse_relations', _counting('relation_parses')),
+    (_PkgRelationMixin, 'relations', _counting_relations),
+)
+
+
+def _instrumented():
+    # type: () -> Tuple[Tuple[type, str, Callable[[Callable], Callable]], ...]
+    # The index files parse their paragraphs without Deb822.iter_paragraphs,
+    # so their own generators are counted too.  They are built on top of this
+    # module, hence the import on use.
+    # pylint: disable=import-outside-toplevel
+    from appleseed import AlpineIndexFile, DebianIndexFile
+    return _INSTRUMENTED + (
+        (AlpineIndexFile, 'iter_paragraphs', _counting_items('paragraphs')),
+        (DebianIndexFile, 'iter_paragraphs', _counting_items('paragraphs')),
+    )
+
+
+def instrumentation_enabled():
+    # type: () -> bool
+    """Return whether the parser counters are enabled."""
+    return bool(_originals)
+
+
+def enable_instrumentation():
+    # type: () -> None
+    """Start counting the work done by the parser.
+
+    The counters keep their values; see reset_instrumentation().
+    """
+    if _originals:
+        return
+
+    for owner, name, wrap in _instrumented():
+        original = owner.__dict__[name]
+        if isinstance(original, classmethod):
+            wrapped = classmethod(wrap(original.__func__))  # type: Any
+        elif isinstance(original, staticmethod):
+            wrapped = staticmethod(wrap(original.__func__))
+        elif isinstance(original, property):
+            wrapped = property(wrap(original.fget), original.fset,
+                               original.fdel, original.__doc__)
+        else:
+            wrapped = wrap(original)
+        _originals.append((owner, name, original))
+        setattr(owner, name, wrapped)
+
+
+def disable_instrumentation():
+    # type: () -> None
+    """Stop counting, restoring the uninstrumented methods."""
+    while _originals:
+        owner, name, original = _originals.pop()
+        setattr(owner, name, original)
+
+
+def reset_instrumentation():
+    # type: () -> None
+    """Set all the counters to zero."""
+    for counter in _counters:
+        _counters[counter] = 0
+
+
+def instrumentation_snapshot():
+    # type: () -> Dict[str, int]
+    """Return a copy of the counters."""
+    return dict(_counters)
+
+
+@contextlib.contextmanager
+def instrumentation():
+    # type: () -> Iterator[Dict[str, int]]
+    """Count the work done by the parser in a with block.
+
+    The yielded dict is filled with the counts of the block when it exits::
+
+        >>> with instrumentation() as counts:
+        ...     for p in Packages.iter_paragraphs(f):
+        ...         pass
+        >>> counts['paragraphs']
+
+    The counters are enabled for the duration of the block only, unless they
+    were already enabled.
+    """
+    was_enabled = instrumentation_enabled()
+    enable_instrumentation()
+    before = instrumentation_snapshot()
+    counts = {}  # type: Dict[str, int]
+    try:
+        yield counts
+    finally:
+        after = instrumentation_snapshot()
+        counts.update((counter, after[counter] - before[counter])
+                      for counter in INSTRUMENTATION_COUNTERS)
+        if not was_enabled:
+            disable_instrumentation()
@@ -19,6 +19,7 @@
 
 from __future__ import absolute_import, print_function
 
+import collections
 import os
 import os.path
 import re
@@ -27,12 +28,14 @@ try:
     # pylint: disable=unused-import
     from typing import (
         Any,
+        Callable,
         Dict,
         Iterator,
         List,
         Optional,
         Pattern,
         Text,
+        Tuple,
         Union,
     )
 except ImportError:
@@ -67,6 +70,23 @@ except ImportError:
                 " may not be linked with this library due to license"
                 " incompatibilities")
 
+# The SHA256 of the full downloads, as listed in the Release files, comes
+# from the built-in extension too (_sha2 since Python 3.12).
+try:
+    import _sha256    # type: ignore
+    new_sha256 = _sha256.sha256
+except ImportError:
+    try:
+        import _sha2    # type: ignore
+        new_sha256 = _sha2.sha256
+    except ImportError:
+        def new_sha256(*args):    # pylint: disable=unused-argument
+            raise NotImplementedError(
+                "Built-in sha256 implementation not found; cannot use hashlib"
+                " implementation because it depends on OpenSSL, which"
+                " may not be linked with this library due to license"
+                " incompatibilities")
+
 
 class ParseError(Exception):
     """An exception which is used to signal a parse failure.
@@ -80,7 +100,7 @@ class ParseError(Exception):
     """
 
     def __init__(self, filename, lineno, msg):
-        assert isinstance(int, lineno)
+        assert isinstance(lineno, int)
         self.filename = filename
         self.lineno = lineno
         self.msg = msg
@@ -370,6 +390,58 @@ def version_compare(a, b):
     return 0
 
 
+_re_version_part = re.compile(r"(\D*)(\d*)")
+
+# The code marking the end of a run of non-digits in version_sort_key. It has
+# to be greater than the code of '~' and less than the code of anything else.
+_VERSION_KEY_END = "001"
+
+
+def _version_key_number(digits):
+    # type: (str) -> str
+    digits = digits.lstrip("0")
+    return "%02x%s" % (len(digits), digits)
+
+
+def _version_key_part(part):
+    # type: (str) -> str
+    pairs = [m.groups() for m in _re_version_part.finditer(part)]
+    # The digits and non-digits missing at the end of a part compare as 0 and
+    # as an empty string respectively.  The first pair is always kept so that
+    # the key of every part starts the same way.
+    while len(pairs) > 1 and not pairs[-1][0] and not pairs[-1][1].strip("0"):
+        pairs.pop()
+
+    key = []
+    for chars, digits in pairs:
+        for c in chars:
+            if c == "~":
+                key.append("000")
+            elif c.isalpha():
+                key.append("%03x" % ord(c))
+            else:
+                key.append("%03x" % (ord(c) + 256))
+        key.append(_VERSION_KEY_END)
+        key.append(_version_key_number(digits))
+    key.append(_VERSION_KEY_END)
+    return "".join(key)
+
+
+def version_sort_key(version):
+    # type: (Union[str, BaseVersion]) -> str
+    """Returns a string which sorts like version in the dpkg order
+
+    Comparing the keys of two versions as plain strings gives the same result
+    as version_compare, so the key can be stored in a database and indexed.
+    Raises ValueError if version is not a valid Debian version.
+    """
+    if not isinstance(version, BaseVersion):
+        version = BaseVersion(version)
+    return (_version_key_number(version.epoch or "0") +
+            _version_key_part(version.upstream_version) +
+            _version_key_part(version.debian_revision or "0"))
+
+
 class PackageFile:
     """A Debian package file.
 
@@ -379,6 +451,9 @@ class PackageFile:
     re_field = re.compile(r'^([A-Za-z][A-Za-z0-9-_]+):(?:\s*(.*?))?\s*$')
     re_continuation = re.compile(r'^\s+(?:\.|(\S.*?)\s*)$')
 
+    # The file is read in blocks of this many bytes.
+    block_size = 1 << 16
+
     def __init__(self, name, file_obj=None, encoding="utf-8"):
         """Creates a new package file object.
 
@@ -393,38 +468,73 @@ class PackageFile:
         self.lineno = 0
         self.encoding = encoding
 
+    def _iter_lines(self):
+        # type: () -> Iterator[Tuple[str, bool]]
+        """Yields (line, terminated) pairs, reading the file in blocks.
+
+        The lines are decoded and stripped of their newlines; terminated is
+        False only for a last line that has no newline.
+        """
+        pending = b''
+        while True:
+            data = self.file.read(self.block_size)
+            if not data:
+                break
+            if pending:
+                data = pending + data
+            end = data.rfind(b'\n') + 1
+            if not end:
+                pending = data
+                continue
+            pending = data[end:]
+            lines = data[:end].decode(self.encoding).split('\n')
+            lines.pop()
+            for line in lines:
+                yield (line, True)
+        if pending:
+            yield (pending.decode(self.encoding), False)
+
     def __iter__(self):
-        line = self.file.readline().decode(self.encoding)
-        self.lineno += 1
+        re_field_match = self.re_field.match
+        lineno = self.lineno
         pkg = []
-        while line:
-            if line.strip(' \t') == '\n':
+        name = None
+        contents = []    # type: List[str]
+
+        for (line, terminated) in self._iter_lines():
+            lineno += 1
+
+            if name is not None:
+                # Same as matching re_continuation, without the regex.
+                if line[:1].isspace():
+                    stripped = line.strip()
+                    if stripped:
+                        # Only a lone dot stands for an empty line; a dot
+                        # followed by whitespace is kept.
+                        contents.append("" if line.lstrip() == "." else stripped)
+                        continue
+                pkg.append((name, "\n".join(contents)))
+                name = None
+
+            if terminated and not line.strip(' \t'):
+                self.lineno = lineno
                 if not pkg:
                     self.raise_syntax_error('expected package record')
                 yield pkg
                 pkg = []
-                line = self.file.readline().decode(self.encoding)
-                self.lineno += 1
                 continue
 
-            match = self.re_field.match(line)
+            match = re_field_match(line)
             if not match:
+                self.lineno = lineno
                 self.raise_syntax_error("expected package field")
-            (name, contents) = match.groups()
-            contents = contents or ''
+            (name, first) = match.groups()
+            contents = [first or '']
 
-            while True:
-                line = self.file.readline().decode(self.encoding)
-                self.lineno += 1
-                match = self.re_continuation.match(line)
-                if match:
-                    (ncontents,) = match.groups()
-                    if ncontents is None:
-                        ncontents = ""
-                    contents = "%s\n%s" % (contents, ncontents)
-                else:
-                    break
-            pkg.append((name, contents))
+        if name is not None:
+            pkg.append((name, "\n".join(contents)))
+        # Account for the read hitting the end of the file.
+        self.lineno = lineno + 1
         if pkg:
             yield pkg
 
@@ -607,62 +717,412 @@ def patch_lines(lines, patches):
 patchLines = function_deprecated_by(patch_lines)
 
 
-def replace_file(lines, local):
-    # type: (List[str], str) -> None
+ChangeSet = collections.namedtuple('ChangeSet', 'added changed removed')
+
+
+class ChangeTracker(object):
+    """Records which lines of a file a series of patches touched.
+
+    The file is modelled as a list of segments, each either a run of lines
+    carried over from the original file or a run of lines introduced by a
+    patch.  Deletions leave an empty run behind, so the place where lines
+    vanished is still known.  Pass an instance to update_file and call
+    changes() afterwards.
+    """
+
+    re_key = re.compile(r'^Package:\s*(\S+)', re.IGNORECASE)
+
+    def __init__(self):
+        # type: () -> None
+        self.old_lines = []     # type: List[str]
+        self.valid = False
+        # (first line in the original file or None, number of lines)
+        self._segments = []     # type: List[Tuple[Optional[int], int]]
+
+    def start(self, lines):
+        # type: (List[str]) -> None
+        self.old_lines = list(lines)
+        self.valid = True
+        self._segments = [(0, len(lines))]
+
+    def invalidate(self):
+        # type: () -> None
+        """Marks the changes as unknown, e.g. after a full download."""
+        self.valid = False
+        self.old_lines = []
+        self._segments = []
+
+    def patch_lines(self, lines, patches):
+        # type: (List[str], Iterator) -> None
+        """Applies patches to lines like patch_lines and records them."""
+        for (first, last, args) in patches:
+            lines[first:last] = args
+            self._record(first, last, len(args))
+
+    def _record(self, first, last, count):
+        # type: (int, int, int) -> None
+        before = []    # type: List[Tuple[Optional[int], int]]
+        after = []     # type: List[Tuple[Optional[int], int]]
+        pos = 0
+        for (origin, length) in self._segments:
+            end = pos + length
+            if pos < first or (pos == first and end == first):
+                head = min(end, first) - pos
+                before.append((origin, head))
+            if end > last:
+                skip = max(pos, last) - pos
+                after.append((origin if origin is None else origin + skip,
+                              length - skip))
+            pos = end
+
+        if before and before[-1][0] is None:
+            count += before.pop()[1]
+        if after and after[0][0] is None:
+            count += after.pop(0)[1]
+        self._segments = before + [(None, count)] + after
+
+    def _regions(self, lines):
+        # type: (List[str]) -> List[Tuple[int, int, int, int]]
+        """Returns the regions of the file touched by the patches.
+
+        Every region is widened to blank lines carried over from the
+        original file, so that it covers whole paragraphs both before and
+        after patching.  Regions are (first, last, old_first, old_last)
+        tuples of line indexes into the new and the original file.
+        """
+        # pylint: disable=import-outside-toplevel
+        import bisect
+
+        starts = []
+        pos = 0
+        for (_, length) in self._segments:
+            starts.append(pos)
+            pos += length
+
+        def origin_of(i):
+            # type: (int) -> Optional[int]
+            k = bisect.bisect_right(starts, i) - 1
+            origin = self._segments[k][0]
+            return None if origin is None else origin + i - starts[k]
+
+        def anchor(i):
+            # type: (int) -> bool
+            return not lines[i].strip() and origin_of(i) is not None
+
+        regions = []    # type: List[Tuple[int, int, int, int]]
+        for (k, (origin, length)) in enumerate(self._segments):
+            if origin is not None:
+                continue
+            first = starts[k]
+            last = first + length
+            if regions and first <= regions[-1][1]:
+                first = regions.pop()[0]
+            while first > 0 and not anchor(first - 1):
+                first -= 1
+            while last < len(lines) and not anchor(last):
+                last += 1
+
+            old_first = 0 if first == 0 else origin_of(first - 1) + 1
+            old_last = len(self.old_lines) if last == len(lines) \
+                else origin_of(last)
+            regions.append((first, last, old_first, old_last))
+        return regions
+
+    @classmethod
+    def _paragraphs(cls, lines):
+        # type: (List[str]) -> Dict[str, str]
+        """Returns the paragraphs in lines, keyed by package."""
+        paragraphs = {}
+        i = 0
+        while i < len(lines):
+            if not lines[i].strip():
+                i += 1
+                continue
+            start = i
+            while i < len(lines) and lines[i].strip():
+                i += 1
+            text = ''.join(lines[start:i])
+            match = cls.re_key.match(text)
+            if match:
+                paragraphs[match.group(1)] = text
+        return paragraphs
+
+    def changes(self, lines):
+        # type: (List[str]) -> Optional[ChangeSet]
+        """Returns the packages added, changed and removed by the patches.
+
+        lines - the patched lines
+
+        Each member of the change set maps package names to the text of
+        their paragraphs (the old text for removed packages).  None is
+        returned if the changes are not known.
+        """
+        if not self.valid:
+            return None
+
+        old = {}    # type: Dict[str, str]
+        new = {}    # type: Dict[str, str]
+        for (first, last, old_first, old_last) in self._regions(lines):
+            old.update(self._paragraphs(self.old_lines[old_first:old_last]))
+            new.update(self._paragraphs(lines[first:last]))
+
+        added = {}
+        changed = {}
+        for (name, text) in new.items():
+            if name not in old:
+                added[name] = text
+            elif old[name] != text:
+                changed[name] = text
+        removed = dict((name, text) for (name, text) in old.items()
+                       if name not in new)
+        return ChangeSet(added, changed, removed)
+
+
+def _sha1_cache_name(local):
+    # type: (str) -> str
+    return local + '.sha1'
+
+
+def read_cached_sha1(local):
+    # type: (str) -> Optional[str]
+    """Returns the cached SHA1 of the local file, if it is still valid.
+
+    The cache is keyed by the size and modification time of the file, so
+    it is ignored as soon as the file is changed by something else.
+    """
+    try:
+        st = os.stat(local)
+        with open(_sha1_cache_name(local)) as cache_file:
+            (size, mtime_ns, digest) = cache_file.read().split()
+    except (IOError, ValueError):
+        return None
+
+    if int(size) != st.st_size or int(mtime_ns) != st.st_mtime_ns:
+        return None
+    return digest
+
+
+def write_cached_sha1(local, digest):
+    # type: (str, str) -> None
+    st = os.stat(local)
+    with open(_sha1_cache_name(local), 'w') as cache_file:
+        cache_file.write("%d %d %s\n" % (st.st_size, st.st_mtime_ns, digest))
+
+
+def replace_file(lines, local, expected_sha1=None):
+    # type: (List[str], str, Optional[str]) -> str
+    """Atomically replaces the local file with lines.
+
+    The lines are hashed while they are written, and the file is left
+    untouched if expected_sha1 is given and does not match.  The hash is
+    cached alongside the file (see read_cached_sha1).
+
+    Returns the SHA1 of the new contents.
+    """
     local_new = local + '.new'
-    new_file = open(local_new, 'w+')
+    new_file = open(local_new, 'wb')
+    m = new_sha1()
 
     try:
         for l in lines:
-            new_file.write(l)
+            b = l.encode("UTF-8")
+            m.update(b)
+            new_file.write(b)
         new_file.close()
+
+        new_hash = m.hexdigest()
+        if expected_sha1 is not None and new_hash != expected_sha1:
+            raise ValueError("patch failed, got %s instead of %s"
+                             % (new_hash, expected_sha1))
+
         os.rename(local_new, local)
     finally:
+        new_file.close()
         if os.path.exists(local_new):
             os.unlink(local_new)
 
+    write_cached_sha1(local, new_hash)
+    return new_hash
+
 
 replaceFile = function_deprecated_by(replace_file)
 
 
-def download_gunzip_lines(remote):
-    # type: (Text) -> List[bytes]
-    """Downloads a file from a remote location and gunzips it.
+# Number of pdiff patches fetched concurrently by update_file.
+PDIFF_WORKERS = 4
 
-    Returns the lines in the file."""
+_CHUNK_SIZE = 64 * 1024
+
+_REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+
+class _ConnectionPool(object):
+    """Keeps one persistent HTTP connection per thread and mirror host.
+
+    URLs with schemes other than http and https are opened with urlopen.
+    """
+
+    def __init__(self, timeout=60):
+        # type: (int) -> None
+        # pylint: disable=import-outside-toplevel
+        import threading
+
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._all = []    # type: List[Any]
+
+    def _connection(self, scheme, netloc, fresh=False):
+        # type: (str, str, bool) -> Any
+        # pylint: disable=import-outside-toplevel
+        import http.client
+
+        conns = self._local.__dict__.setdefault('conns', {})
+        conn = conns.get((scheme, netloc))
+        if conn is not None and not fresh:
+            return conn
+        if conn is not None:
+            conn.close()
+
+        if scheme == 'https':
+            conn = http.client.HTTPSConnection(netloc, timeout=self.timeout)
+        else:
+            conn = http.client.HTTPConnection(netloc, timeout=self.timeout)
+        conns[(scheme, netloc)] = conn
+        with self._lock:
+            self._all.append(conn)
+        return conn
+
+    def open(self, url):
+        # type: (str) -> Any
+        """Returns a file-like response for url, following redirects."""
+        # pylint: disable=import-outside-toplevel
+        import http.client
+        from urllib.parse import urljoin, urlsplit
+        from urllib.request import urlopen
+
+        for _ in range(5):
+            parts = urlsplit(url)
+            if parts.scheme not in ('http', 'https'):
+                return urlopen(url)
+
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+
+            # A kept-alive connection may have been closed by the server in
+            # the meantime, so retry once on a fresh one.
+            for attempt in (0, 1):
+                conn = self._connection(parts.scheme, parts.netloc,
+                                        fresh=attempt > 0)
+                try:
+                    conn.request('GET', path)
+                    response = conn.getresponse()
+                    break
+                except (http.client.HTTPException, ConnectionError):
+                    if attempt:
+                        raise
 
-    # The implementation is rather crude, but it seems that the gzip
-    # module needs a real file for input.
+            if response.status in _REDIRECT_STATUSES:
+                response.read()
+                url = urljoin(url, response.getheader('Location'))
+                continue
+            if response.status != 200:
+                response.read()
+                raise IOError("%s: HTTP error %d %s"
+                              % (url, response.status, response.reason))
+            return response
+
+        raise IOError("%s: too many redirects" % url)
+
+    def close(self):
+        # type: () -> None
+        with self._lock:
+            for conn in self._all:
+                conn.close()
+            self._all = []
 
-   # pylint: disable=import-outside-toplevel
-    import gzip
-    import tempfile
-    # pylint: disable=import-error
-    from six.moves.urllib.request import urlretrieve  # type: ignore
 
-    (handle, fname) = tempfile.mkstemp()
+def _fetch_gunzip_lines(remote, pool=None, raw_hash=None):
+    # type: (Text, Optional[_ConnectionPool], Optional[Any]) -> Tuple[List[bytes], str]
+    """Downloads a gzipped file and gunzips it in memory as it arrives.
+
+    raw_hash, if given, is a hash object updated with the gzipped data.
+
+    Returns the lines in the file and the SHA1 of its uncompressed contents.
+    """
+
+    # pylint: disable=import-outside-toplevel
+    import io
+    import zlib
+
+    gzip_wbits = 16 + zlib.MAX_WBITS
+    m = new_sha1()
+    decompressor = zlib.decompressobj(gzip_wbits)
+    chunks = []    # type: List[bytes]
+
+    # A pool made for this download alone is closed with it.
+    own_pool = pool is None
+    if own_pool:
+        pool = _ConnectionPool()
+    response = None
     try:
-        os.close(handle)
-        (filename, _) = urlretrieve(remote, fname)
-        gfile = gzip.GzipFile(filename)
-        lines = gfile.readlines()
-        gfile.close()
+        response = pool.open(remote)
+        while True:
+            data = response.read(_CHUNK_SIZE)
+            if not data:
+                break
+            if raw_hash is not None:
+                raw_hash.update(data)
+            while True:
+                out = decompressor.decompress(data)
+                m.update(out)
+                chunks.append(out)
+                # Concatenated gzip members are allowed.
+                if not (decompressor.eof and decompressor.unused_data):
+                    break
+                data = decompressor.unused_data
+                decompressor = zlib.decompressobj(gzip_wbits)
     finally:
-        os.unlink(fname)
-    return lines
+        if response is not None:
+            response.close()
+        if own_pool:
+            pool.close()
+
+    if not decompressor.eof:
+        raise IOError("%s: truncated gzip stream" % remote)
+
+    return (io.BytesIO(b''.join(chunks)).readlines(), m.hexdigest())
+
+
+def download_gunzip_lines(remote):
+    # type: (Text) -> List[bytes]
+    """Downloads a file from a remote location and gunzips it.
+
+    Returns the lines in the file."""
+
+    return _fetch_gunzip_lines(remote)[0]
 
 
 downloadGunzipLines = function_deprecated_by(download_gunzip_lines)
 
 
-def download_file(remote, local):
+def download_file(remote, local, expected_sha256=None):
     """Copies a gzipped remote file to the local system.
 
     remote - URL, without the .gz suffix
     local - name of the local file
+    expected_sha256 - SHA256 of the gzipped file, as listed in Release; the
+                      local file is left untouched if the download does
+                      not match
     """
 
-    lines = download_gunzip_lines(remote + '.gz')
+    raw_hash = new_sha256() if expected_sha256 is not None else None
+    (raw_lines, _) = _fetch_gunzip_lines(remote + '.gz', raw_hash=raw_hash)
+    if raw_hash is not None and raw_hash.hexdigest() != expected_sha256:
+        raise ValueError("%s.gz was garbled, got SHA256 %s instead of %s"
+                         % (remote, raw_hash.hexdigest(), expected_sha256))
+    lines = [l.decode('UTF-8') for l in raw_lines]
     replace_file(lines, local)
     return lines
 
@@ -670,29 +1130,93 @@ def download_file(remote, local):
 downloadFile = function_deprecated_by(download_file)
 
 
-def update_file(remote, local, verbose=None):
-    # type: (str, str, bool) -> List[str]
+# Estimated cost of a single patch on top of its size, in bytes.  It accounts
+# for the extra round trip to the mirror and for applying the ed script to
+# the in-memory copy of the file.
+PDIFF_PATCH_OVERHEAD = 16 * 1024
+
+
+def plan_update(patch_sizes, full_size, overhead=PDIFF_PATCH_OVERHEAD):
+    # type: (List[int], Optional[int], int) -> Tuple[bool, str]
+    """Decides whether patching is cheaper than downloading the full file.
+
+    patch_sizes - sizes of the patches that would have to be applied
+    full_size - size of the full download as listed in Release, or None
+                if it is not known
+    overhead - estimated cost of fetching and applying a single patch
+
+    Returns a (use_patches, reason) pair.
+    """
+
+    patch_cost = sum(patch_sizes) + overhead * len(patch_sizes)
+    if full_size is None:
+        return (True, "size of the full file is unknown, applying %d "
+                      "patches (%d bytes)" % (len(patch_sizes), patch_cost))
+
+    if patch_cost >= full_size:
+        return (False, "%d patches cost %d bytes, full download is %d bytes"
+                       % (len(patch_sizes), patch_cost, full_size))
+
+    return (True, "%d patches cost %d bytes, full download is %d bytes"
+                  % (len(patch_sizes), patch_cost, full_size))
+
+
+def update_file(remote, local, verbose=None, full_size=None,
+                workers=PDIFF_WORKERS, tracker=None, log=None, full_sha256=None):
+    # type: (str, str, bool, Optional[int], int, Optional[ChangeTracker], Optional[Callable], Optional[str]) -> List[str]
     """Updates the local file by downloading a remote patch.
 
+    remote - URL, without the .gz suffix
+    local - name of the local file
+    full_size - size of the full download (remote + '.gz') as listed in
+                Release; when given, the full file is downloaded instead
+                of the patches if that is cheaper (see plan_update)
+    workers - number of patches fetched concurrently
+    tracker - a ChangeTracker recording which lines the patches touched;
+              it is invalidated if the full file has to be downloaded
+    log - a callable the decision between the patches and the full
+          download is reported to, along with its reason; the decision is
+          printed if it is not given and verbose is set
+    full_sha256 - SHA256 of the full download as listed in Release; the full
+                  download is checked against it (see download_file)
+
     Returns a list of lines in the local file.
     """
 
+    def decide(message):
+        # type: (str) -> None
+        if log is not None:
+            log(message)
+        elif verbose:
+            print("update_file: " + message)
+
+    def full_download():
+        # type: () -> List[str]
+        if tracker is not None:
+            tracker.invalidate()
+        return download_file(remote, local, full_sha256)
+
     try:
         local_file = open(local)
     except IOError:
-        if verbose:
-            print("update_file: no local copy, downloading full file")
-        return download_file(remote, local)
+        decide("no local copy, downloading full file")
+        return full_download()
 
     lines = local_file.readlines()
     local_file.close()
-    local_hash = read_lines_sha1(lines)
+    if tracker is not None:
+        tracker.start(lines)
+    local_hash = read_cached_sha1(local)
+    if local_hash is None:
+        local_hash = read_lines_sha1(lines)
+        write_cached_sha1(local, local_hash)
     patches_to_apply = []    # type: List[str]
     patch_hashes = {}        # type: Dict[str, str]
+    patch_sizes = {}         # type: Dict[str, int]
+    download_sizes = {}      # type: Dict[str, int]
 
-    # pylint: disable=import-error
     # pylint: disable=import-outside-toplevel
-    from six.moves.urllib.request import urlopen
+    from urllib.request import urlopen
 
     index_name = remote + '.diff/Index'
 
@@ -704,21 +1228,18 @@ def update_file(remote, local, verbose=None):
     except ParseError:
         # FIXME: urllib does not raise a proper exception, so we parse
         # the error message.
-        if verbose:
-            print("update_file: could not interpret patch index file")
-        return download_file(remote, local)
+        decide("could not interpret patch index file, downloading full file")
+        return full_download()
     except IOError:
-        if verbose:
-            print("update_file: could not download patch index file")
-        return download_file(remote, local)
+        decide("could not download patch index file, downloading full file")
+        return full_download()
 
     for fields in index_fields:
         for (field, value) in fields:
             if field == 'SHA1-Current':
                 (remote_hash, _) = re_whitespace.split(value)
                 if local_hash == remote_hash:
-                    if verbose:
-                        print("update_file: local file is up-to-date")
+                    decide("local file is up-to-date")
                     return lines
                 continue
 
@@ -739,34 +1260,82 @@ def update_file(remote, local, verbose=None):
                 for entry in value.splitlines():
                     if entry == '':
                         continue
-                    (patch_hash, _, patch_name) = re_whitespace.split(entry)
+                    (patch_hash, patch_size, patch_name) = \
+                        re_whitespace.split(entry)
                     patch_hashes[patch_name] = patch_hash
+                    patch_sizes[patch_name] = int(patch_size)
+                continue
+
+            if field in ('SHA1-Download', 'SHA256-Download'):
+                # Sizes of the compressed patches, which is what actually
+                # goes over the wire.
+                for entry in value.splitlines():
+                    if entry == '':
+                        continue
+                    (_, download_size, download_name) = \
+                        re_whitespace.split(entry)
+                    if download_name.endswith('.gz'):
+                        download_sizes[download_name[:-3]] = int(download_size)
                 continue
 
             if verbose:
                 print("update_file: field %r ignored" % field)
 
     if not patches_to_apply:
-        if verbose:
-            print("update_file: could not find historic entry", local_hash)
-        return download_file(remote, local)
-
-    for patch_name in patches_to_apply:
-        if verbose:
-            print("update_file: downloading patch %r" % patch_name)
-        patch_contents = download_gunzip_lines(
-            remote + '.diff/' + patch_name + '.gz')
-        if read_lines_sha1(patch_contents) != patch_hashes[patch_name]:
+        decide("could not find historic entry %s, downloading full file"
+               % local_hash)
+        return full_download()
+
+    (use_patches, reason) = plan_update(
+        [download_sizes.get(name, patch_sizes.get(name, 0))
+         for name in patches_to_apply],
+        full_size)
+    decide("%s, %s" % (
+        "applying patches" if use_patches else "downloading full file",
+        reason))
+    if not use_patches:
+        return full_download()
+
+    pool = _ConnectionPool()
+
+    def fetch_patch(patch_name):
+        # type: (str) -> List[str]
+        (patch_contents, patch_hash) = _fetch_gunzip_lines(
+            remote + '.diff/' + patch_name + '.gz', pool)
+        if patch_hash != patch_hashes[patch_name]:
             raise ValueError("patch %r was garbled" % patch_name)
-        patch_contents_unicode = [p.decode('UTF-8') for p in patch_contents]
-        patch_lines(lines, patches_from_ed_script(patch_contents_unicode))
+        return [p.decode('UTF-8') for p in patch_contents]
 
-    new_hash = read_lines_sha1(lines)
-    if new_hash != remote_hash:
-        raise ValueError("patch failed, got %s instead of %s"
-                         % (new_hash, remote_hash))
+    # pylint: disable=import-outside-toplevel
+    from concurrent.futures import ThreadPoolExecutor
 
-    replace_file(lines, local)
+    # The whole chain is fetched concurrently, but the patches are still
+    # applied in order, each one as soon as it is available.
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        for patch_name in patches_to_apply:
+            if verbose:
+                print("update_file: downloading patch %r" % patch_name)
+            futures.append(executor.submit(fetch_patch, patch_name))
+
+        try:
+            for future in futures:
+                patches = patches_from_ed_script(future.result())
+                if tracker is not None:
+                    tracker.patch_lines(lines, patches)
+                else:
+                    patch_lines(lines, patches)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            # The patches being fetched still use the connections.
+            executor.shutdown(wait=True)
+            raise
+        finally:
+            pool.close()
+
+    # The result is verified while it is written out.
+    replace_file(lines, local, expected_sha1=remote_hash)
     return lines
 
 
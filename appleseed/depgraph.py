@@ -0,0 +1,568 @@
+"""The dependency graph of the packages of an index file.
+
+The graph is built once from the output of iter_paragraphs and answers "what does X depend
+on" and "what depends on X" in time proportional to the number of answers. Every name
+(of a package or of a virtual package) gets an integer id, the real packages coming first,
+and every relation type is kept in compressed sparse row form:
+
+    groups of package p:        group_offsets[package_offsets[p]:package_offsets[p + 1]]
+    alternatives of group g:    targets[group_offsets[g]:group_offsets[g + 1]]
+    packages related to name n: reverse_sources[reverse_offsets[n]:reverse_offsets[n + 1]]
+
+A group is a comma-separated part of a relation field and its alternatives are the names
+separated by |. The providers of a virtual package are the reverse of the provides
+relation. The version constraints and the architecture qualifiers are not kept: an index
+file holds one version of each package, and when it holds several, the latest one is
+taken.
+
+The graph can be saved to a single file which is loaded without parsing anything.
+
+A ClosureEngine answers "what is installed with these packages, and how large is it" over
+a graph. The closures are integer bitsets over the packages numbered in the topological
+order of the strongly connected components of the dependency graph, which keeps the
+closures of the packages low in the graph narrow. The closures of the components several
+others depend on are memoized, so that the closure of libc6 is computed for the first
+package which needs it and reused by the others.
+"""
+
+import array
+import collections
+import re
+import struct
+import sys
+import warnings
+
+from appleseed.debian_support import version_sort_key
+
+RELATIONS = ('pre-depends', 'depends', 'recommends', 'suggests', 'enhances', 'breaks',
+             'conflicts', 'replaces', 'provides')
+
+# The relations which make a package installed along with another one.
+INSTALL_RELATIONS = ('pre-depends', 'depends')
+
+# The memory a ClosureEngine may take for the closures it memoizes.
+CLOSURE_CACHE_BYTES = 64 * 1024 * 1024
+
+_MAGIC = b'ASDG'
+_VERSION = 1
+_HEADER = struct.Struct('<4sIIIIQQQ')
+
+# The name at the start of an alternative parse_relations has returned raw.
+_RAW_NAME_RE = re.compile(r'[^\s:(\[<]+')
+
+
+class DependencyGraphError(Exception):
+    pass
+
+
+def _name(alternative):
+    if 'archqual' in alternative:
+        return alternative['name']
+    match = _RAW_NAME_RE.match(alternative['name'].strip())
+    return match.group() if match else None
+
+
+def _le_bytes(arr):
+    if sys.byteorder == 'big':
+        arr = array.array(arr.typecode, arr)
+        arr.byteswap()
+    return arr.tobytes()
+
+
+class _ArrayReader:
+    def __init__(self, data, pos):
+        self._data = data
+        self.pos = pos
+
+    def read(self, count, typecode='I'):
+        arr = array.array(typecode)
+        end = self.pos + count * arr.itemsize
+        if end > len(self._data):
+            raise DependencyGraphError('the dependency graph file is truncated')
+        arr.frombytes(self._data[self.pos:end])
+        if sys.byteorder == 'big':
+            arr.byteswap()
+        self.pos = end
+        return arr
+
+    def read_strings(self, length, count):
+        end = self.pos + length
+        strings = self._data[self.pos:end].decode('utf-8').split('\n') if count else []
+        self.pos = end
+        return strings
+
+
+class Relation:
+    """One relation type of a DependencyGraph, in compressed sparse row form (see the
+    module docstring).
+    """
+
+    def __init__(self, package_offsets, group_offsets, targets, reverse_offsets,
+                 reverse_sources):
+        self.package_offsets = package_offsets
+        self.group_offsets = group_offsets
+        self.targets = targets
+        self.reverse_offsets = reverse_offsets
+        self.reverse_sources = reverse_sources
+
+    @classmethod
+    def build(cls, groups_by_package, names_count):
+        """Builds a relation from the list, indexed by package id, of the lists of groups of
+        name ids of every package.
+        """
+
+        package_offsets = array.array('I', [0])
+        group_offsets = array.array('I', [0])
+        targets = array.array('I')
+        counts = [0] * (names_count + 1)
+        for groups in groups_by_package:
+            for group in groups:
+                targets.extend(group)
+                group_offsets.append(len(targets))
+            package_offsets.append(len(group_offsets) - 1)
+            for name_id in {name_id for group in groups for name_id in group}:
+                counts[name_id + 1] += 1
+
+        # The reverse index is filled by counting sort, so that the sources of every name are
+        # in increasing order.
+        reverse_offsets = array.array('I', counts)
+        for i in range(names_count):
+            reverse_offsets[i + 1] += reverse_offsets[i]
+        reverse_sources = array.array('I', bytes(4 * reverse_offsets[-1]))
+        fill = array.array('I', reverse_offsets)
+        for package_id, groups in enumerate(groups_by_package):
+            for name_id in {name_id for group in groups for name_id in group}:
+                reverse_sources[fill[name_id]] = package_id
+                fill[name_id] += 1
+
+        return cls(package_offsets, group_offsets, targets, reverse_offsets, reverse_sources)
+
+    def groups(self, package_id):
+        """Returns the groups of alternatives (as arrays of name ids) of a package."""
+
+        group_offsets, targets = self.group_offsets, self.targets
+        return [targets[group_offsets[g]:group_offsets[g + 1]]
+                for g in range(self.package_offsets[package_id],
+                               self.package_offsets[package_id + 1])]
+
+    def sources(self, name_id):
+        """Returns the ids of the packages which have a relation to a name."""
+
+        return self.reverse_sources[self.reverse_offsets[name_id]:
+                                    self.reverse_offsets[name_id + 1]]
+
+    def arrays(self):
+        return (self.package_offsets, self.group_offsets, self.targets, self.reverse_offsets,
+                self.reverse_sources)
+
+
+class DependencyGraph:
+    """The relations between the packages of an index file.
+
+    The methods taking a name accept the name of a package or of a virtual package and
+    raise KeyError for an unknown name.
+    """
+
+    def __init__(self, names, packages_count, versions, installed_sizes, relations):
+        self.names = names
+        self.packages_count = packages_count
+        self.versions = versions
+        self.installed_sizes = installed_sizes  # in kibibytes, as in the index files
+        self.relations = relations  # relation type -> Relation
+        self.ids = {name: i for i, name in enumerate(names)}
+
+    @classmethod
+    def from_paragraphs(cls, paragraphs, relations=RELATIONS):
+        """Builds the graph of the given relation types (see RELATIONS) of paragraphs."""
+
+        # pylint: disable=import-outside-toplevel
+        from appleseed.deb822 import PkgRelation
+
+        relations = tuple(relation.lower() for relation in relations)
+        if 'provides' not in relations:
+            relations += ('provides', )
+
+        latest = {}  # name -> (version key, version, installed size, raw relations)
+        for paragraph in paragraphs:
+            name = paragraph['package']
+            version = paragraph.get('version', '')
+            try:
+                key = version_sort_key(version)
+            except ValueError:
+                key = ''
+            if name in latest and latest[name][0] >= key:
+                continue
+            raw = {relation: paragraph.get(relation) for relation in relations}
+            latest[name] = (key, version, paragraph.get('installed-size'), raw)
+
+        names = sorted(latest)
+        ids = {name: i for i, name in enumerate(names)}
+
+        def name_id(name):
+            try:
+                return ids[name]
+            except KeyError:
+                ids[name] = len(names)
+                names.append(name)
+                return ids[name]
+
+        packages_count = len(names)
+        versions = []
+        installed_sizes = array.array('I')
+        groups_by_relation = {relation: [] for relation in relations}
+        with warnings.catch_warnings():
+            # parse_relations warns about the alternatives it cannot parse.
+            warnings.simplefilter('ignore')
+            for name in names[:packages_count]:
+                _key, version, installed_size, raw = latest[name]
+                versions.append(version)
+                try:
+                    installed_sizes.append(int(installed_size))
+                except (TypeError, ValueError):
+                    installed_sizes.append(0)
+
+                for relation in relations:
+                    groups = []
+                    if raw[relation]:
+                        for alternatives in PkgRelation.parse_relations(raw[relation]):
+                            group = [name_id(name) for name in map(_name, alternatives)
+                                     if name]
+                            if group:
+                                groups.append(group)
+                    groups_by_relation[relation].append(groups)
+
+        return cls(names, packages_count, versions, installed_sizes,
+                   {relation: Relation.build(groups, len(names))
+                    for relation, groups in groups_by_relation.items()})
+
+    def __len__(self):
+        return self.packages_count
+
+    def __contains__(self, name):
+        return name in self.ids
+
+    def is_virtual(self, name):
+        """Returns whether a name is not the name of a real package."""
+
+        return self.ids[name] >= self.packages_count
+
+    def version(self, name):
+        return self.versions[self.ids[name]]
+
+    def installed_size(self, name):
+        return self.installed_sizes[self.ids[name]]
+
+    def dependencies(self, name, relation='depends'):
+        """Returns the groups of alternatives of a relation of a package as lists of names.
+        A virtual package has none.
+        """
+
+        package_id = self.ids[name]
+        if package_id >= self.packages_count:
+            return []
+        return [[self.names[target] for target in group]
+                for group in self.relations[relation].groups(package_id)]
+
+    def reverse_dependencies(self, name, relation='depends', through_provides=True):
+        """Returns the names of the packages which have a relation to name, in any
+        alternative. When through_provides is true, the relations to the virtual packages
+        name provides count as well.
+        """
+
+        name_id = self.ids[name]
+        sources = set(self.relations[relation].sources(name_id))
+        if through_provides and name_id < self.packages_count:
+            for group in self.relations['provides'].groups(name_id):
+                for virtual_id in group:
+                    sources.update(self.relations[relation].sources(virtual_id))
+        return sorted(self.names[source] for source in sources)
+
+    def providers(self, name):
+        """Returns the names of the real packages which provide name."""
+
+        return [self.names[source]
+                for source in self.relations['provides'].sources(self.ids[name])]
+
+    def resolve_id(self, name_id):
+        """Returns the ids of the real packages which satisfy a relation to a name id: the
+        package itself if it is real, and its providers.
+        """
+
+        providers = self.relations['provides'].sources(name_id)
+        if name_id < self.packages_count:
+            return [name_id] + [provider for provider in providers if provider != name_id]
+        return list(providers)
+
+    def resolve(self, name):
+        """Returns the names of the real packages which satisfy a relation to name."""
+
+        return [self.names[package_id] for package_id in self.resolve_id(self.ids[name])]
+
+    def save(self, path):
+        names = '\n'.join(self.names).encode('utf-8')
+        versions = '\n'.join(self.versions).encode('utf-8')
+        relation_names = '\n'.join(self.relations).encode('utf-8')
+        with open(path, 'wb') as outfile:
+            outfile.write(_HEADER.pack(_MAGIC, _VERSION, len(self.names), self.packages_count,
+                                       len(self.relations), len(names), len(versions),
+                                       len(relation_names)))
+            outfile.write(names)
+            outfile.write(versions)
+            outfile.write(relation_names)
+            outfile.write(_le_bytes(self.installed_sizes))
+            for relation in self.relations.values():
+                for arr in relation.arrays():
+                    outfile.write(_le_bytes(arr))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as infile:
+            data = infile.read()
+
+        try:
+            (magic, version, names_count, packages_count, relations_count, names_len,
+             versions_len, relation_names_len) = _HEADER.unpack_from(data)
+        except struct.error as exc:
+            raise DependencyGraphError(f'{path} is truncated') from exc
+        if magic != _MAGIC or version != _VERSION:
+            raise DependencyGraphError(f'{path} is not a dependency graph file')
+
+        reader = _ArrayReader(data, _HEADER.size)
+        names = reader.read_strings(names_len, names_count)
+        versions = reader.read_strings(versions_len, packages_count)
+        relation_names = reader.read_strings(relation_names_len, relations_count)
+        installed_sizes = reader.read(packages_count)
+
+        relations = {}
+        for relation in relation_names:
+            package_offsets = reader.read(packages_count + 1)
+            group_offsets = reader.read(package_offsets[-1] + 1)
+            targets = reader.read(group_offsets[-1])
+            reverse_offsets = reader.read(names_count + 1)
+            reverse_sources = reader.read(reverse_offsets[-1])
+            relations[relation] = Relation(package_offsets, group_offsets, targets,
+                                           reverse_offsets, reverse_sources)
+
+        return cls(names, packages_count, versions, installed_sizes, relations)
+
+
+Footprint = collections.namedtuple('Footprint', ('packages', 'installed_size'))
+Footprint.__doc__ = """The names of the packages of a closure and the sum of their
+Installed-Size, in kibibytes."""
+
+
+def _bit_positions(bits):
+    digits = bin(bits)[:1:-1]
+    position = digits.find('1')
+    while position != -1:
+        yield position
+        position = digits.find('1', position + 1)
+
+
+def _components(successors):
+    """Returns the strongly connected components of a graph given as the list of the
+    successors of every node (Tarjan's algorithm, without recursion): the list of the
+    component of every node and the number of components. The components are numbered in
+    reverse topological order, so the successors of a component have smaller numbers.
+    """
+
+    count = len(successors)
+    index = [-1] * count
+    low = [0] * count
+    on_stack = [False] * count
+    component = [-1] * count
+    stack = []
+    visited = 0
+    components = 0
+    for root in range(count):
+        if index[root] != -1:
+            continue
+
+        index[root] = low[root] = visited
+        visited += 1
+        stack.append(root)
+        on_stack[root] = True
+        work = [(root, 0)]
+        while work:
+            node, i = work[-1]
+            if i < len(successors[node]):
+                work[-1] = (node, i + 1)
+                successor = successors[node][i]
+                if index[successor] == -1:
+                    index[successor] = low[successor] = visited
+                    visited += 1
+                    stack.append(successor)
+                    on_stack[successor] = True
+                    work.append((successor, 0))
+                elif on_stack[successor] and index[successor] < low[node]:
+                    low[node] = index[successor]
+                continue
+
+            work.pop()
+            if work and low[node] < low[work[-1][0]]:
+                low[work[-1][0]] = low[node]
+            if low[node] == index[node]:
+                while True:
+                    member = stack.pop()
+                    on_stack[member] = False
+                    component[member] = components
+                    if member == node:
+                        break
+                components += 1
+
+    return component, components
+
+
+class ClosureEngine:
+    """Computes the transitive closures of the relations (INSTALL_RELATIONS by default) of
+    the packages of a DependencyGraph.
+
+    Of every group of alternatives, the first satisfiable one is taken: the first
+    alternative which is a real package or, failing that, is provided by one (the first
+    provider is taken then). The groups none of whose alternatives is satisfiable (the
+    packages of another component or suite) are left out of the closures.
+    """
+
+    def __init__(self, graph, relations=INSTALL_RELATIONS, cache_bytes=CLOSURE_CACHE_BYTES):
+        self.graph = graph
+        packages_count = graph.packages_count
+        provides = graph.relations['provides']
+
+        successors = [[] for _ in range(packages_count)]
+        for relation in relations:
+            relation = graph.relations[relation]
+            package_offsets, group_offsets, targets = (relation.package_offsets,
+                                                       relation.group_offsets, relation.targets)
+            for package_id in range(packages_count):
+                chosen = successors[package_id]
+                for group in range(package_offsets[package_id], package_offsets[package_id + 1]):
+                    for target in targets[group_offsets[group]:group_offsets[group + 1]]:
+                        if target < packages_count:
+                            chosen.append(target)
+                            break
+                        providers = provides.sources(target)
+                        if providers:
+                            chosen.append(providers[0])
+                            break
+
+        component, components = _components(successors)
+        self._component = array.array('I', component)  # package id -> component
+
+        # The packages are renumbered by component, so that the members of a component have
+        # consecutive positions and a closure, which only holds the components numbered
+        # lower than its own, is a bitset no wider than the position of its last member.
+        # The packages most depended upon come first and have the narrowest closures.
+        self._offsets = array.array('I', bytes(4 * (components + 1)))
+        for component in self._component:
+            self._offsets[component + 1] += 1
+        for component in range(components):
+            self._offsets[component + 1] += self._offsets[component]
+        self._order = array.array('I', bytes(4 * packages_count))  # position -> package id
+        fill = array.array('I', self._offsets)
+        for package_id, component in enumerate(self._component):
+            self._order[fill[component]] = package_id
+            fill[component] += 1
+
+        successor_sets = [set() for _ in range(components)]
+        for package_id, component in enumerate(self._component):
+            for successor in successors[package_id]:
+                if self._component[successor] != component:
+                    successor_sets[component].add(self._component[successor])
+        del successors
+
+        self._successor_offsets = array.array('I', [0])
+        self._successors = array.array('I')
+        predecessors = array.array('I', bytes(4 * components))
+        for component_successors in successor_sets:
+            self._successors.extend(sorted(component_successors))
+            self._successor_offsets.append(len(self._successors))
+            for successor in component_successors:
+                predecessors[successor] += 1
+
+        # Only the closures of the components several others depend on are worth keeping:
+        # the closure of any other component is only walked through from its single
+        # predecessor. The cache stops growing once it takes cache_bytes.
+        self._shared = bytes(count > 1 for count in predecessors)
+        self._closures = {}  # shared component -> bitset of the positions of its closure
+        self._cache_bytes = cache_bytes
+        self._cached_bytes = 0
+
+    def _members(self, component):
+        first, end = self._offsets[component], self._offsets[component + 1]
+        return ((1 << (end - first)) - 1) << first
+
+    def _walk(self, components):
+        """Returns the bitset of the closure of components, using the memoized closures."""
+
+        closures, successors, offsets = self._closures, self._successors, self._successor_offsets
+        bits = 0
+        seen = set(components)
+        stack = list(seen)
+        while stack:
+            component = stack.pop()
+            closure = closures.get(component)
+            if closure is not None:
+                bits |= closure
+                continue
+
+            bits |= self._members(component)
+            for successor in successors[offsets[component]:offsets[component + 1]]:
+                if successor not in seen:
+                    seen.add(successor)
+                    stack.append(successor)
+        return bits
+
+    def _memoize(self, components):
+        """Memoizes the closures of the shared components reachable from components."""
+
+        closures, successors, offsets = self._closures, self._successors, self._successor_offsets
+        pending = []
+        seen = set(components)
+        stack = list(seen)
+        while stack:
+            component = stack.pop()
+            if component in closures:
+                continue
+            if self._shared[component]:
+                pending.append(component)
+            for successor in successors[offsets[component]:offsets[component + 1]]:
+                if successor not in seen:
+                    seen.add(successor)
+                    stack.append(successor)
+
+        # The successors of a component are numbered lower than it, so computing the
+        # closures in increasing order finds those of the shared successors memoized.
+        for component in sorted(pending):
+            if self._cached_bytes >= self._cache_bytes:
+                break
+            closure = self._walk((component, ))
+            closures[component] = closure
+            self._cached_bytes += closure.bit_length() // 8
+
+    def _resolve(self, name):
+        package_ids = self.graph.resolve_id(self.graph.ids[name])
+        if not package_ids:
+            raise KeyError(f'nothing provides {name}')
+        return package_ids[0]
+
+    def _positions(self, names):
+        components = {self._component[self._resolve(name)] for name in names}
+        self._memoize(components)
+        return _bit_positions(self._walk(components))
+
+    def closure(self, names):
+        """Returns the names of the packages of the closure of the packages (or virtual
+        packages) names. Raises KeyError if a name is unknown or is not provided by any
+        package.
+        """
+
+        return sorted(self.graph.names[self._order[position]]
+                      for position in self._positions(names))
+
+    def footprint(self, names):
+        """Returns the Footprint of the closure of names."""
+
+        graph = self.graph
+        package_ids = sorted(self._order[position] for position in self._positions(names))
+        return Footprint([graph.names[package_id] for package_id in package_ids],
+                         sum(graph.installed_sizes[package_id] for package_id in package_ids))
@@ -0,0 +1,265 @@
+"""A small language for filtering the paragraphs of the index files.
+
+An expression is made of comparisons of fields with values, combined with and, or, not and
+parentheses. For example,
+
+    section == utils and size < 100000 and not package ~ '^lib'
+    package not in (0ad, 0ad-data, flightgear)
+
+The comparison operators are ==, !=, <, <=, >, >=, ~ and !~ (the last two search the
+field for a regular expression), as well as in and not in followed by a parenthesized
+list of values. A value is either a word or a quoted string. When an unquoted value is an
+integer, the field is compared to it as a number. The field names are case-insensitive.
+A comparison involving a field which is missing in a paragraph (or which is not a number
+when it is compared to one) is false.
+
+compile_filter turns an expression into a Predicate, a callable which takes a mapping such
+as a Deb822 paragraph and returns whether it matches. The fields attribute of a predicate
+lists the fields it looks at, so that a parser can evaluate it before building the whole
+paragraph.
+"""
+
+import operator
+import re
+
+_TOKEN_RE = re.compile(r"""\s*(?:
+    (?P<op>==|!=|<=|>=|!~|<|>|~|\(|\)|,)
+    |(?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+    |(?P<word>[^\s()<>=!~,"']+)
+)""", re.VERBOSE)
+
+_INTEGER_RE = re.compile(r'^-?\d+$')
+
+_OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+_KEYWORDS = ('and', 'or', 'not', 'in')
+
+
+class FilterSyntaxError(ValueError):
+    def __init__(self, expression, pos, msg):
+        self.expression = expression
+        self.pos = pos
+        self.msg = msg
+        super().__init__(f'{msg} at position {pos} in {expression!r}')
+
+
+class Predicate:
+    """A compiled filter expression."""
+
+    def __init__(self, expression, func, fields):
+        self.expression = expression
+        self.fields = fields
+        self._func = func
+
+    def __call__(self, paragraph):
+        return self._func(paragraph)
+
+    def __repr__(self):
+        return f'Predicate({self.expression!r})'
+
+
+class _Token:
+    __slots__ = ('kind', 'value', 'pos')
+
+    def __init__(self, kind, value, pos):
+        self.kind = kind
+        self.value = value
+        self.pos = pos
+
+
+def _tokenize(expression):
+    tokens = []
+    pos = 0
+    while True:
+        match = _TOKEN_RE.match(expression, pos)
+        if match is None or match.end() == pos:
+            if expression[pos:].strip():
+                raise FilterSyntaxError(expression, pos, 'unexpected character')
+            break
+
+        start = match.start(match.lastindex)
+        pos = match.end()
+        if match.group('op'):
+            tokens.append(_Token('op', match.group('op'), start))
+        elif match.group('string'):
+            string = match.group('string')
+            tokens.append(_Token('string', re.sub(r'\\(.)', r'\1', string[1:-1]), start))
+        else:
+            word = match.group('word')
+            kind = 'keyword' if word.lower() in _KEYWORDS else 'word'
+            tokens.append(_Token(kind, word.lower() if kind == 'keyword' else word, start))
+
+    tokens.append(_Token('end', None, len(expression)))
+    return tokens
+
+
+def _comparison(field, op, value, numeric):
+    if op in ('~', '!~'):
+        search = re.compile(value).search
+        matches = op == '~'
+
+        def test(paragraph):
+            field_value = paragraph.get(field)
+            if field_value is None:
+                return False
+            return (search(field_value) is not None) == matches
+
+    elif numeric:
+        compare = _OPERATORS[op]
+        number = int(value)
+
+        def test(paragraph):
+            field_value = paragraph.get(field)
+            if field_value is None:
+                return False
+            try:
+                return compare(int(field_value), number)
+            except ValueError:
+                return False
+
+    else:
+        compare = _OPERATORS[op]
+
+        def test(paragraph):
+            field_value = paragraph.get(field)
+            if field_value is None:
+                return False
+            return compare(field_value, value)
+
+    return test
+
+
+def _membership(field, values, negated):
+    values = frozenset(values)
+
+    def test(paragraph):
+        field_value = paragraph.get(field)
+        if field_value is None:
+            return False
+        return (field_value in values) != negated
+
+    return test
+
+
+class _Parser:
+    def __init__(self, expression):
+        self._expression = expression
+        self._tokens = _tokenize(expression)
+        self._pos = 0
+        self.fields = set()
+
+    def _peek(self):
+        return self._tokens[self._pos]
+
+    def _next(self):
+        token = self._tokens[self._pos]
+        self._pos += 1
+        return token
+
+    def _error(self, token, msg):
+        return FilterSyntaxError(self._expression, token.pos, msg)
+
+    def _accept(self, kind, value=None):
+        token = self._peek()
+        if token.kind == kind and (value is None or token.value == value):
+            self._pos += 1
+            return token
+        return None
+
+    def _expect(self, kind, value=None):
+        token = self._accept(kind, value)
+        if token is None:
+            raise self._error(self._peek(), f'expected {value or kind}')
+        return token
+
+    def parse(self):
+        func = self._or()
+        token = self._peek()
+        if token.kind != 'end':
+            raise self._error(token, f'unexpected {token.value!r}')
+        return func
+
+    def _or(self):
+        funcs = [self._and()]
+        while self._accept('keyword', 'or'):
+            funcs.append(self._and())
+        if len(funcs) == 1:
+            return funcs[0]
+        return lambda paragraph: any(func(paragraph) for func in funcs)
+
+    def _and(self):
+        funcs = [self._not()]
+        while self._accept('keyword', 'and'):
+            funcs.append(self._not())
+        if len(funcs) == 1:
+            return funcs[0]
+        return lambda paragraph: all(func(paragraph) for func in funcs)
+
+    def _not(self):
+        if self._accept('keyword', 'not'):
+            func = self._not()
+            return lambda paragraph: not func(paragraph)
+        return self._atom()
+
+    def _atom(self):
+        if self._accept('op', '('):
+            func = self._or()
+            self._expect('op', ')')
+            return func
+
+        token = self._peek()
+        if token.kind != 'word':
+            raise self._error(token, 'expected a field name')
+        self._next()
+        field = token.value.lower()
+        self.fields.add(field)
+
+        negated = self._accept('keyword', 'not') is not None
+        if negated or self._accept('keyword', 'in'):
+            if negated:
+                self._expect('keyword', 'in')
+            return _membership(field, self._values(), negated)
+
+        token = self._next()
+        if token.kind != 'op' or token.value not in _OPERATORS and token.value not in ('~', '!~'):
+            raise self._error(token, 'expected a comparison operator')
+        op = token.value
+
+        value = self._next()
+        if value.kind not in ('word', 'string'):
+            raise self._error(value, 'expected a value')
+        numeric = value.kind == 'word' and _INTEGER_RE.match(value.value) is not None
+        try:
+            return _comparison(field, op, value.value, numeric)
+        except re.error as exc:
+            raise self._error(value, f'invalid regular expression: {exc}') from exc
+
+    def _values(self):
+        self._expect('op', '(')
+        values = []
+        while True:
+            token = self._next()
+            if token.kind not in ('word', 'string'):
+                raise self._error(token, 'expected a value')
+            values.append(token.value)
+            if not self._accept('op', ','):
+                break
+        self._expect('op', ')')
+        return values
+
+
+def compile_filter(expression):
+    """Compiles a filter expression into a Predicate, raising FilterSyntaxError if the
+    expression is not valid.
+    """
+
+    parser = _Parser(expression)
+    func = parser.parse()
+    return Predicate(expression, func, frozenset(parser.fields))
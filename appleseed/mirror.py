@@ -0,0 +1,88 @@
+"""Verification of a local mirror of a suite against its Release file.
+
+The files are hashed on a thread pool. hashlib releases the GIL while it hashes large
+buffers, so the threads hash in parallel and a verification is bound by the disks rather
+than by a single core. The large files are hashed through mmap in one call, the small ones
+are read in large chunks.
+"""
+
+import collections
+import concurrent.futures
+import hashlib
+import mmap
+import os
+import os.path
+
+# The files of at least this size are mapped into memory rather than read.
+MMAP_THRESHOLD = 4 * 1024 * 1024
+
+READ_SIZE = 1024 * 1024
+
+VerifyResult = collections.namedtuple('VerifyResult', ('ok', 'missing', 'mismatched'))
+VerifyResult.__doc__ = """The names of the files which match the Release file, the ones which
+are not on the mirror and the ones whose size or hash differ."""
+
+
+def hash_file(path, algorithm='sha256'):
+    """Returns the hex digest and the size of the file at path."""
+
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as infile:
+        size = os.fstat(infile.fileno()).st_size
+        if size >= MMAP_THRESHOLD:
+            with mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                digest.update(mapped)
+        else:
+            for chunk in iter(lambda: infile.read(READ_SIZE), b''):
+                digest.update(chunk)
+
+    return digest.hexdigest(), size
+
+
+def _check(path, expected_hash, algorithm):
+    try:
+        digest, _size = hash_file(path, algorithm)
+    except FileNotFoundError:
+        return None
+    return digest == expected_hash
+
+
+def verify_release(release, root, workers=None, field='SHA256'):
+    """Verifies the files of the local mirror in root (the directory of the suite, which
+    holds the Release file) against the sizes and hashes release lists in field, and returns
+    a VerifyResult. The files are hashed by workers threads (as many as the CPUs by
+    default). The files whose size is wrong are reported without being hashed.
+    """
+
+    algorithm = field.lower()
+    if algorithm == 'md5sum':
+        algorithm = 'md5'
+
+    result = VerifyResult(set(), set(), set())
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        futures = {}
+        for name, (expected_hash, expected_size) in release.checksums(field).items():
+            path = os.path.join(root, name)
+            try:
+                size = os.stat(path).st_size
+            except FileNotFoundError:
+                result.missing.add(name)
+                continue
+
+            if size != expected_size:
+                result.mismatched.add(name)
+                continue
+
+            futures[pool.submit(_check, path, expected_hash, algorithm)] = name
+
+        for future in concurrent.futures.as_completed(futures):
+            name = futures[future]
+            matches = future.result()
+            if matches is None:
+                result.missing.add(name)
+            elif matches:
+                result.ok.add(name)
+            else:
+                result.mismatched.add(name)
+
+    return result
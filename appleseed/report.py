@@ -0,0 +1,206 @@
+"""Progress reporting and per-stage timings of the index file loads."""
+
+import contextlib
+import gc
+import json
+import linecache
+import sys
+import threading
+import time
+import tracemalloc
+
+
+class Stage:
+    """The wall time, CPU time, bytes and items accumulated by a stage, and the peak of the
+    memory traced by tracemalloc while the stage ran (None when tracemalloc is off).
+    """
+
+    def __init__(self):
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.bytes = None
+        self.items = None
+        self.peak = None
+
+    def as_dict(self):
+        return {'wall': round(self.wall, 6), 'cpu': round(self.cpu, 6),
+                'bytes': self.bytes, 'items': self.items, 'peak': self.peak}
+
+
+def _reset_peak():
+    """Returns the peak of the traced memory since the previous call, or None if tracemalloc
+    is off.
+    """
+
+    if not tracemalloc.is_tracing():
+        return None
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.reset_peak()
+    return peak
+
+
+def _max(peak, other):
+    if peak is None or other is None:
+        return peak if other is None else other
+    return max(peak, other)
+
+
+class RunReport:
+    """Collects the timings of the stages of a run.
+
+    The CPU time is the time of the threads doing the work of a stage, so the stages run by
+    several threads at once may have more CPU time than wall time. The report can be
+    updated from any thread.
+
+    When tracemalloc is tracing, the stages also record the peak of the traced memory while
+    they ran. The peak is that of the whole process, so the stages which run at the same
+    time in other threads share it.
+    """
+
+    def __init__(self, **info):
+        self.info = info
+        self.stages = {}
+        self._lock = threading.Lock()
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.process_time()
+
+    def add(self, stage, wall=0.0, cpu=0.0, nbytes=None, items=None, peak=None):
+        with self._lock:
+            totals = self.stages.setdefault(stage, Stage())
+            totals.wall += wall
+            totals.cpu += cpu
+            if nbytes is not None:
+                totals.bytes = (totals.bytes or 0) + nbytes
+            if items is not None:
+                totals.items = (totals.items or 0) + items
+            totals.peak = _max(totals.peak, peak)
+
+    @contextlib.contextmanager
+    def measure(self, stage):
+        """Measures the time spent in the with block. The block can store the bytes and items
+        it has processed into the bytes and items attributes of the yielded Stage.
+        """
+
+        measured = Stage()
+        _reset_peak()
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield measured
+        finally:
+            self.add(stage, time.perf_counter() - wall, time.thread_time() - cpu,
+                     measured.bytes, measured.items, _reset_peak())
+
+    def as_dict(self):
+        with self._lock:
+            stages = {name: stage.as_dict() for name, stage in self.stages.items()}
+            peak = None
+            for stage in self.stages.values():
+                peak = _max(peak, stage.peak)
+        return dict(self.info,
+                    wall=round(time.perf_counter() - self._wall_start, 6),
+                    cpu=round(time.process_time() - self._cpu_start, 6),
+                    peak=peak,
+                    stages=stages)
+
+    def write(self, path):
+        """Writes the report as JSON to path, or to stdout if path is -."""
+
+        if path == '-':
+            json.dump(self.as_dict(), sys.stdout, indent=2)
+            sys.stdout.write('\n')
+        else:
+            with open(path, 'w') as outfile:
+                json.dump(self.as_dict(), outfile, indent=2)
+                outfile.write('\n')
+
+
+class Laps:
+    """Splits the time of a loop between the stages of its body.
+
+    The clocks are read once per boundary between two stages, each reading closing the
+    current stage and opening the next one, and the totals only reach the report when the
+    loop is over.
+    """
+
+    def __init__(self, report):
+        self._report = report
+        self._totals = {}
+        self._wall = self._cpu = None
+        self._tracing = False
+
+    def __enter__(self):
+        self._tracing = tracemalloc.is_tracing()
+        if self._tracing:
+            tracemalloc.reset_peak()
+        self._wall, self._cpu = time.perf_counter(), time.thread_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        for stage, (wall, cpu, peak) in self._totals.items():
+            self._report.add(stage, wall, cpu, peak=peak)
+
+    def lap(self, stage):
+        """Charges the time since the previous lap to stage."""
+
+        wall, cpu = time.perf_counter(), time.thread_time()
+        wall_total, cpu_total, peak = self._totals.get(stage, (0.0, 0.0, None))
+        if self._tracing:
+            peak = _max(peak, _reset_peak())
+        self._totals[stage] = (wall_total + wall - self._wall, cpu_total + cpu - self._cpu, peak)
+        self._wall, self._cpu = wall, cpu
+
+
+class Progress:
+    """Writes a progress line at most once per interval seconds."""
+
+    def __init__(self, message, stream=sys.stderr, interval=0.5):
+        self._message = message
+        self._stream = stream
+        self._interval = interval
+        self._next = 0.0
+
+    def update(self, n):
+        now = time.monotonic()
+        if now >= self._next:
+            self._next = now + self._interval
+            self._stream.write(f'\r{self._message}: {n}')
+            self._stream.flush()
+
+
+class RetainedMemory:
+    """Measures the memory allocated in a with block and still held when it exits, that is
+    the memory held by the objects the block has built and kept. tracemalloc must be
+    tracing.
+    """
+
+    def __init__(self):
+        self.bytes = None
+        self._start = None
+        self._baseline = self._snapshot = None
+
+    def __enter__(self):
+        gc.collect()
+        self._baseline = tracemalloc.take_snapshot()
+        self._start = tracemalloc.get_traced_memory()[0]
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        gc.collect()
+        self.bytes = tracemalloc.get_traced_memory()[0] - self._start
+        self._snapshot = tracemalloc.take_snapshot()
+
+    def top(self, limit=10):
+        """Returns the limit source lines holding the most of the retained memory."""
+
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        stats = self._snapshot.filter_traces(filters).compare_to(
+            self._baseline.filter_traces(filters), 'lineno')
+        sites = []
+        for stat in stats[:limit]:
+            if stat.size_diff <= 0:
+                continue
+            frame = stat.traceback[0]
+            sites.append({'site': f'{frame.filename}:{frame.lineno}',
+                          'line': linecache.getline(frame.filename, frame.lineno).strip(),
+                          'bytes': stat.size_diff, 'count': stat.count_diff})
+        return sites
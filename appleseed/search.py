@@ -0,0 +1,201 @@
+"""In-process search over package names.
+
+The index keeps the package names in a sorted array, which answers prefix queries with
+bisect, and a trigram posting list, which answers substring queries. It is built from the
+output of iter_paragraphs and can be saved to a single file which is loaded without any
+parsing of the package data.
+"""
+
+import array
+import bisect
+import struct
+import sys
+
+# The weight of the package field in the search_index MongoDB index.
+PACKAGE_WEIGHT = 100
+
+_MAGIC = b'ASIX'
+_VERSION = 1
+_HEADER = struct.Struct('<4sIIIQQ')
+
+
+class SearchIndexError(Exception):
+    pass
+
+
+def _trigrams(s):
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+
+def _le_bytes(arr):
+    if sys.byteorder == 'big':
+        arr = array.array(arr.typecode, arr)
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def _read_array(path, data, pos, count):
+    """Reads count little-endian unsigned ints from data at pos and returns them along
+    with the position after them.
+    """
+
+    arr = array.array('I')
+    end = pos + count * arr.itemsize
+    if end > len(data):
+        raise SearchIndexError(f'{path} is truncated')
+    arr.frombytes(data[pos:end])
+    if sys.byteorder == 'big':
+        arr.byteswap()
+    return arr, end
+
+
+class PackageSearchIndex:
+    """Prefix and substring search over a set of package names.
+
+    The results are ranked in the spirit of the search_index text index, where the package
+    name has weight PACKAGE_WEIGHT: an exact match scores highest, then a prefix match, then a
+    substring match, and within each kind the more of the name the query covers, the better.
+    """
+
+    def __init__(self, names, trigrams, offsets, postings):
+        self._names = names
+        self._trigrams = trigrams  # trigram -> position in offsets
+        self._offsets = offsets
+        self._postings = postings
+
+    @classmethod
+    def from_names(cls, names):
+        names = sorted({name.lower() for name in names})
+
+        postings_by_trigram = {}
+        for i, name in enumerate(names):
+            for trigram in _trigrams(name):
+                postings_by_trigram.setdefault(trigram, []).append(i)
+
+        keys = sorted(postings_by_trigram)
+        offsets = array.array('I', [0])
+        postings = array.array('I')
+        for key in keys:
+            postings.extend(postings_by_trigram[key])
+            offsets.append(len(postings))
+
+        return cls(names, {key: i for i, key in enumerate(keys)}, offsets, postings)
+
+    @classmethod
+    def from_paragraphs(cls, paragraphs):
+        return cls.from_names(paragraph['package'] for paragraph in paragraphs)
+
+    def __len__(self):
+        return len(self._names)
+
+    def _posting(self, trigram):
+        try:
+            i = self._trigrams[trigram]
+        except KeyError:
+            return ()
+        return self._postings[self._offsets[i]:self._offsets[i + 1]]
+
+    def prefix(self, prefix, limit=None):
+        """Returns the names starting with prefix in alphabetical order."""
+
+        prefix = prefix.lower()
+        names = []
+        i = bisect.bisect_left(self._names, prefix)
+        while i < len(self._names) and self._names[i].startswith(prefix):
+            names.append(self._names[i])
+            if limit is not None and len(names) >= limit:
+                break
+            i += 1
+        return names
+
+    def _matches(self, word):
+        """Returns the ids of the names containing word."""
+
+        if len(word) < 3:
+            # Too short for trigrams, so only prefixes are looked for.
+            first = bisect.bisect_left(self._names, word)
+            last = bisect.bisect_left(self._names, word + '\U0010ffff', first)
+            return set(range(first, last))
+
+        postings = sorted((self._posting(trigram) for trigram in _trigrams(word)), key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            if not candidates:
+                break
+            candidates.intersection_update(posting)
+        return {i for i in candidates if word in self._names[i]}
+
+    @staticmethod
+    def _score(word, name):
+        if name == word:
+            kind = 2
+        elif name.startswith(word):
+            kind = 1
+        else:
+            kind = 0
+        return PACKAGE_WEIGHT * (kind + len(word) / len(name))
+
+    def search(self, query, limit=10):
+        """Returns up to limit (name, score) pairs for the names containing every word of the
+        query, best matches first.
+        """
+
+        words = query.lower().split()
+        if not words:
+            return []
+
+        ids = None
+        for word in sorted(words, key=len, reverse=True):
+            matches = self._matches(word)
+            ids = matches if ids is None else ids & matches
+            if not ids:
+                return []
+
+        results = []
+        for i in ids:
+            name = self._names[i]
+            results.append((name, sum(self._score(word, name) for word in words)))
+        results.sort(key=lambda result: (-result[1], result[0]))
+        return results[:limit]
+
+    def save(self, path):
+        names = '\n'.join(self._names).encode('utf-8')
+        keys = '\n'.join(sorted(self._trigrams, key=self._trigrams.get)).encode('utf-8')
+        with open(path, 'wb') as outfile:
+            outfile.write(_HEADER.pack(_MAGIC, _VERSION, len(self._names), len(self._trigrams),
+                                       len(names), len(keys)))
+            outfile.write(names)
+            outfile.write(keys)
+            outfile.write(_le_bytes(self._offsets))
+            outfile.write(_le_bytes(self._postings))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as infile:
+            data = infile.read()
+
+        try:
+            magic, version, names_count, trigrams_count, names_len, keys_len = \
+                _HEADER.unpack_from(data)
+        except struct.error as exc:
+            raise SearchIndexError(f'{path} is truncated') from exc
+        if magic != _MAGIC or version != _VERSION:
+            raise SearchIndexError(f'{path} is not a search index file')
+
+        pos = _HEADER.size
+        if pos + names_len + keys_len > len(data):
+            raise SearchIndexError(f'{path} is truncated')
+        names = data[pos:pos + names_len].decode('utf-8').split('\n') if names_count else []
+        pos += names_len
+        keys = data[pos:pos + keys_len].decode('utf-8').split('\n') if trigrams_count else []
+        pos += keys_len
+        if len(names) != names_count or len(keys) != trigrams_count:
+            raise SearchIndexError(f'{path} is corrupted')
+
+        offsets, pos = _read_array(path, data, pos, trigrams_count + 1)
+        # The offsets are in the host order by now, so they give the number of postings.
+        postings, pos = _read_array(path, data, pos, offsets[-1])
+        if pos != len(data):
+            raise SearchIndexError(f'{path} is corrupted')
+
+        return cls(names, {key: i for i, key in enumerate(keys)}, offsets, postings)
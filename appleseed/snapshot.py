@@ -0,0 +1,296 @@
+"""Binary snapshots of parsed index files.
+
+A snapshot stores the paragraphs of an index file as fixed-width records pointing into a
+table of UTF-8 strings, so that it can be mapped into memory and read without any deb822
+parsing. Snapshots are named after the SHA256 of the index file they were made from (of the
+file as downloaded, when its SHA256 is known from the download), which makes a stale
+snapshot impossible to pick up.
+
+The layout of a snapshot file (all the integers are little-endian) is
+
+    header: magic, version, number of fields, number of records, size of the string table
+    fields: (offset, length) of each field name in the string table
+    records: (offset, length) of each field value, length is MISSING if the field is absent
+    strings: the string table
+"""
+
+import array
+import collections.abc
+import hashlib
+import mmap
+import os
+import os.path
+import shutil
+import struct
+import sys
+import tempfile
+
+_MAGIC = b'ASSN'
+_VERSION = 1
+_HEADER = struct.Struct('<4sIIIQ')
+
+MISSING = 0xFFFFFFFF
+
+_HASH_BLOCK_SIZE = 1 << 20
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _le_bytes(arr):
+    if sys.byteorder == 'big':
+        arr = array.array(arr.typecode, arr)
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as infile:
+        for block in iter(lambda: infile.read(_HASH_BLOCK_SIZE), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def snapshot_path(snapshot_dir, sha256):
+    return os.path.join(snapshot_dir, f'{sha256}.snap')
+
+
+class SnapshotWriter:
+    """Collects paragraphs and writes them as a snapshot.
+
+    The records and the string table go to temporary files (in temp_dir, the system default
+    if it is None) as the paragraphs are added, so the memory the writer takes does not grow
+    with the index file. The records are spilled in a sparse form, since the number of
+    fields is only known at the end, and are widened by save(). Only the short strings,
+    which are the ones repeated across paragraphs (sections, priorities, maintainers and the
+    like), are deduplicated, and at most DEDUP_STRINGS of them.
+    """
+
+    DEDUP_LENGTH = 128
+    DEDUP_STRINGS = 1 << 16
+
+    def __init__(self, temp_dir=None):
+        self._strings = tempfile.TemporaryFile(dir=temp_dir)
+        self._strings_len = 0
+        self._string_refs = {}  # short string -> (offset, length) in self._strings
+        self._fields = []
+        self._field_index = {}  # lowercased field name -> position in self._fields
+        self._records = tempfile.TemporaryFile(dir=temp_dir)
+        self._records_count = 0
+
+    def _ref(self, string):
+        ref = self._string_refs.get(string)
+        if ref is not None:
+            return ref
+
+        data = string.encode('utf-8')
+        ref = (self._strings_len, len(data))
+        self._strings.write(data)
+        self._strings_len += len(data)
+        if len(data) <= self.DEDUP_LENGTH and len(self._string_refs) < self.DEDUP_STRINGS:
+            self._string_refs[string] = ref
+        return ref
+
+    def add(self, paragraph):
+        # A sparse record is the number of its fields followed by a (field, offset, length)
+        # triple for each of them, in the order of the host.
+        record = array.array('I', [0])
+        for key, value in paragraph.items():
+            lkey = key.lower()
+            if lkey not in self._field_index:
+                self._field_index[lkey] = len(self._fields)
+                self._fields.append(key)
+            record.append(self._field_index[lkey])
+            record.extend(self._ref(value))
+        record[0] = (len(record) - 1) // 3
+        self._records.write(record.tobytes())
+        self._records_count += 1
+
+    def __len__(self):
+        return self._records_count
+
+    def _rows(self):
+        """Yields the records widened to all the fields, in the order of the host."""
+
+        self._records.seek(0)
+        missing = (0, MISSING) * len(self._fields)
+        for _ in range(self._records_count):
+            count = array.array('I', self._records.read(4))[0]
+            triples = array.array('I', self._records.read(12 * count))
+            row = array.array('I', missing)
+            for i in range(0, len(triples), 3):
+                row[2 * triples[i]] = triples[i + 1]
+                row[2 * triples[i] + 1] = triples[i + 2]
+            yield row
+
+    def save(self, path):
+        """Writes the snapshot to path atomically."""
+
+        if self._strings_len + sum(map(len, self._fields)) >= MISSING:
+            raise SnapshotError('the string table is too big')
+
+        fields = array.array('I')
+        for field in self._fields:
+            fields.extend(self._ref(field))
+
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.')
+        try:
+            with os.fdopen(fd, 'wb') as outfile:
+                outfile.write(_HEADER.pack(_MAGIC, _VERSION, len(self._fields),
+                                           self._records_count, self._strings_len))
+                outfile.write(_le_bytes(fields))
+                for row in self._rows():
+                    outfile.write(_le_bytes(row))
+                self._strings.seek(0)
+                shutil.copyfileobj(self._strings, outfile, _HASH_BLOCK_SIZE)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def close(self):
+        """Removes the temporary files."""
+
+        self._records.close()
+        self._strings.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+
+class SnapshotRecord(collections.abc.Mapping):
+    """A read-only view of one record.
+
+    It behaves like the Deb822 paragraph it was made from as far as the access to the fields
+    goes: the lookup of the field names is case-insensitive and the values are decoded from
+    the string table only when they are asked for. Wrapping it with Deb822(_parsed=record)
+    gives a full Deb822 object, at the cost of a much slower iteration.
+    """
+
+    __slots__ = ('_snapshot', '_base')
+
+    def __init__(self, snapshot, base):
+        self._snapshot = snapshot
+        self._base = base
+
+    def __getitem__(self, key):
+        i = self._snapshot.field_index[key.lower()]
+        value = self._snapshot.value(self._base + 2 * i)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        try:
+            i = self._snapshot.field_index[key.lower()]
+        except KeyError:
+            return False
+        return self._snapshot.has_value(self._base + 2 * i)
+
+    def __iter__(self):
+        for i, field in enumerate(self._snapshot.fields):
+            if self._snapshot.has_value(self._base + 2 * i):
+                yield field
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+class Snapshot:
+    """A snapshot mapped into memory.
+
+    Opening a snapshot costs the same whatever its size: the records are read from the
+    mapping when they are accessed.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as infile:
+            try:
+                self._mmap = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError as exc:  # empty file
+                raise SnapshotError(f'{path} is not a snapshot') from exc
+
+        try:
+            self._load(path)
+        except BaseException:
+            self._mmap.close()
+            raise
+
+    def _load(self, path):
+        try:
+            magic, version, fields_count, records_count, strings_len = \
+                _HEADER.unpack_from(self._mmap)
+        except struct.error as exc:
+            raise SnapshotError(f'{path} is truncated') from exc
+        if magic != _MAGIC or version != _VERSION:
+            raise SnapshotError(f'{path} is not a snapshot')
+
+        records_offset = _HEADER.size + fields_count * 8
+        self._strings_offset = records_offset + records_count * fields_count * 8
+        if len(self._mmap) != self._strings_offset + strings_len:
+            raise SnapshotError(f'{path} is truncated')
+
+        self._view = memoryview(self._mmap)
+        self._records = self._view[records_offset:self._strings_offset].cast('I')
+        if sys.byteorder == 'big':
+            self._records = array.array('I', self._records)
+            self._records.byteswap()
+
+        field_refs = struct.unpack_from(f'<{2 * fields_count}I', self._mmap, _HEADER.size)
+        self.fields = [self._string(field_refs[2 * i], field_refs[2 * i + 1])
+                       for i in range(fields_count)]
+        self.field_index = {field.lower(): i for i, field in enumerate(self.fields)}
+        self._records_count = records_count
+
+    def _string(self, offset, length):
+        start = self._strings_offset + offset
+        return self._mmap[start:start + length].decode('utf-8')
+
+    def has_value(self, pos):
+        return self._records[pos + 1] != MISSING
+
+    def value(self, pos):
+        length = self._records[pos + 1]
+        if length == MISSING:
+            return None
+        return self._string(self._records[pos], length)
+
+    def __len__(self):
+        return self._records_count
+
+    def __getitem__(self, n):
+        if not 0 <= n < self._records_count:
+            raise IndexError('snapshot record index out of range')
+        return SnapshotRecord(self, n * 2 * len(self.fields))
+
+    def __iter__(self):
+        for n in range(self._records_count):
+            yield self[n]
+
+    def close(self):
+        if isinstance(self._records, memoryview):
+            self._records.release()
+        self._view.release()
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+
+def open_snapshot(snapshot_dir, source_path):
+    """Returns the snapshot of the index file at source_path, or None if there is no valid
+    one in snapshot_dir.
+    """
+
+    try:
+        return Snapshot(snapshot_path(snapshot_dir, file_sha256(source_path)))
+    except (FileNotFoundError, SnapshotError):
+        return None
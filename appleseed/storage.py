@@ -0,0 +1,297 @@
+"""Backends storing the packages metadata produced by the index files.
+
+A document is a dict describing a package. It must have at least the 'package' and
+'content_hash' keys; the package name identifies the document for upserts and deletes.
+
+A secondary index is given as a sequence of (field, direction) pairs, where direction is 1
+for the ascending order and -1 for the descending one.
+"""
+
+import json
+import sqlite3
+import threading
+
+
+class Backend:
+    """The interface every storage backend implements."""
+
+    name = None
+
+    def bulk_load(self, documents):
+        """Inserts the documents, assuming they are not stored yet."""
+        raise NotImplementedError
+
+    def upsert(self, documents):
+        self.update(documents, ())
+
+    def delete(self, names):
+        self.update((), names)
+
+    def update(self, documents, names):
+        """Upserts the documents and deletes the packages with the given names in one go."""
+        raise NotImplementedError
+
+    def search(self, query, limit=20):
+        """Returns the documents matching the query, best matches first."""
+        raise NotImplementedError
+
+    def hashes(self):
+        """Returns a dict mapping the stored package names to their content hashes."""
+        raise NotImplementedError
+
+    def create_indexes(self, indexes=()):
+        """Creates the full-text index and the given secondary indexes."""
+        raise NotImplementedError
+
+    def commit(self):
+        """Makes everything written so far visible to readers."""
+
+    def drop(self):
+        raise NotImplementedError
+
+    def staging(self):
+        """Returns an empty backend of the same kind to build a replacement in."""
+        raise NotImplementedError
+
+    def replace_with(self, staging):
+        """Atomically replaces the stored data with the contents of a staging backend."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MongoBackend(Backend):
+    """Stores the documents in a MongoDB collection with a text index on the package names."""
+
+    def __init__(self, collection_name, host='127.0.0.1', port=27017, db_name='cusdeb',
+                 client=None):
+        from pymongo import MongoClient  # pylint: disable=import-outside-toplevel
+
+        self._client = client or MongoClient(host, port)
+        self._db_name = db_name
+        self._owns_client = client is None
+        self.name = collection_name
+        self.collection = self._client[db_name][collection_name]
+
+    def bulk_load(self, documents):
+        self.collection.insert_many(documents, ordered=False)
+
+    def update(self, documents, names):
+        # pylint: disable=import-outside-toplevel
+        from pymongo import DeleteMany, UpdateOne
+
+        requests = [UpdateOne({'package': document['package']}, {'$set': document}, upsert=True)
+                    for document in documents]
+        if names:
+            requests.append(DeleteMany({'package': {'$in': list(names)}}))
+        if requests:
+            self.collection.bulk_write(requests, ordered=False)
+
+    def search(self, query, limit=20):
+        cursor = self.collection.find(
+            {'$text': {'$search': query}},
+            {'_id': 0, 'score': {'$meta': 'textScore'}},
+        ).sort([('score', {'$meta': 'textScore'})]).limit(limit)
+        return list(cursor)
+
+    def hashes(self):
+        return {
+            document['package']: document.get('content_hash')
+            for document in self.collection.find({}, {'_id': 0, 'package': 1, 'content_hash': 1})
+        }
+
+    def create_indexes(self, indexes=()):
+        self.collection.create_index(
+            [('package', 'text')], name='search_index', weights={'package': 100}
+        )
+        for index in indexes:
+            self.collection.create_index(list(index))
+
+    def drop(self):
+        self.collection.drop()
+
+    def staging(self):
+        staging = MongoBackend(f'{self.name}-staging', db_name=self._db_name,
+                               client=self._client)
+        staging.drop()  # leftovers of an interrupted run
+        return staging
+
+    def replace_with(self, staging):
+        self._client.admin.command('renameCollection', f'{self._db_name}.{staging.name}',
+                                   to=f'{self._db_name}.{self.name}', dropTarget=True)
+
+    def close(self):
+        if self._owns_client:
+            self._client.close()
+
+
+class SQLiteBackend(Backend):
+    """Stores the documents in an SQLite database, searchable through FTS5.
+
+    The database is in WAL mode, so readers are not blocked by a load, and all the writes
+    between two calls to commit() go into a single transaction. The full-text index weighs
+    the package names 100 times more than the descriptions, like the MongoDB text index.
+    Package names are unique, so a package listed twice keeps its last document.
+    """
+
+    def __init__(self, path, table):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._path = path
+        self._lock = threading.Lock()
+        self._in_transaction = False
+        self._indexes = ()
+        self._staging = False
+        self.name = table
+
+        self._conn.execute(f'CREATE TABLE IF NOT EXISTS "{table}" ('
+                           f'package TEXT PRIMARY KEY, description TEXT, '
+                           f'content_hash TEXT, document TEXT)')
+
+    @staticmethod
+    def _row(document):
+        return (document['package'], document.get('description'), document.get('content_hash'),
+                json.dumps(document))
+
+    def _begin(self):
+        if not self._in_transaction:
+            self._conn.execute('BEGIN')
+            self._in_transaction = True
+
+    def _upsert(self, documents):
+        # Unlike INSERT OR REPLACE, whose deletes do not fire the triggers keeping the
+        # full-text index up to date, an upsert fires the update trigger.
+        self._conn.executemany(
+            f'INSERT INTO "{self.name}" VALUES (?, ?, ?, ?) '
+            f'ON CONFLICT (package) DO UPDATE SET description = excluded.description, '
+            f'content_hash = excluded.content_hash, document = excluded.document',
+            map(self._row, documents)
+        )
+
+    def bulk_load(self, documents):
+        with self._lock:
+            self._begin()
+            self._upsert(documents)
+
+    def update(self, documents, names):
+        with self._lock:
+            self._begin()
+            self._upsert(documents)
+            self._conn.executemany(f'DELETE FROM "{self.name}" WHERE package = ?',
+                                   ((name, ) for name in names))
+        self.commit()
+
+    def search(self, query, limit=20):
+        # Any of the words matches, as with MongoDB's $search.
+        match = ' OR '.join('"{}"'.format(word.replace('"', '""')) for word in query.split())
+        if not match:
+            return []
+
+        with self._lock:
+            rows = self._conn.execute(
+                f'SELECT t.document FROM "{self.name}_fts" JOIN "{self.name}" AS t '
+                f'ON t.rowid = "{self.name}_fts".rowid WHERE "{self.name}_fts" MATCH ? '
+                f'ORDER BY bm25("{self.name}_fts", 100.0, 1.0) LIMIT ?', (match, limit)
+            ).fetchall()
+        return [json.loads(document) for (document, ) in rows]
+
+    def hashes(self):
+        with self._lock:
+            return dict(self._conn.execute(f'SELECT package, content_hash FROM "{self.name}"'))
+
+    def _create_fts(self):
+        table = self.name
+        if self._conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                              (f'{table}_fts', )).fetchone():
+            return  # the triggers keep it up to date
+
+        self._conn.execute(f'CREATE VIRTUAL TABLE IF NOT EXISTS "{table}_fts" USING fts5('
+                           f'package, description, content="{table}", content_rowid="rowid")')
+        # The index is filled in one pass over the rows loaded before it existed and then kept
+        # up to date by the triggers.
+        self._conn.execute(f'INSERT INTO "{table}_fts"("{table}_fts") VALUES (\'rebuild\')')
+        self._conn.execute(f'CREATE TRIGGER IF NOT EXISTS "{table}_ai" AFTER INSERT ON "{table}" '
+                           f'BEGIN INSERT INTO "{table}_fts"(rowid, package, description) '
+                           f'VALUES (new.rowid, new.package, new.description); END')
+        self._conn.execute(f'CREATE TRIGGER IF NOT EXISTS "{table}_ad" AFTER DELETE ON "{table}" '
+                           f'BEGIN INSERT INTO "{table}_fts"("{table}_fts", rowid, package, '
+                           f'description) VALUES (\'delete\', old.rowid, old.package, '
+                           f'old.description); END')
+        self._conn.execute(f'CREATE TRIGGER IF NOT EXISTS "{table}_au" AFTER UPDATE ON "{table}" '
+                           f'BEGIN INSERT INTO "{table}_fts"("{table}_fts", rowid, package, '
+                           f'description) VALUES (\'delete\', old.rowid, old.package, '
+                           f'old.description); INSERT INTO "{table}_fts"(rowid, package, '
+                           f'description) VALUES (new.rowid, new.package, new.description); END')
+
+    def _drop_fts(self, table):
+        for trigger in ('ai', 'ad', 'au'):
+            self._conn.execute(f'DROP TRIGGER IF EXISTS "{table}_{trigger}"')
+        self._conn.execute(f'DROP TABLE IF EXISTS "{table}_fts"')
+
+    def _create_secondary_indexes(self):
+        # The documents are stored as JSON, so the fields are indexed through expressions.
+        # A query uses an index when it filters or sorts on the same json_extract() calls.
+        for index in self._indexes:
+            name = '_'.join(field if direction > 0 else f'{field}_desc'
+                            for field, direction in index)
+            columns = ', '.join(
+                "json_extract(document, '$.{}'){}".format(field, '' if direction > 0 else ' DESC')
+                for field, direction in index
+            )
+            self._conn.execute(f'CREATE INDEX IF NOT EXISTS "{self.name}_{name}" '
+                               f'ON "{self.name}" ({columns})')
+
+    def create_indexes(self, indexes=()):
+        with self._lock:
+            self._indexes = tuple(tuple(index) for index in indexes)
+            if self._staging:
+                return  # built by replace_with() once the table has its final name
+            self._begin()
+            self._create_fts()
+            self._create_secondary_indexes()
+        self.commit()
+
+    def commit(self):
+        with self._lock:
+            if self._in_transaction:
+                self._conn.execute('COMMIT')
+                self._in_transaction = False
+
+    def drop(self):
+        with self._lock:
+            self._begin()
+            self._drop_fts(self.name)
+            self._conn.execute(f'DELETE FROM "{self.name}"')
+        self.commit()
+
+    def staging(self):
+        with self._lock:
+            self._drop_fts(f'{self.name}-staging')
+            self._conn.execute(f'DROP TABLE IF EXISTS "{self.name}-staging"')
+        staging = SQLiteBackend(self._path, f'{self.name}-staging')
+        staging._staging = True  # pylint: disable=protected-access
+        return staging
+
+    def replace_with(self, staging):
+        staging.commit()
+        staging.close()
+
+        with self._lock:
+            self._begin()
+            # The full-text index refers to its table by name and the secondary indexes
+            # would keep names clashing with the ones of the next staging table, so the
+            # staging table gets neither and they are built once, for the renamed table.
+            # Readers keep seeing the old data until the commit.
+            self._indexes = staging._indexes  # pylint: disable=protected-access
+            self._drop_fts(self.name)
+            self._conn.execute(f'DROP TABLE "{self.name}"')
+            self._conn.execute(f'ALTER TABLE "{staging.name}" RENAME TO "{self.name}"')
+            self._create_fts()
+            self._create_secondary_indexes()
+        self.commit()
+
+    def close(self):
+        self.commit()
+        self._conn.close()
@@ -0,0 +1,15 @@
+"""Benchmarks of the parsers on synthetic corpora.
+
+Run them with
+
+    python -m benchmarks.run --output results.json
+
+and compare a later run with the saved results with
+
+    python -m benchmarks.run --baseline results.json
+
+See benchmarks/run.py for the options. The import times of the modules are checked
+against their budgets with
+
+    python -m benchmarks.imports
+"""
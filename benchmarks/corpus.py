@@ -0,0 +1,413 @@
+"""Deterministic generator of synthetic index files.
+
+The corpora imitate the shape of the Debian and Alpine archives: the field sets, the
+package names, the versions, the relationship fields and the lengths of the descriptions
+are drawn from distributions resembling the real ones. The same size and seed always
+give the same files.
+"""
+
+import gzip
+import hashlib
+import os
+import os.path
+import random
+
+SIZES = (1000, 10000, 100000)
+
+PDIFF_PATCHES = 4
+
+_WORDS = (
+    'the', 'a', 'of', 'for', 'and', 'to', 'with', 'in', 'is', 'this', 'package', 'library',
+    'contains', 'provides', 'files', 'support', 'development', 'tool', 'data', 'module',
+    'python', 'interface', 'documentation', 'server', 'client', 'utility', 'shared',
+    'headers', 'program', 'written', 'fast', 'simple', 'small', 'command-line', 'network',
+    'graphical', 'plugin', 'kernel', 'image', 'audio', 'video', 'format', 'parser',
+    'runtime', 'compiler', 'debugging', 'symbols', 'implementation', 'bindings', 'GNOME',
+    'KDE', 'X11', 'GTK+', 'Qt', 'Perl', 'Ruby', 'Java', 'JavaScript', 'database', 'web',
+    'framework', 'engine', 'common', 'extension', 'API', 'various', 'used', 'by', 'other',
+)
+
+_SYLLABLES = ('ba', 'co', 'de', 'fi', 'gu', 'ha', 'jo', 'ki', 'lu', 'me', 'no', 'pa', 'qu',
+              'ri', 'so', 'tu', 'vi', 'wa', 'xe', 'yo', 'ze', 'gtk', 'xml', 'ssl', 'png', 'z')
+
+_PREFIXES = (('', 50), ('lib', 25), ('python3-', 8), ('golang-', 4), ('node-', 4),
+             ('r-cran-', 3), ('fonts-', 2), ('ruby-', 2), ('texlive-', 1), ('gir1.2-', 1))
+
+_SUFFIXES = (('', 55), ('-dev', 12), ('-doc', 6), ('-data', 5), ('-common', 5),
+             ('1', 5), ('-dbgsym', 4), ('-bin', 3), ('-utils', 3), ('6v5', 1), ('-tools', 1))
+
+_SECTIONS = ('admin', 'devel', 'doc', 'editors', 'games', 'graphics', 'libdevel', 'libs',
+             'misc', 'net', 'python', 'science', 'sound', 'text', 'utils', 'web', 'x11',
+             'contrib/libs', 'non-free/misc')
+
+_ARCHITECTURES = (('amd64', 70), ('all', 30))
+
+_MAINTAINERS = ('Debian QA Group <packages@qa.debian.org>',
+                'Debian Python Team <team+python@tracker.debian.org>',
+                'Jöhn Dœ <john@example.org>',
+                'Debian Go Packaging Team <team+pkg-go@tracker.debian.org>',
+                'Ubuntu Developers <ubuntu-devel-discuss@lists.ubuntu.com>',
+                'Debian Perl Group <pkg-perl-maintainers@lists.alioth.debian.org>')
+
+
+def _weighted(rnd, choices):
+    total = sum(weight for _, weight in choices)
+    point = rnd.uniform(0, total)
+    for value, weight in choices:
+        point -= weight
+        if point <= 0:
+            return value
+    return choices[-1][0]
+
+
+def _geometric(rnd, mean, cap):
+    n = 0
+    while n < cap and rnd.random() > 1 / (mean + 1):
+        n += 1
+    return n
+
+
+def _names(rnd, n):
+    names = []
+    seen = set()
+    while len(names) < n:
+        stem = ''.join(rnd.choice(_SYLLABLES) for _ in range(rnd.randint(1, 4)))
+        name = _weighted(rnd, _PREFIXES) + stem + _weighted(rnd, _SUFFIXES)
+        if len(name) < 2:
+            continue  # not a valid package name
+        if name in seen:
+            name = f'{name}{len(names)}'
+        seen.add(name)
+        names.append(name)
+    return names
+
+
+def _version(rnd):
+    upstream = '.'.join(str(int(rnd.expovariate(0.3))) for _ in range(rnd.randint(1, 3)))
+    extra = rnd.random()
+    if extra < 0.1:
+        upstream += '+dfsg'
+    elif extra < 0.15:
+        upstream += f'~rc{rnd.randint(1, 4)}'
+    elif extra < 0.2:
+        upstream += (f'+git{rnd.randint(2015, 2021)}{rnd.randint(1, 12):02}01.'
+                     f'{rnd.getrandbits(28):07x}')
+
+    version = f'{rnd.randint(1, 3)}:{upstream}' if rnd.random() < 0.05 else upstream
+    revision = rnd.random()
+    if revision < 0.1:
+        return version  # a native package
+    if revision < 0.8:
+        return f'{version}-{rnd.randint(1, 5)}'
+    if revision < 0.9:
+        return f'{version}-{rnd.randint(1, 3)}ubuntu{rnd.randint(1, 4)}'
+    return f'{version}-{rnd.randint(1, 3)}+deb10u{rnd.randint(1, 3)}'
+
+
+def _relation(rnd, names):
+    def atom():
+        name = rnd.choice(names)
+        if rnd.random() < 0.03:
+            name += ':any'
+        if rnd.random() < 0.4:
+            op = rnd.choice(('>=', '>=', '>=', '<<', '=', '>>', '<='))
+            name += f' ({op} {_version(rnd)})'
+        if rnd.random() < 0.03:
+            name += ' [amd64 arm64]'
+        return name
+
+    alternatives = 1 + _geometric(rnd, 0.15, 3)
+    return ' | '.join(atom() for _ in range(alternatives))
+
+
+def _relations(rnd, names, mean):
+    return ', '.join(_relation(rnd, names) for _ in range(1 + _geometric(rnd, mean, 40)))
+
+
+def _sentence(rnd, words):
+    return ' '.join(rnd.choice(_WORDS) for _ in range(words))
+
+
+def _description(rnd):
+    lines = [_sentence(rnd, rnd.randint(2, 9))]
+    for _ in range(_geometric(rnd, 5, 40)):
+        if rnd.random() < 0.15:
+            lines.append(' .')
+        elif rnd.random() < 0.1:
+            lines.append('  * ' + _sentence(rnd, rnd.randint(3, 10)))
+        else:
+            lines.append(' ' + _sentence(rnd, rnd.randint(8, 14)))
+    return '\n'.join(lines)
+
+
+def _hex(rnd, length):
+    return f'{rnd.getrandbits(length * 4):0{length}x}'
+
+
+def _package(rnd, name, names):
+    fields = [('Package', name)]
+    if rnd.random() < 0.3:
+        fields.append(('Source', rnd.choice(names)))
+    fields.append(('Version', _version(rnd)))
+    fields.append(('Installed-Size', str(int(rnd.lognormvariate(6, 1.8)) + 1)))
+    fields.append(('Maintainer', rnd.choice(_MAINTAINERS)))
+    fields.append(('Architecture', _weighted(rnd, _ARCHITECTURES)))
+    if rnd.random() < 0.2:
+        fields.append(('Multi-Arch', rnd.choice(('same', 'foreign', 'allowed'))))
+    if rnd.random() < 0.05:
+        fields.append(('Pre-Depends', _relations(rnd, names, 0.5)))
+    if rnd.random() < 0.85:
+        fields.append(('Depends', _relations(rnd, names, 4)))
+    for field, probability, mean in (('Recommends', 0.25, 1), ('Suggests', 0.2, 1),
+                                     ('Breaks', 0.08, 0.5), ('Replaces', 0.08, 0.5),
+                                     ('Provides', 0.1, 0.5), ('Conflicts', 0.05, 0.3)):
+        if rnd.random() < probability:
+            fields.append((field, _relations(rnd, names, mean)))
+    fields.append(('Description', _description(rnd)))
+    if rnd.random() < 0.6:
+        fields.append(('Homepage', f'https://{rnd.choice(names)}.example.org/'))
+    fields.append(('Description-md5', _hex(rnd, 32)))
+    if rnd.random() < 0.3:
+        fields.append(('Tag', ', '.join(f'{rnd.choice(_WORDS)}::{rnd.choice(_WORDS)}'
+                                        for _ in range(rnd.randint(1, 6)))))
+    fields.append(('Section', rnd.choice(_SECTIONS)))
+    fields.append(('Priority', rnd.choice(('optional', 'optional', 'optional', 'extra'))))
+    fields.append(('Filename', f'pool/main/{name[0]}/{name}/{name}_amd64.deb'))
+    fields.append(('Size', str(int(rnd.lognormvariate(10, 1.5)) + 500)))
+    fields.append(('MD5sum', _hex(rnd, 32)))
+    fields.append(('SHA256', _hex(rnd, 64)))
+    return fields
+
+
+def _render(paragraphs):
+    # The multiline fields with an empty first line have no space after the colon.
+    return ''.join(''.join(f'{field}:{"" if value.startswith(chr(10)) else " "}{value}\n'
+                           for field, value in paragraph) + '\n'
+                   for paragraph in paragraphs)
+
+
+def generate_packages(n, seed=0):
+    rnd = random.Random(seed)
+    names = _names(rnd, n)
+    return _render(_package(rnd, name, names) for name in names)
+
+
+def generate_sources(n, seed=0):
+    rnd = random.Random(seed)
+    names = _names(rnd, n)
+
+    paragraphs = []
+    for name in names:
+        version = _version(rnd)
+        files = [(f'{name}_{version}.dsc', rnd.randint(800, 3000)),
+                 (f'{name}_{version}.orig.tar.xz', int(rnd.lognormvariate(12, 1.5))),
+                 (f'{name}_{version}.debian.tar.xz', rnd.randint(2000, 90000))]
+        fields = [
+            ('Package', name),
+            ('Binary', ', '.join([name] + rnd.sample(names, _geometric(rnd, 1.5, 10)))),
+            ('Version', version),
+            ('Maintainer', rnd.choice(_MAINTAINERS)),
+        ]
+        if rnd.random() < 0.5:
+            fields.append(('Uploaders', ', '.join(rnd.sample(_MAINTAINERS, rnd.randint(1, 3)))))
+        fields.append(('Build-Depends', _relations(rnd, names, 6)))
+        if rnd.random() < 0.3:
+            fields.append(('Build-Depends-Indep', _relations(rnd, names, 2)))
+        fields += [
+            ('Architecture', rnd.choice(('any', 'all', 'any all', 'amd64 arm64'))),
+            ('Standards-Version', f'4.{rnd.randint(0, 5)}.{rnd.randint(0, 1)}'),
+            ('Format', rnd.choice(('3.0 (quilt)', '3.0 (quilt)', '3.0 (native)', '1.0'))),
+            ('Files', ''.join(f'\n {_hex(rnd, 32)} {size} {file_name}'
+                              for file_name, size in files)),
+            ('Vcs-Git', f'https://salsa.debian.org/debian/{name}.git'),
+            ('Checksums-Sha256', ''.join(f'\n {_hex(rnd, 64)} {size} {file_name}'
+                                         for file_name, size in files)),
+            ('Homepage', f'https://{name}.example.org/'),
+            ('Directory', f'pool/main/{name[0]}/{name}'),
+            ('Priority', 'source'),
+            ('Section', rnd.choice(_SECTIONS)),
+        ]
+        paragraphs.append(fields)
+
+    return _render(paragraphs)
+
+
+def generate_apkindex(n, seed=0):
+    rnd = random.Random(seed)
+    names = _names(rnd, n)
+
+    paragraphs = []
+    for name in names:
+        fields = [
+            ('C', f'Q1{_hex(rnd, 27)}='),
+            ('P', name),
+            ('V', f'{_version(rnd).split(":")[-1].split("-")[0]}-r{rnd.randint(0, 5)}'),
+            ('A', 'x86_64'),
+            ('S', str(int(rnd.lognormvariate(10, 1.5)) + 500)),
+            ('I', str(int(rnd.lognormvariate(11, 1.8)) + 4096)),
+            ('T', _sentence(rnd, rnd.randint(3, 10))),
+            ('U', f'https://{name}.example.org/'),
+            ('L', rnd.choice(('MIT', 'GPL-2.0-or-later', 'BSD-3-Clause', 'Apache-2.0'))),
+            ('o', rnd.choice(names)),
+            ('m', rnd.choice(_MAINTAINERS)),
+            ('t', str(rnd.randint(1500000000, 1600000000))),
+            ('c', _hex(rnd, 40)),
+        ]
+        if rnd.random() < 0.8:
+            fields.append(('D', ' '.join(rnd.sample(names, _geometric(rnd, 3, 20) or 1))))
+        if rnd.random() < 0.3:
+            fields.append(('p', f'so:lib{name}.so.{rnd.randint(0, 9)}={rnd.randint(0, 9)}.0'))
+        paragraphs.append(fields)
+
+    return ''.join(''.join(f'{field}:{value}\n' for field, value in paragraph) + '\n'
+                   for paragraph in paragraphs)
+
+
+def generate_release(n, seed=0):
+    """Returns a Release file listing n index files."""
+
+    rnd = random.Random(seed)
+    files = []
+    for i in range(n):
+        component = rnd.choice(('main', 'contrib', 'non-free'))
+        kind = rnd.choice((f'binary-arch{i % 40}/Packages', f'i18n/Translation-l{i % 60}',
+                           f'Contents-arch{i % 40}', f'dep11/Components-{i}.yml'))
+        suffix = rnd.choice(('', '.gz', '.xz'))
+        files.append((f'{component}/{kind}{suffix}', int(rnd.lognormvariate(11, 2))))
+
+    fields = [
+        ('Origin', 'Debian'),
+        ('Label', 'Debian'),
+        ('Suite', 'unstable'),
+        ('Codename', 'sid'),
+        ('Changelogs', 'https://metadata.ftp-master.debian.org/changelogs/@CHANGEPATH@'),
+        ('Date', 'Sat, 15 May 2021 08:12:44 UTC'),
+        ('Valid-Until', 'Sat, 22 May 2021 08:12:44 UTC'),
+        ('Acquire-By-Hash', 'yes'),
+        ('No-Support-for-Architecture-all', 'Packages'),
+        ('Architectures', ' '.join(f'arch{i}' for i in range(40))),
+        ('Components', 'main contrib non-free'),
+        ('Description', 'Debian x.y Unstable - Not Released'),
+        ('MD5Sum', ''.join(f'\n {_hex(rnd, 32)} {size:>16} {name}' for name, size in files)),
+        ('SHA256', ''.join(f'\n {_hex(rnd, 64)} {size:>16} {name}' for name, size in files)),
+    ]
+    return _render([fields])
+
+
+def _sha1(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def write_pdiff_mirror(root, n, patches=PDIFF_PATCHES, seed=0):
+    """Writes a Packages file with n paragraphs and its pdiff history of patches versions
+    into root, laid out like dists/<suite>/<section>/binary-<arch> on a mirror, and returns
+    the text of the oldest version, to be used as the outdated local copy.
+    """
+
+    rnd = random.Random(seed)
+    names = _names(rnd, n + patches * max(1, n // 100))
+    paragraphs = [_package(rnd, name, names) for name in names[:n]]
+    next_name = n
+
+    states = [_render(paragraphs)]
+    scripts = []
+    for _ in range(patches):
+        # Every version bumps 1% of the packages, removes 0.2% and adds 1%, the way a
+        # daily update of unstable roughly does.
+        starts = []
+        line = 1
+        for paragraph in paragraphs:
+            starts.append(line)
+            line += sum(value.count('\n') + 1 for _, value in paragraph) + 1
+
+        edits = []  # (first line, last line, new lines), last line < first line to append
+        for i in rnd.sample(range(len(paragraphs)), max(1, len(paragraphs) // 100)):
+            fields = paragraphs[i]
+            version_line = starts[i] + [field for field, _ in fields].index('Version')
+            version = _version(rnd)
+            fields[[field for field, _ in fields].index('Version')] = ('Version', version)
+            edits.append((version_line, version_line, [f'Version: {version}']))
+        deleted = set(rnd.sample(range(len(paragraphs)), max(1, len(paragraphs) // 500)))
+        for i in deleted:
+            end = starts[i + 1] - 1 if i + 1 < len(paragraphs) else line - 1
+            edits = [edit for edit in edits if not starts[i] <= edit[0] <= end]
+            edits.append((starts[i], end, []))
+
+        added = []
+        for _ in range(max(1, n // 100)):
+            added.append(_package(rnd, names[next_name], names))
+            next_name += 1
+        edits.append((line, line - 1, _render(added).splitlines()))
+
+        script = []
+        for first, last, new_lines in sorted(edits, reverse=True):
+            if last < first:
+                script.append(f'{first - 1}a')
+            elif new_lines:
+                script.append(f'{first},{last}c')
+            else:
+                script.append(f'{first},{last}d')
+            if new_lines:
+                script += new_lines
+                script.append('.')
+        scripts.append(''.join(f'{command}\n' for command in script))
+
+        paragraphs = [paragraph for i, paragraph in enumerate(paragraphs)
+                      if i not in deleted] + added
+        states.append(_render(paragraphs))
+
+    os.makedirs(os.path.join(root, 'Packages.diff'), exist_ok=True)
+    history, patch_entries, downloads = [], [], []
+    for k, script in enumerate(scripts, 1):
+        previous = states[k - 1].encode('utf-8')
+        script = script.encode('utf-8')
+        compressed = gzip.compress(script, mtime=0)
+        name = f'T-{k}'
+        with open(os.path.join(root, 'Packages.diff', f'{name}.gz'), 'wb') as outfile:
+            outfile.write(compressed)
+        history.append(f' {_sha1(previous)} {len(previous)} {name}')
+        patch_entries.append(f' {_sha1(script)} {len(script)} {name}')
+        downloads.append(f' {_sha1(compressed)} {len(compressed)} {name}.gz')
+
+    current = states[-1].encode('utf-8')
+    with open(os.path.join(root, 'Packages.diff', 'Index'), 'w') as outfile:
+        outfile.write(f'SHA1-Current: {_sha1(current)} {len(current)}\n'
+                      'SHA1-History:\n' + '\n'.join(history) + '\n'
+                      'SHA1-Patches:\n' + '\n'.join(patch_entries) + '\n'
+                      'SHA1-Download:\n' + '\n'.join(downloads) + '\n')
+    with open(os.path.join(root, 'Packages'), 'wb') as outfile:
+        outfile.write(current)
+    with open(os.path.join(root, 'Packages.gz'), 'wb') as outfile:
+        outfile.write(gzip.compress(current, mtime=0))
+
+    return states[0]
+
+
+def write_corpus(directory, n, seed=0):
+    """Writes all the corpora of size n into directory, unless they are already there, and
+    returns a dict mapping the corpus names to their paths.
+    """
+
+    directory = os.path.join(directory, f'{n}-{seed}')
+    paths = {
+        'packages': os.path.join(directory, 'Packages'),
+        'sources': os.path.join(directory, 'Sources'),
+        'apkindex': os.path.join(directory, 'APKINDEX'),
+        'release': os.path.join(directory, 'Release'),
+        'pdiff': os.path.join(directory, 'mirror'),
+        'pdiff_base': os.path.join(directory, 'Packages.base'),
+    }
+    if os.path.exists(os.path.join(directory, '.complete')):
+        return paths
+
+    os.makedirs(directory, exist_ok=True)
+    for name, generate in (('packages', generate_packages), ('sources', generate_sources),
+                           ('apkindex', generate_apkindex), ('release', generate_release)):
+        with open(paths[name], 'w', encoding='utf-8') as outfile:
+            outfile.write(generate(n, seed))
+    base = write_pdiff_mirror(paths['pdiff'], n, seed=seed)
+    with open(paths['pdiff_base'], 'w', encoding='utf-8') as outfile:
+        outfile.write(base)
+
+    open(os.path.join(directory, '.complete'), 'w').close()
+    return paths
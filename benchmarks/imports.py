@@ -0,0 +1,98 @@
+"""Checks that importing the modules of appleseed stays cheap.
+
+Every module is imported in a fresh interpreter run with -X importtime. The time its import
+adds to the startup of the interpreter is compared with the budget of the module, and the
+modules it pulls in are checked against the ones it must leave alone until they are needed.
+The exit status is 1 if a module is over budget or imports a module it must not.
+
+    python -m benchmarks.imports
+    python -m benchmarks.imports --scale 2  # on a slow machine
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+# The modules which only some code paths need and which take long to import.
+HEAVY = ('appleseed.deb822', 'appleseed.snapshot', 'chardet', 'email.utils', 'gzip', 'six',
+         'subprocess', 'tarfile', 'urllib.request', 'uuid')
+
+# module: (budget in milliseconds, the modules it must not import)
+BUDGETS = {
+    'appleseed': (25, HEAVY),
+    'appleseed.debian_support': (45, HEAVY),
+    'appleseed.filter': (25, HEAVY),
+    'appleseed.report': (30, HEAVY),
+    'appleseed.deb822': (60, ('chardet', 'email.utils', 'six', 'subprocess')),
+}
+
+
+def import_times(statement):
+    """Runs statement in a fresh interpreter and returns a dict mapping the names of the
+    modules it has imported at the top level to their cumulative import times in
+    microseconds, and the set of the names of all the modules it has imported.
+    """
+
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement],
+                            stderr=subprocess.PIPE, check=True,
+                            env=dict(os.environ, PYTHONDONTWRITEBYTECODE='1'),
+                            universal_newlines=True).stderr
+    top_level = {}
+    imported = set()
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _self, cumulative, name = line[len('import time:'):].split('|')
+        imported.add(name.strip())
+        if not name.startswith('  '):  # not imported by another module
+            top_level[name.strip()] = int(cumulative)
+
+    return top_level, imported
+
+
+def measure(module, repeat):
+    """Returns the best time in milliseconds importing module adds to the startup of the
+    interpreter, and the modules it imports.
+    """
+
+    best = None
+    imported = set()
+    for _ in range(repeat):
+        baseline, startup = import_times('pass')
+        top_level, imported = import_times(f'import {module}')
+        imported -= startup
+        elapsed = sum(cumulative for name, cumulative in top_level.items()
+                      if name not in baseline) / 1000
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best, imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the import time of the modules')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='The number of imports of each module; the best one is reported')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='The factor the budgets are multiplied by')
+    args = parser.parse_args()
+
+    failures = 0
+    sys.stderr.write('{:<28} {:>10} {:>10}\n'.format('module', 'time', 'budget'))
+    for module, (budget, forbidden) in BUDGETS.items():
+        elapsed, imported = measure(module, args.repeat)
+        budget *= args.scale
+        problems = [f'imports {name}' for name in forbidden if name in imported]
+        if elapsed > budget:
+            problems.insert(0, 'over budget')
+        failures += bool(problems)
+        sys.stderr.write('{:<28} {:>8.1f}ms {:>8.1f}ms  {}\n'.format(
+            module, elapsed, budget, ', '.join(problems)))
+
+    if failures:
+        sys.stderr.write(f'{failures} module(s) failed the check\n')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
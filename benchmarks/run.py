@@ -0,0 +1,374 @@
+"""Times the parsers on the synthetic corpora of benchmarks/corpus.py.
+
+The results are written as JSON. Given a baseline (the JSON output of a previous run), the
+run is compared with it and the benchmarks which have become slower than the threshold
+allows are reported as regressions, in which case the exit status is 1.
+
+    python -m benchmarks.run --sizes 1000,10000 --output baseline.json
+    python -m benchmarks.run --sizes 1000,10000 --baseline baseline.json --threshold 0.1
+"""
+
+import argparse
+import contextlib
+import functools
+import http.server
+import json
+import os
+import os.path
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from appleseed import AlpineIndexFile, DebianIndexFile
+from appleseed import deb822
+from appleseed.deb822 import Deb822, Packages, PkgRelation, Release, Sources
+from appleseed.debian_support import NativeVersion, PackageFile, update_file
+from appleseed.depgraph import ClosureEngine, DependencyGraph
+
+from benchmarks.corpus import SIZES, write_corpus
+
+FORMAT_VERSION = 1
+
+BENCHMARKS = {}
+
+
+def benchmark(name, requires_apt_pkg=False):
+    """Registers a benchmark. The decorated function takes the paths of a corpus and returns
+    a (prepare, run) pair: prepare (which may be None) is called before every run and is not
+    timed, run does the work and returns the number of items it has processed. A benchmark
+    holding resources returns a context manager yielding the pair instead, which is exited
+    after the last run.
+    """
+
+    def decorator(func):
+        BENCHMARKS[name] = (func, requires_apt_pkg)
+        return func
+
+    return decorator
+
+
+@benchmark('deb822_internal')
+def bench_deb822_internal(paths):
+    def run():
+        with open(paths['packages'], 'rb') as infile:
+            return sum(1 for paragraph in Deb822.iter_paragraphs(infile, use_apt_pkg=False)
+                       if paragraph['package'])
+
+    return None, run
+
+
+@benchmark('deb822_apt', requires_apt_pkg=True)
+def bench_deb822_apt(paths):
+    def run():
+        with open(paths['packages'], 'rb') as infile:
+            return sum(1 for paragraph in Deb822.iter_paragraphs(infile, use_apt_pkg=True)
+                       if paragraph['package'])
+
+    return None, run
+
+
+@benchmark('packages', requires_apt_pkg=True)
+def bench_packages(paths):
+    def run():
+        with open(paths['packages'], 'rb') as infile:
+            return sum(1 for paragraph in Packages.iter_paragraphs(infile)
+                       if paragraph['package'])
+
+    return None, run
+
+
+@benchmark('sources', requires_apt_pkg=True)
+def bench_sources(paths):
+    def run():
+        with open(paths['sources'], 'rb') as infile:
+            return sum(1 for paragraph in Sources.iter_paragraphs(infile)
+                       if paragraph['package'])
+
+    return None, run
+
+
+@benchmark('packages_internal')
+def bench_packages_internal(paths):
+    def run():
+        with open(paths['packages'], 'rb') as infile:
+            return sum(1 for paragraph in Packages.iter_paragraphs(infile, use_apt_pkg=False)
+                       if paragraph['package'])
+
+    return None, run
+
+
+@benchmark('sources_internal')
+def bench_sources_internal(paths):
+    def run():
+        with open(paths['sources'], 'rb') as infile:
+            return sum(1 for paragraph in Sources.iter_paragraphs(infile, use_apt_pkg=False)
+                       if paragraph['package'])
+
+    return None, run
+
+
+@benchmark('package_file')
+def bench_package_file(paths):
+    def run():
+        return sum(1 for _ in PackageFile(paths['packages']))
+
+    return None, run
+
+
+@benchmark('debian_index_file', requires_apt_pkg=True)
+def bench_debian_index_file(paths):
+    def run():
+        with DebianIndexFile('debian', 'sid', 'amd64', paths['packages']) as index_file:
+            return sum(1 for paragraph in index_file.iter_paragraphs() if paragraph['package'])
+
+    return None, run
+
+
+@benchmark('alpine_index_file')
+def bench_alpine_index_file(paths):
+    def run():
+        with AlpineIndexFile('alpine', 'edge', 'x86_64', paths['apkindex']) as index_file:
+            return sum(1 for paragraph in index_file.iter_paragraphs() if paragraph['package'])
+
+    return None, run
+
+
+@benchmark('release')
+def bench_release(paths):
+    def run():
+        with open(paths['release'], 'rb') as infile:
+            return len(Release(infile)['SHA256'])
+
+    return None, run
+
+
+@benchmark('release_lookup')
+def bench_release_lookup(paths):
+    def run():
+        with open(paths['release'], 'rb') as infile:
+            release = Release(infile)
+        return len(release.checksums('SHA256'))
+
+    return None, run
+
+
+def _field_values(path, field):
+    with open(path, 'rb') as infile:
+        return [paragraph[field] for paragraph in Deb822.iter_paragraphs(infile)
+                if field in paragraph]
+
+
+@benchmark('parse_relations')
+def bench_parse_relations(paths):
+    relations = _field_values(paths['packages'], 'Depends')
+
+    def run():
+        for raw in relations:
+            PkgRelation.parse_relations(raw)
+        return len(relations)
+
+    return None, run
+
+
+@benchmark('native_version_sort')
+def bench_native_version_sort(paths):
+    versions = _field_values(paths['packages'], 'Version')
+
+    def run():
+        sorted(NativeVersion(version) for version in versions)
+        return len(versions)
+
+    return None, run
+
+
+@benchmark('dependency_graph')
+def bench_dependency_graph(paths):
+    with open(paths['packages'], 'rb') as infile:
+        paragraphs = list(Deb822.iter_paragraphs(infile, use_apt_pkg=False))
+
+    def run():
+        return len(DependencyGraph.from_paragraphs(paragraphs))
+
+    return None, run
+
+
+@benchmark('closure')
+def bench_closure(paths):
+    """Computes the install footprints of sets of 40 packages, the memoized closures being
+    reused from one set to the next as they would be by an image builder.
+    """
+
+    with open(paths['packages'], 'rb') as infile:
+        graph = DependencyGraph.from_paragraphs(Deb822.iter_paragraphs(infile,
+                                                                       use_apt_pkg=False))
+    names = graph.names[:len(graph)]
+    step = max(1, len(names) // 40)
+    requests = [names[i::step][:40] for i in range(20)]
+
+    def run():
+        engine = ClosureEngine(graph)
+        for request in requests:
+            engine.footprint(request)
+        return len(requests)
+
+    return None, run
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+@benchmark('update_file')
+@contextlib.contextmanager
+def bench_update_file(paths):
+    """Brings the oldest version of a Packages file up to date through pdiff patches served
+    over HTTP from localhost.
+    """
+
+    handler = functools.partial(_QuietHandler, directory=paths['pdiff'])
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    remote = 'http://127.0.0.1:{}/Packages'.format(server.server_address[1])
+
+    try:
+        with tempfile.TemporaryDirectory() as local_dir:
+            local = os.path.join(local_dir, 'Packages')
+
+            def prepare():
+                shutil.copyfile(paths['pdiff_base'], local)
+                if os.path.exists(local + '.sha1'):
+                    os.remove(local + '.sha1')
+
+            def run():
+                return sum(1 for line in update_file(remote, local) if line == '\n')
+
+            yield prepare, run
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def run_benchmark(func, paths, repeat):
+    timings = []
+    items = 0
+    with contextlib.ExitStack() as stack:
+        setup = func(paths)
+        if isinstance(setup, contextlib.AbstractContextManager):
+            setup = stack.enter_context(setup)
+        prepare, run = setup
+        for _ in range(repeat):
+            if prepare is not None:
+                prepare()
+            start = time.perf_counter()
+            items = run()
+            timings.append(time.perf_counter() - start)
+
+    best = min(timings)
+    return {
+        'items': items,
+        'best': round(best, 6),
+        'median': round(statistics.median(timings), 6),
+        'items_per_second': round(items / best) if best else None,
+    }
+
+
+def compare(results, baseline, threshold):
+    """Returns the (name, change) pairs of the benchmarks whose best time is worse than the
+    baseline by more than threshold (a fraction), printing a comparison table.
+    """
+
+    regressions = []
+    sys.stderr.write('{:<32} {:>12} {:>12} {:>8}\n'.format('benchmark', 'baseline', 'current',
+                                                            'change'))
+    for name, result in sorted(results['results'].items()):
+        base = baseline['results'].get(name)
+        if base is None or not base['best']:
+            continue
+
+        change = result['best'] / base['best'] - 1
+        flag = ''
+        if change > threshold:
+            regressions.append((name, change))
+            flag = '  REGRESSION'
+        sys.stderr.write('{:<32} {:>11.4f}s {:>11.4f}s {:>+7.1%}{}\n'.format(
+            name, base['best'], result['best'], change, flag))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the parsers on synthetic corpora')
+    parser.add_argument('--baseline',
+                        help='The JSON output of a previous run to compare the results with')
+    parser.add_argument('--corpus-dir',
+                        default=os.path.join(tempfile.gettempdir(), 'appleseed-benchmarks'),
+                        help='The directory where the generated corpora are kept between runs')
+    parser.add_argument('--only', action='append',
+                        help='Run only the benchmarks whose name contains the specified string. '
+                             'The option can be specified several times')
+    parser.add_argument('--output', help='The file the results are written to (stdout by '
+                                         'default)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='The number of runs of each benchmark; the best one is reported')
+    parser.add_argument('--seed', type=int, default=0, help='The seed of the corpora')
+    parser.add_argument('--sizes', default=','.join(map(str, SIZES)),
+                        help='A comma-separated list of the numbers of paragraphs of the '
+                             'corpora')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='The slowdown, as a fraction of the baseline time, above which a '
+                             'benchmark is reported as a regression')
+    args = parser.parse_args()
+
+    results = {
+        'format': FORMAT_VERSION,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'apt_pkg': deb822._have_apt_pkg,  # pylint: disable=protected-access
+        'repeat': args.repeat,
+        'seed': args.seed,
+        'results': {},
+    }
+
+    for size in map(int, args.sizes.split(',')):
+        sys.stderr.write(f'Generating the corpora of {size} paragraphs...\n')
+        paths = write_corpus(args.corpus_dir, size, args.seed)
+
+        for name, (func, requires_apt_pkg) in BENCHMARKS.items():
+            if args.only and not any(pattern in name for pattern in args.only):
+                continue
+            if requires_apt_pkg and not results['apt_pkg']:
+                sys.stderr.write(f'Skipping {name}: apt_pkg is not available\n')
+                continue
+
+            key = f'{name}/{size}'
+            result = run_benchmark(func, paths, args.repeat)
+            results['results'][key] = result
+            sys.stderr.write(f'{key:<32} {result["best"]:>10.4f}s '
+                             f'{result["items_per_second"]:>10} items/s\n')
+
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            json.dump(results, outfile, indent=2)
+            outfile.write('\n')
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+    if args.baseline:
+        with open(args.baseline) as infile:
+            baseline = json.load(infile)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            sys.stderr.write('{} regression(s) over {:.0%}\n'.format(len(regressions),
+                                                                      args.threshold))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
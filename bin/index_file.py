@@ -1,13 +1,27 @@
 #!/usr/bin/env python3
 import argparse
+import hashlib
+import itertools
+import json
 import sys
 import os
 import os.path
+import queue
+import re
+import threading
+import time
+import tracemalloc
+import urllib.parse
 from urllib.error import HTTPError
 
-from pymongo import MongoClient
-
-from appleseed import ALLOWED_DISTROS, AlpineIndexFile, DebianIndexFile
+from appleseed import (ALLOWED_DISTROS, AlpineIndexFile, DebianIndexFile, IndexFileCorrupted,
+                       IndexFileNotListed, ReleaseFileNotFound)
+from appleseed.deb822 import (Deb822, disable_instrumentation, enable_instrumentation,
+                              instrumentation_enabled, instrumentation_snapshot)
+from appleseed.debian_support import ChangeTracker, update_file, version_sort_key
+from appleseed.filter import FilterSyntaxError, compile_filter
+from appleseed.report import Laps, Progress, RetainedMemory, RunReport
+from appleseed.storage import MongoBackend, SQLiteBackend
 
 
 BLACKLIST = [
@@ -18,78 +32,564 @@ BLACKLIST = [
     'flightgear-dbgsym', 'flightgear-phi',
 ]
 
+# The number of paragraphs kept to measure the memory held per paragraph with --profile-memory.
+MEMORY_SAMPLE = 1000
+
+DEFAULT_INDEXES = ('size', 'installed_size', 'section,size')
+
+
+def make_predicate(expression=None):
+    """Compiles a predicate rejecting the packages from BLACKLIST and, if expression is
+    specified, the packages not matching it.
+    """
+
+    blacklist = 'package not in ({})'.format(', '.join(BLACKLIST))
+    if expression:
+        compile_filter(expression)  # reports the syntax errors relative to expression
+        return compile_filter(f'({blacklist}) and ({expression})')
+    return compile_filter(blacklist)
+
+
+class TimedPredicate:
+    """Charges the evaluations of a predicate to the filter stage of laps, and the time
+    since the previous lap, spent parsing, to the parse stage.
+    """
+
+    def __init__(self, predicate, laps):
+        self.fields = predicate.fields
+        self.evaluated = 0
+        self._predicate = predicate
+        self._laps = laps
+
+    def __call__(self, paragraph):
+        self._laps.lap('parse')
+        self.evaluated += 1
+        result = self._predicate(paragraph)
+        self._laps.lap('filter')
+        return result
+
+
+class BatchWriter:
+    """Loads documents into a storage backend in bulk writes of a bounded size.
+
+    A batch is handed over as soon as it holds max_docs documents or roughly max_bytes bytes,
+    so memory use does not depend on the size of the index file. The batches are written by
+    a pool of writer threads fed through a bounded queue: parsing goes on while the database
+    is busy, but it blocks once queue_size batches are waiting to be written.
+    """
+
+    def __init__(self, backend, max_docs, max_bytes, writers=1, queue_size=4, report=None):
+        self._backend = backend
+        self._report = report
+        self._max_docs = max_docs
+        self._max_bytes = max_bytes
+
+        self._batch = []
+        self._batch_bytes = 0
+        self._lock = threading.Lock()
+        self._error = None
+        self.batches = 0
+        self.total = 0
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._threads = [threading.Thread(target=self._drain, daemon=True)
+                         for _ in range(writers)]
+        for thread in self._threads:
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if exc_type is not None:
+            # The exception of the body is the one to report, not a writer error it may
+            # have caused.
+            self._stop()
+            return
+
+        try:
+            self.flush()
+        finally:
+            self.close()
+
+    def add(self, document):
+        self._batch.append(document)
+        self._batch_bytes += sum(len(key) + len(str(value)) for key, value in document.items())
+        if len(self._batch) >= self._max_docs or self._batch_bytes >= self._max_bytes:
+            self.flush()
+
+    def flush(self):
+        if self._error is not None:
+            raise self._error
+
+        if self._batch:
+            self._queue.put((self._batch, self._batch_bytes))  # blocks when writers lag behind
+            self._batch = []
+            self._batch_bytes = 0
+
+    def close(self):
+        """Waits for the queued batches to be written and stops the writers."""
+
+        self._stop()
+        if self._error is not None:
+            raise self._error
+
+    def _stop(self):
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def _drain(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if self._error is not None:
+                continue  # keep draining so that the parser is not blocked forever
+
+            batch, batch_bytes = item
+            start, start_cpu = time.perf_counter(), time.thread_time()
+            try:
+                self._backend.bulk_load(batch)
+            except Exception as exc:  # pylint: disable=broad-except
+                self._error = exc
+                continue
+            elapsed = max(time.perf_counter() - start, 1e-6)
+            if self._report is not None:
+                self._report.add('db_write', elapsed, time.thread_time() - start_cpu,
+                                 batch_bytes, len(batch))
+
+            with self._lock:
+                self.batches += 1
+                self.total += len(batch)
+                sys.stderr.write(f'\rBatch {self.batches}: {len(batch)} documents '
+                                 f'({batch_bytes} bytes) in {elapsed:.2f}s, '
+                                 f'{len(batch) / elapsed:.0f} documents/s\n')
+
+
+def to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def make_document(paragraph):
+    try:
+        version_key = version_sort_key(paragraph['version'])
+    except ValueError:
+        version_key = None
+
+    document = {
+        'package': paragraph['package'],
+        'description': paragraph['description'],
+        'version': paragraph['version'],
+        # Lets the versions be compared and sorted in the database.
+        'version_key': version_key,
+        'architecture': paragraph.get('architecture'),
+        'section': paragraph.get('section'),
+        'size': to_int(paragraph.get('size')),
+        'installed_size': to_int(paragraph.get('installed-size')),
+    }
+    # Lets the delta mode tell whether the stored document is outdated.
+    document['content_hash'] = hashlib.sha1(
+        json.dumps(document, sort_keys=True).encode('utf-8')
+    ).hexdigest()
+
+    return document
+
+
+def index_spec(value):
+    """Converts a comma-separated list of document fields, each optionally prefixed with -
+    for the descending order, to a list of (field, direction) pairs.
+    """
+
+    index = []
+    for field in value.split(','):
+        direction = 1
+        if field.startswith('-'):
+            field = field[1:]
+            direction = -1
+        if not re.match(r'^[a-z_]+$', field):
+            raise argparse.ArgumentTypeError(f'invalid field name: {field!r}')
+        index.append((field, direction))
+
+    return index
+
+
+def download(index_file):
+    # The Debian index files are looked up in the Release file of the suite and verified
+    # against it, so there are no variants to probe.
+    sys.stderr.write('Downloading the index file...\n')
+    try:
+        size = index_file.download()
+    except (HTTPError, IndexFileCorrupted, IndexFileNotListed, ReleaseFileNotFound) as exc:
+        sys.stderr.write(f'Could not download an index file: {exc}\n')
+        sys.exit(1)
+
+    sys.stderr.write(f'Downloaded {index_file.url} ({size} bytes)\n')
+    return size
+
+
+def update_local_copy(args, collection_name):
+    """Brings the local copy of the Packages file up to date using pdiff and
+    returns the packages the patches have added, changed and removed, or None
+    if the whole file had to be downloaded.
+
+    The local copy is only trusted if the changes it brought were written to the
+    collection (see mark_committed). Otherwise it is downloaded again, so that the
+    collection is reloaded from the whole file.
+    """
+
+    remote = urllib.parse.urljoin(
+        args.mirror, f'dists/{args.suite}/{args.section}/binary-{args.arch}/Packages'
+    )
+    local = os.path.join(args.state_dir, f'{collection_name}-{args.section}-Packages')
+    marker = local + '.committed'
+    if os.path.exists(marker):
+        os.remove(marker)
+    elif os.path.exists(local):
+        sys.stderr.write(f'The previous changes of {local} were not written, reloading\n')
+        os.remove(local)
+
+    # The patches are only worth it while they are smaller than the full download, which is
+    # checked against the Release file like the downloads of the index files.
+    index_file = DebianIndexFile(args.distro, args.suite, args.arch, args.mirror, args.section)
+    try:
+        full_sha256, full_size = index_file.get_release().lookup(
+            f'{args.section}/binary-{args.arch}/Packages.gz', 'SHA256')
+    except (HTTPError, KeyError, ReleaseFileNotFound) as exc:
+        sys.stderr.write(f'Could not find the size of the full download: {exc!r}\n')
+        full_sha256 = full_size = None
+
+    tracker = ChangeTracker()
+    sys.stderr.write(f'Updating {local} from {remote}...\n')
+    lines = update_file(remote, local, full_size=full_size, tracker=tracker,
+                        log=lambda message: sys.stderr.write(f'pdiff: {message}\n'),
+                        full_sha256=full_sha256)
+
+    return local, tracker.changes(lines)
+
+
+def mark_committed(local):
+    """Records that the collection holds the contents of the local copy."""
+
+    with open(local + '.committed', 'w'):
+        pass
+
+
+def profile_memory(index_file, report):
+    """Adds the memory held per paragraph and per document, and the source lines which
+    allocate it, to the report. The index file is parsed once for the paragraphs and once
+    for the documents. The parser counters are paused meanwhile, so that they only count
+    the load.
+    """
+
+    counting = instrumentation_enabled()
+    disable_instrumentation()
+    try:
+        with RetainedMemory() as paragraphs_memory:
+            sample = list(itertools.islice(index_file.iter_paragraphs(), MEMORY_SAMPLE))
+        n = len(sample) or 1
+        del sample
+
+        with RetainedMemory() as documents_memory:
+            documents = [make_document(paragraph) for paragraph
+                         in itertools.islice(index_file.iter_paragraphs(), MEMORY_SAMPLE)]
+        del documents
+    finally:
+        if counting:
+            enable_instrumentation()
+
+    report.info['memory'] = {
+        'sample': n,
+        'bytes_per_paragraph': round(paragraphs_memory.bytes / n),
+        'bytes_per_document': round(documents_memory.bytes / n),
+        'paragraph_sites': paragraphs_memory.top(),
+        'document_sites': documents_memory.top(),
+    }
+
+
+def apply_changes(backend, changes, predicate, report):
+    with report.measure('documents') as stage:
+        documents = []
+        removed = list(changes.removed)
+        for name, text in itertools.chain(changes.added.items(), changes.changed.items()):
+            paragraph = Deb822(text)
+            if predicate(paragraph):
+                documents.append(make_document(paragraph))
+            elif name in changes.changed:
+                # The package may have been stored before it stopped matching the predicate.
+                removed.append(name)
+        stage.items = len(documents)
+
+    sys.stderr.write('{} added, {} changed, {} removed\n'.format(
+        len(changes.added), len(changes.changed), len(changes.removed)))
+    with report.measure('db_write') as stage:
+        backend.update(documents, removed)
+        stage.items = len(documents) + len(removed)
+
+    return len(documents)
+
+
+def load_full(backend, paragraphs, laps, args, report):
+    """Inserts the documents made of paragraphs, which are read within laps."""
+
+    n = 0
+    progress = Progress('Packages processed')
+    # The time the parser spends blocked on the writers goes to db_wait.
+    with laps:
+        with BatchWriter(backend, args.batch_size, args.batch_bytes,
+                         args.writers, args.queue_size, report) as writer:
+            for paragraph in paragraphs:
+                laps.lap('parse')
+                document = make_document(paragraph)
+                laps.lap('documents')
+                writer.add(document)
+                laps.lap('db_wait')
+                n += 1
+                progress.update(n)
+        laps.lap('db_wait')
+
+    report.add('documents', items=n)
+    return n
+
+
+def load_delta(backend, paragraphs, laps, args, report):
+    """Brings the stored documents in line with paragraphs, which are read within laps,
+    writing only the documents whose content hash differs from the stored one and deleting
+    the packages which are gone. The documents are written as they come, in batches of
+    args.batch_size documents.
+    """
+
+    with report.measure('db_read') as stage:
+        stored = backend.hashes()
+        stage.items = len(stored)
+
+    n = 0
+    written = 0
+    seen = set()
+    pending = {}  # package -> document, so that a package listed twice is written once
+    progress = Progress('Packages processed')
+    with laps:
+        for paragraph in paragraphs:
+            laps.lap('parse')
+            document = make_document(paragraph)
+            name = document['package']
+            seen.add(name)
+            if stored.get(name) != document['content_hash']:
+                pending[name] = document
+                # Another paragraph of the package is only written if it differs.
+                stored[name] = document['content_hash']
+            laps.lap('documents')
+            if len(pending) >= args.batch_size:
+                backend.update(list(pending.values()), ())
+                written += len(pending)
+                pending.clear()
+                laps.lap('db_write')
+            n += 1
+            progress.update(n)
+
+    report.add('documents', items=n)
+
+    vanished = [name for name in stored if name not in seen]
+
+    sys.stderr.write('\r{} documents to update, {} to delete\n'.format(
+        written + len(pending), len(vanished)))
+    with report.measure('db_write') as stage:
+        backend.update(list(pending.values()), vanished)
+        stage.items = written + len(pending) + len(vanished)
+
+    return n
+
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--arch', default='armhf', help='The architecture of the distribution')
+    parser.add_argument('--backend', choices=('mongo', 'sqlite'), default='mongo',
+                        help='The storage the packages metadata is loaded into')
+    parser.add_argument('--batch-bytes', type=int, default=16 * 1024 * 1024,
+                        help='The approximate size in bytes of the batches the documents are '
+                             'inserted in')
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help='The maximum number of documents inserted in one batch')
+    parser.add_argument('--delta', action='store_true',
+                        help='Update only the documents which have changed since the previous '
+                             'run and delete the ones which are gone instead of inserting '
+                             'everything')
     parser.add_argument('--distro', default='raspbian',
                         help=f'The distribution name. The option takes the following values: '
                              f'{", ".join(ALLOWED_DISTROS)}')
+    parser.add_argument('--filter',
+                        help='Load only the packages matching a filter expression, e.g. '
+                             '"section == utils and size < 1000000 and not package ~ \'^lib\'" '
+                             '(see appleseed/filter.py for the syntax). The packages from the '
+                             'built-in blacklist are always skipped')
+    parser.add_argument('--index', action='append', type=index_spec, dest='indexes',
+                        help=f'A secondary index to create after loading the packages, given as a '
+                             f'comma-separated list of document fields, each of which may be '
+                             f'prefixed with - for the descending order. The option can be '
+                             f'specified several times (the default is '
+                             f'{" ".join("--index " + spec for spec in DEFAULT_INDEXES)})')
     parser.add_argument('--mirror', default='http://archive.raspbian.org/raspbian/',
                         help='The address of the repository where the packages of the '
                              'distribution can be found')
     parser.add_argument('--mongodb-host', default='127.0.0.1', help='The MongoDB host')
     parser.add_argument('--mongodb-port', type=int, default=27017,
                         help='The MongoDB port the server listens on')
+    parser.add_argument('--parser-counters', action='store_true',
+                        help='Count the paragraphs, lines and bytes the parser goes through and '
+                             'how often it falls back to its slow paths, and add the counts to '
+                             'the report')
+    parser.add_argument('--profile-memory', action='store_true',
+                        help='Trace the memory allocations and add the peak memory of each stage, '
+                             'the memory held per parsed paragraph and the source lines '
+                             'allocating it to the report. The run is noticeably slower')
+    parser.add_argument('--queue-size', type=int, default=4,
+                        help='The number of parsed batches allowed to wait for the writers')
+    parser.add_argument('--report',
+                        help='Write a JSON report with the wall time, CPU time and bytes of each '
+                             'stage of the run to the specified file (- for stdout)')
     parser.add_argument('--section', default='main',
                         help='The section name of the distribution (e.g. main, universe, etc.)')
+    parser.add_argument('--snapshot-dir',
+                        help='A directory where binary snapshots of the parsed index files are '
+                             'kept, so that an index file which has already been seen is not '
+                             'parsed again')
+    parser.add_argument('--sqlite-path', default='cusdeb.sqlite3',
+                        help='The SQLite database file used by the sqlite backend')
     parser.add_argument('--suite', default='buster',
                         help='The distribution code name of version (e.g. Buster, Focal, etc.)')
+    parser.add_argument('--state-dir',
+                        help='A directory where the local copy of the index file is kept between '
+                             'runs. When specified, the collection is updated incrementally using '
+                             'the pdiff patches published by the mirror (not supported for Alpine)')
+    parser.add_argument('--swap', action='store_true',
+                        help='Load the packages into a staging collection, index it and then '
+                             'replace the live collection with it in one step, so that readers '
+                             'never see a half-loaded collection')
     parser.add_argument('--temp-dir', default='/tmp',
                         help='A temporary directory where the target index files will be located')
+    parser.add_argument('--writers', type=int, default=2,
+                        help='The number of threads writing the batches into the database')
 
     args = parser.parse_args()
+    if args.indexes is None:
+        args.indexes = [index_spec(spec) for spec in DEFAULT_INDEXES]
+    try:
+        args.predicate = make_predicate(args.filter)
+    except FilterSyntaxError as exc:
+        parser.error(f'--filter: {exc}')
+    if args.delta and args.swap:
+        parser.error('--delta and --swap cannot be used together')
+    for option in ('parser_counters', 'profile_memory'):
+        if getattr(args, option) and not args.report:
+            parser.error('--{} requires --report'.format(option.replace('_', '-')))
 
     args.mirror = os.path.join(args.mirror, '')  # add trailing slash
 
+    if args.state_dir and args.distro == 'alpine':
+        sys.stderr.write('Incremental updates are not supported for Alpine\n')
+        sys.exit(1)
+
+    collection_name = '{}-{}-{}'.format(args.distro, args.suite,
+                                        args.arch)
+
+    if args.backend == 'sqlite':
+        backend = SQLiteBackend(args.sqlite_path, collection_name)
+    else:
+        backend = MongoBackend(collection_name, args.mongodb_host, args.mongodb_port)
+
+    report = RunReport(distro=args.distro, suite=args.suite, arch=args.arch,
+                       section=args.section, backend=args.backend)
+    status = 'failed'
+    if args.parser_counters:
+        enable_instrumentation()
+    if args.profile_memory:
+        tracemalloc.start()
+    try:
+        report.info['packages'] = index(args, backend, report)
+        status = 'ok'
+    finally:
+        backend.close()
+        if args.report:
+            report.info['status'] = status
+            if args.parser_counters:
+                report.info['parser'] = instrumentation_snapshot()
+            report.write(args.report)
+
+
+def index(args, backend, report):
+    location = args.mirror
+    if args.state_dir:
+        with report.measure('download'):
+            location, changes = update_local_copy(args, backend.name)
+        if changes is not None:
+            n = apply_changes(backend, changes, args.predicate, report)
+            mark_committed(location)
+            return n
+
+        if not args.delta and not args.swap:
+            # The whole file was downloaded, so the patches cannot tell what
+            # has changed in the collection.
+            backend.drop()
+
+    target = backend.staging() if args.swap else backend
+
     index_file_cls = AlpineIndexFile if args.distro == 'alpine' else DebianIndexFile
-    with index_file_cls(args.distro, args.suite, args.arch, args.mirror, args.section,
+    with index_file_cls(args.distro, args.suite, args.arch, location, args.section,
                         args.temp_dir) as index_file:
-        for url in index_file.get_url():
-            sys.stderr.write(f'Downloading {url}...\n')
+        if not args.state_dir:
+            with report.measure('download') as stage:
+                stage.bytes = download(index_file)
 
-            try:
-                index_file.download()
-                break
-            except HTTPError as exc:
-                sys.stderr.write(f'Could not download an index file: {exc}\n')
-                continue
-        else:
-            sys.exit(1)
-
-        n = 0
-        packages_list = []
-        for paragraph in index_file.iter_paragraphs():
-            if paragraph['package'] not in BLACKLIST:
-                packages_list.append({
-                    'package': paragraph['package'],
-                    'description': paragraph['description'],
-                    'version': paragraph['version'],
-                    'size': paragraph['size'],
-                })
-                n += 1
-            sys.stderr.write('\rPackages processed: {}'.format(n))
-            sys.stderr.flush()
+        with report.measure('decompress') as stage:
+            stage.bytes = index_file.decompress()
+        report.add('parse', nbytes=stage.bytes)
 
-    sys.stderr.write('\n')
+        # The predicate is evaluated by the parser, before the paragraphs are built.
+        laps = Laps(report)
+        predicate = TimedPredicate(args.predicate, laps)
+        if args.snapshot_dir:
+            paragraphs = index_file.iter_cached_paragraphs(args.snapshot_dir, predicate)
+        else:
+            paragraphs = index_file.iter_paragraphs(predicate)
 
-    collection_name = '{}-{}-{}'.format(args.distro, args.suite,
-                                        args.arch)
-    db_name = 'cusdeb'
+        if args.delta:
+            sys.stderr.write('Updating the packages metadata in {}...\n'.format(backend.name))
+            n = load_delta(backend, paragraphs, laps, args, report)
+        else:
+            sys.stderr.write('Inserting the packages metadata into {}...\n'.format(target.name))
+            n = load_full(target, paragraphs, laps, args, report)
+            with report.measure('db_write'):
+                target.commit()
+        report.add('parse', items=predicate.evaluated)
+        report.add('filter', items=n)
 
-    client = MongoClient(args.mongodb_host, args.mongodb_port)
-    db = client[db_name]
-    packages_collection = db[collection_name]
+        if args.profile_memory:
+            # The records read from a snapshot do not outlive the iteration, so the
+            # paragraphs of the parser are measured even with --snapshot-dir.
+            sys.stderr.write('Measuring the memory held by the paragraphs...\n')
+            profile_memory(index_file, report)
 
-    sys.stderr.write('{} packages have been processed\n'.format(n))
+    sys.stderr.write('\r{} packages have been processed\n'.format(n))
 
-    sys.stderr.write('Inserting the packages metadata into the {} '
-                     'collection...\n'.format(collection_name))
-    packages_collection.insert_many(packages_list)
+    # With --swap, the index is built in one pass over the loaded data, which is faster than
+    # maintaining it during the inserts.
     sys.stderr.write('Creating indices...\n')
-    packages_collection.create_index(
-        [('package', 'text')], name='search_index', weights={'package': 100}
-    )
+    with report.measure('index_build'):
+        target.create_indexes(args.indexes)
+
+    if args.swap:
+        sys.stderr.write('Replacing {} with {}...\n'.format(backend.name, target.name))
+        with report.measure('swap'):
+            backend.replace_with(target)
+
+    if args.state_dir:
+        mark_committed(location)
+
+    return n
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,65 @@
+import unittest
+
+from appleseed.deb822 import Release
+
+RELEASE = '''Origin: Debian
+Suite: unstable
+Codename: sid
+Date: Sat, 01 Jul 2023 08:00:00 UTC
+Acquire-By-Hash: yes
+MD5Sum:
+ 0cc175b9c0f1b6a831c399e269772661           123456 main/binary-amd64/Packages
+ 92eb5ffee6ae2fec3ad71c777531578f             4567 main/binary-amd64/Packages.xz
+SHA256:
+ ca978112ca1bbdcafac231b39a23dc4da786eff8147c4e72b9807785afee48bb           123456 main/binary-amd64/Packages
+ 3e23e8160039594a33894f6564e1b1348bbd7a0088d42c4acb73eeaed59c009d             4567 main/binary-amd64/Packages.xz
+ 2e7d2c03a9507ae265ecf5b5356885a53393a2029d241394997265a1a25aefc6              789 main/i18n/Translation-en.xz
+'''
+
+
+class ReleaseTest(unittest.TestCase):
+    def setUp(self):
+        self.release = Release(RELEASE)
+
+    def test_lookup(self):
+        self.assertEqual(
+            self.release.lookup('main/binary-amd64/Packages.xz'),
+            ('3e23e8160039594a33894f6564e1b1348bbd7a0088d42c4acb73eeaed59c009d', 4567))
+        self.assertEqual(self.release.lookup('main/binary-amd64/Packages', 'MD5Sum'),
+                         ('0cc175b9c0f1b6a831c399e269772661', 123456))
+        with self.assertRaises(KeyError):
+            self.release.lookup('main/binary-arm64/Packages.xz')
+        with self.assertRaises(KeyError):
+            self.release.lookup('main/binary-amd64/Packages', 'SHA512')
+
+    def test_checksums(self):
+        checksums = self.release.checksums('SHA256')
+        self.assertEqual(sorted(checksums), ['main/binary-amd64/Packages',
+                                             'main/binary-amd64/Packages.xz',
+                                             'main/i18n/Translation-en.xz'])
+        self.assertEqual(checksums['main/i18n/Translation-en.xz'][1], 789)
+
+    def test_lookup_after_parsing(self):
+        files = self.release['SHA256']
+        self.assertEqual(len(files), 3)
+        self.assertEqual(files[2]['name'], 'main/i18n/Translation-en.xz')
+        self.assertEqual(self.release.lookup('main/i18n/Translation-en.xz'),
+                         ('2e7d2c03a9507ae265ecf5b5356885a53393a2029d241394997265a1a25aefc6',
+                          789))
+
+    def test_lookup_after_setting(self):
+        self.release.lookup('main/binary-amd64/Packages.xz')
+        self.release['SHA256'] = [{'sha256': 'ab' * 32, 'size': '10',
+                                   'name': 'main/binary-amd64/Packages.gz'}]
+        self.assertEqual(self.release.lookup('main/binary-amd64/Packages.gz'), ('ab' * 32, 10))
+        with self.assertRaises(KeyError):
+            self.release.lookup('main/binary-amd64/Packages.xz')
+
+    def test_dump(self):
+        self.assertEqual(Release(self.release.dump()).checksums(),
+                         self.release.checksums())
+        self.assertEqual(Release(self.release.dump())['Codename'], 'sid')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+import itertools
+import os.path
+import random
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from appleseed.debian_support import (PDIFF_PATCH_OVERHEAD, ChangeTracker, NativeVersion,
+                                      patches_from_ed_script, plan_update, version_sort_key)
+
+VERSIONS = ['0', '1', '1.0', '1.0-0', '1.0-1', '1.00', '1.0.0', '1.0~rc1', '1.0~rc1~1',
+            '1.0+b1', '1.0-1+b1', '1.0-1~bpo1', '1~', '1a', '1A', '1.a', '1:0', '0:1.0',
+            '2:1.0', '10', '9', '2.30', '2.4', '1.0-10', '1.0-9', '1.0-1.1', '1.0-a',
+            '1.2.3+dfsg-4ubuntu1', '1.2.3+dfsg-4ubuntu1~18.04.1', '20230101', '1:2.30~rc1-3']
+
+
+def _paragraph(name, version, extra=''):
+    return f'Package: {name}\nVersion: {version}\n{extra}Description: {name}\n more\n\n'
+
+
+def _render(packages):
+    return ''.join(_paragraph(name, *fields) for name, fields in sorted(packages.items()))
+
+
+class PlanUpdateTest(unittest.TestCase):
+    def test_patches_when_the_full_size_is_unknown(self):
+        use_patches, reason = plan_update([10 ** 9], None)
+        self.assertTrue(use_patches)
+        self.assertIn('unknown', reason)
+
+    def test_patches_when_cheaper(self):
+        use_patches, _reason = plan_update([1000, 2000], 10 ** 6)
+        self.assertTrue(use_patches)
+
+    def test_full_download_when_cheaper(self):
+        use_patches, _reason = plan_update([400000, 700000], 10 ** 6)
+        self.assertFalse(use_patches)
+
+    def test_overhead_is_charged_per_patch(self):
+        full_size = 10 * PDIFF_PATCH_OVERHEAD
+        self.assertTrue(plan_update([1] * 9, full_size)[0])
+        self.assertFalse(plan_update([1] * 10, full_size)[0])
+        self.assertTrue(plan_update([1] * 10, full_size, overhead=0)[0])
+
+    def test_tie_goes_to_the_full_download(self):
+        self.assertFalse(plan_update([1000], 1000, overhead=0)[0])
+
+
+def _sign(n):
+    return (n > 0) - (n < 0)
+
+
+def _random_version(rng):
+    version = rng.choice('0123456789') + ''.join(rng.choice('0123456789.+~abZ')
+                                                 for _ in range(rng.randint(0, 5)))
+    if rng.random() < 0.5:
+        version += '-' + ''.join(rng.choice('0123456789.+~ab')
+                                 for _ in range(rng.randint(1, 4)))
+    if rng.random() < 0.2:
+        version = f'{rng.randint(0, 3)}:{version}'
+    return version
+
+
+class VersionSortKeyTest(unittest.TestCase):
+    def assertSameOrder(self, versions):
+        keys = {version: version_sort_key(version) for version in versions}
+        for a, b in itertools.product(versions, repeat=2):
+            expected = _sign(NativeVersion(a)._compare(b))  # pylint: disable=protected-access
+            self.assertEqual(_sign((keys[a] > keys[b]) - (keys[a] < keys[b])), expected,
+                             (a, b, keys[a], keys[b]))
+
+    def test_same_order_as_native_version(self):
+        self.assertSameOrder(VERSIONS)
+
+    def test_same_order_on_random_versions(self):
+        rng = random.Random(0)
+        self.assertSameOrder(sorted({_random_version(rng) for _ in range(300)}))
+
+    def test_sorting(self):
+        self.assertEqual(sorted(VERSIONS, key=version_sort_key),
+                         [str(version) for version in sorted(map(NativeVersion, VERSIONS))])
+
+    def test_version_object(self):
+        self.assertEqual(version_sort_key(NativeVersion('1.0-1')), version_sort_key('1.0-1'))
+
+    def test_invalid_version(self):
+        for version in ('', '1:', '1.0 beta'):
+            with self.assertRaises(ValueError):
+                version_sort_key(version)
+
+
+@unittest.skipUnless(shutil.which('diff'), 'diff is not installed')
+class ChangeTrackerTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._dir.cleanup)
+
+    def _ed_script(self, old, new):
+        # The pdiff patches of the archive are made by diff --ed.
+        paths = []
+        for name, text in (('old', old), ('new', new)):
+            paths.append(os.path.join(self._dir.name, name))
+            with open(paths[-1], 'w') as outfile:
+                outfile.write(text)
+        return subprocess.run(['diff', '--ed'] + paths, stdout=subprocess.PIPE,
+                              universal_newlines=True).stdout.splitlines(True)
+
+    def _track(self, states):
+        lines = states[0].splitlines(True)
+        tracker = ChangeTracker()
+        tracker.start(lines)
+        for old, new in zip(states, states[1:]):
+            tracker.patch_lines(lines, patches_from_ed_script(self._ed_script(old, new)))
+        self.assertEqual(''.join(lines), states[-1])
+        return tracker.changes(lines)
+
+    def test_chain(self):
+        packages = {f'pkg{i}': ('1', ) for i in range(20)}
+        states = [_render(packages)]
+
+        packages['pkg3'] = ('2', )
+        del packages['pkg7']
+        packages['pkg10a'] = ('1', )
+        states.append(_render(packages))
+
+        packages['pkg3'] = ('3', )
+        packages['pkg12'] = ('1', 'Depends: pkg3\n')
+        del packages['pkg10a']
+        del packages['pkg19']
+        packages['pkg2a'] = ('1', )
+        states.append(_render(packages))
+
+        changes = self._track(states)
+        self.assertEqual(set(changes.added), {'pkg2a'})
+        self.assertEqual(set(changes.changed), {'pkg3', 'pkg12'})
+        self.assertEqual(set(changes.removed), {'pkg7', 'pkg19'})
+        # The texts stop before the blank line ending the paragraphs.
+        self.assertEqual(changes.changed['pkg3'], _paragraph('pkg3', '3')[:-1])
+        self.assertEqual(changes.removed['pkg7'], _paragraph('pkg7', '1')[:-1])
+
+    def test_reverted_change(self):
+        packages = {f'pkg{i}': ('1', ) for i in range(5)}
+        first = _render(packages)
+        packages['pkg2'] = ('2', )
+        changes = self._track([first, _render(packages), first])
+        self.assertEqual((changes.added, changes.changed, changes.removed), ({}, {}, {}))
+
+    def test_invalidated(self):
+        tracker = ChangeTracker()
+        tracker.start(_render({'pkg': ('1', )}).splitlines(True))
+        tracker.invalidate()
+        self.assertIsNone(tracker.changes([]))
+
+
+if __name__ == '__main__':
+    unittest.main()
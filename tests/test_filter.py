@@ -0,0 +1,111 @@
+import unittest
+
+from appleseed.deb822 import Deb822, Packages
+from appleseed.filter import FilterSyntaxError, compile_filter
+
+PACKAGES = '''Package: vim
+Section: editors
+Priority: optional
+Installed-Size: 3967
+
+Package: libc6
+Section: libs
+Priority: required
+Installed-Size: 12987
+
+Package: 0ad-data
+Section: games
+Installed-Size: many
+
+Package: emacs
+Section: editors
+Priority: optional
+Installed-Size: 104
+'''
+
+
+def _paragraphs():
+    return [Deb822(text) for text in PACKAGES.split('\n\n')]
+
+
+class CompileFilterTest(unittest.TestCase):
+    def assertMatches(self, expression, names):
+        predicate = compile_filter(expression)
+        self.assertEqual([paragraph['package'] for paragraph in _paragraphs()
+                          if predicate(paragraph)], names)
+
+    def test_comparisons(self):
+        self.assertMatches('section == editors', ['vim', 'emacs'])
+        self.assertMatches('section != editors', ['libc6', '0ad-data'])
+        self.assertMatches('package < emacs', ['0ad-data'])
+        self.assertMatches("package == 'libc6'", ['libc6'])
+
+    def test_numbers(self):
+        self.assertMatches('installed-size < 4000', ['vim', 'emacs'])
+        self.assertMatches('installed-size >= 3967', ['vim', 'libc6'])
+        # Unlike strings, the numbers are not compared character by character.
+        self.assertMatches('installed-size > 200', ['vim', 'libc6'])
+        # A quoted value is a string.
+        self.assertMatches("installed-size > '200'", ['vim', '0ad-data'])
+
+    def test_regular_expressions(self):
+        self.assertMatches("package ~ '^lib'", ['libc6'])
+        self.assertMatches("package !~ '^lib'", ['vim', '0ad-data', 'emacs'])
+        self.assertMatches('package ~ c[0-9]$', ['libc6'])
+        # Backslashes escape the next character in quoted strings.
+        self.assertMatches(r"package ~ '\\d'", ['libc6', '0ad-data'])
+
+    def test_membership(self):
+        self.assertMatches('package in (vim, emacs, nano)', ['vim', 'emacs'])
+        self.assertMatches("package not in (vim, 'emacs')", ['libc6', '0ad-data'])
+
+    def test_missing_fields_do_not_match(self):
+        self.assertMatches('priority == optional', ['vim', 'emacs'])
+        self.assertMatches('priority != optional', ['libc6'])
+        self.assertMatches('not priority == optional', ['libc6', '0ad-data'])
+        self.assertMatches('homepage ~ .', [])
+
+    def test_boolean_operators(self):
+        self.assertMatches('section == editors and installed-size > 1000', ['vim'])
+        self.assertMatches('section == libs or section == games', ['libc6', '0ad-data'])
+        self.assertMatches('section == games or section == libs and priority == optional',
+                           ['0ad-data'])
+        self.assertMatches('(section == games or section == libs) and priority == required',
+                           ['libc6'])
+        self.assertMatches('not not package == vim', ['vim'])
+
+    def test_case_insensitive(self):
+        self.assertMatches('SECTION == editors AND Package ~ v', ['vim'])
+        self.assertMatches('section == Editors', [])
+
+    def test_fields(self):
+        predicate = compile_filter("Section == editors and not (package ~ '^lib' or size < 10)")
+        self.assertEqual(predicate.fields, {'section', 'package', 'size'})
+
+    def test_parsers_evaluate_the_predicate(self):
+        predicate = compile_filter('section == editors or installed-size > 10000')
+        lines = PACKAGES.encode('utf-8').splitlines(True)
+        self.assertEqual([paragraph['package'] for paragraph
+                          in Packages.iter_paragraphs(lines, use_apt_pkg=False,
+                                                      predicate=predicate)],
+                         ['vim', 'libc6', 'emacs'])
+
+    def test_syntax_errors(self):
+        for expression, pos in (('', 0),
+                                ('section ==', 10),
+                                ('section editors', 8),
+                                ('== editors', 0),
+                                ('(section == editors', 19),
+                                ('section == editors)', 18),
+                                ('package in vim', 11),
+                                ('package in (vim,)', 16),
+                                ("package ~ '['", 10),
+                                ('package == vim &', 15)):
+            with self.assertRaises(FilterSyntaxError) as context:
+                compile_filter(expression)
+            self.assertEqual(context.exception.pos, pos, expression)
+            self.assertIsInstance(context.exception, ValueError)
+
+
+if __name__ == '__main__':
+    unittest.main()
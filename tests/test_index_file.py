@@ -0,0 +1,142 @@
+import functools
+import gzip
+import hashlib
+import http.server
+import lzma
+import os
+import os.path
+import tempfile
+import threading
+import unittest
+
+from appleseed import (DebianIndexFile, IndexFileCorrupted, IndexFileNotListed,
+                       ReleaseFileNotFound)
+from appleseed.debian_support import download_file
+
+PACKAGES = b''.join(b'Package: pkg%d\nVersion: 1.%d\nDescription: package %d\n\n' % (i, i, i)
+                    for i in range(50))
+GZIPPED = gzip.compress(PACKAGES, mtime=0)
+XZ = lzma.compress(PACKAGES)
+INDEX = 'main/binary-amd64/Packages'
+
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _release(files, by_hash=False):
+    lines = ['Suite: sid\n']
+    if by_hash:
+        lines.append('Acquire-By-Hash: yes\n')
+    lines.append('SHA256:\n')
+    for name, (sha256, size) in files.items():
+        lines.append(f' {sha256} {size:16} {name}\n')
+    return ''.join(lines).encode('utf-8')
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
+class IndexFileTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls._dir = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(cls._dir.cleanup)
+        cls.mirror = os.path.join(cls._dir.name, 'mirror')
+
+        handler = functools.partial(_QuietHandler, directory=cls.mirror)
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        cls.addClassCleanup(server.server_close)
+        cls.addClassCleanup(server.shutdown)
+        cls.location = 'http://127.0.0.1:{}/'.format(server.server_address[1])
+
+    def _suite(self, name, release, files, release_name='Release'):
+        suite_dir = os.path.join(self.mirror, 'dists', name)
+        for path, data in dict(files, **{release_name: release}).items():
+            path = os.path.join(suite_dir, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as outfile:
+                outfile.write(data)
+
+    def _download(self, suite):
+        with DebianIndexFile('debian', suite, 'amd64', self.location, 'main',
+                             self._dir.name) as index_file:
+            index_file.download()
+            size = index_file.decompress()
+            path = index_file._index_file_path  # pylint: disable=protected-access
+            with open(path, 'rb') as infile:
+                data = infile.read()
+            self.assertEqual(size, len(data))
+            return index_file.url, data
+
+    def test_preferred_compression(self):
+        self._suite('good', _release({INDEX: (_sha256(PACKAGES), len(PACKAGES)),
+                                      INDEX + '.gz': (_sha256(GZIPPED), len(GZIPPED)),
+                                      INDEX + '.xz': (_sha256(XZ), len(XZ))}),
+                     {INDEX + '.gz': GZIPPED, INDEX + '.xz': XZ}, release_name='InRelease')
+        url, data = self._download('good')
+        self.assertTrue(url.endswith('/dists/good/main/binary-amd64/Packages.xz'))
+        self.assertEqual(data, PACKAGES)
+
+    def test_variants_missing_from_the_mirror_are_skipped(self):
+        self._suite('uncompressed', _release({INDEX: (_sha256(PACKAGES), len(PACKAGES)),
+                                              INDEX + '.gz': (_sha256(GZIPPED), len(GZIPPED))}),
+                     {INDEX: PACKAGES})
+        url, data = self._download('uncompressed')
+        self.assertTrue(url.endswith('/Packages'))
+        self.assertEqual(data, PACKAGES)
+
+    def test_by_hash(self):
+        self._suite('by-hash', _release({INDEX + '.gz': (_sha256(GZIPPED), len(GZIPPED))},
+                                        by_hash=True),
+                     {f'main/binary-amd64/by-hash/SHA256/{_sha256(GZIPPED)}': GZIPPED})
+        url, data = self._download('by-hash')
+        self.assertTrue(url.endswith(_sha256(GZIPPED)))
+        self.assertEqual(data, PACKAGES)
+
+    def test_wrong_sha256(self):
+        self._suite('sha256', _release({INDEX + '.gz': (_sha256(XZ), len(GZIPPED))}),
+                     {INDEX + '.gz': GZIPPED})
+        with self.assertRaises(IndexFileCorrupted):
+            self._download('sha256')
+
+    def test_wrong_size(self):
+        for suite, size in (('smaller', len(GZIPPED) - 1), ('larger', len(GZIPPED) + 1)):
+            self._suite(suite, _release({INDEX + '.gz': (_sha256(GZIPPED), size)}),
+                         {INDEX + '.gz': GZIPPED})
+            with self.assertRaises(IndexFileCorrupted):
+                self._download(suite)
+
+    def test_not_listed(self):
+        self._suite('unlisted', _release({'contrib/binary-amd64/Packages.gz':
+                                          (_sha256(GZIPPED), len(GZIPPED))}),
+                     {INDEX + '.gz': GZIPPED})
+        with self.assertRaises(IndexFileNotListed):
+            self._download('unlisted')
+
+    def test_no_release_file(self):
+        os.makedirs(os.path.join(self.mirror, 'dists', 'empty'))
+        with self.assertRaises(ReleaseFileNotFound):
+            self._download('empty')
+
+    def test_full_download_is_verified(self):
+        self._suite('full', b'', {INDEX + '.gz': GZIPPED})
+        remote = self.location + 'dists/full/' + INDEX
+        local = os.path.join(self._dir.name, 'Packages')
+
+        lines = download_file(remote, local, expected_sha256=_sha256(GZIPPED))
+        self.assertEqual(''.join(lines).encode('utf-8'), PACKAGES)
+
+        with open(local, 'w') as outfile:
+            outfile.write('Package: old\n')
+        with self.assertRaises(ValueError):
+            download_file(remote, local, expected_sha256=_sha256(XZ))
+        with open(local) as infile:
+            self.assertEqual(infile.read(), 'Package: old\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import os.path
+import tempfile
+import unittest
+
+from appleseed.search import PackageSearchIndex, SearchIndexError
+
+NAMES = ['python3', 'python3-six', 'libpython3.11', 'py', 'vim', 'vim-tiny', 'neovim', 'Emacs']
+
+
+class PackageSearchIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = PackageSearchIndex.from_names(NAMES)
+        self._dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._dir.cleanup)
+        self.path = os.path.join(self._dir.name, 'packages.idx')
+
+    def test_prefix(self):
+        self.assertEqual(self.index.prefix('PY'), ['py', 'python3', 'python3-six'])
+        self.assertEqual(self.index.prefix('vim', limit=1), ['vim'])
+        self.assertEqual(self.index.prefix('x'), [])
+
+    def test_ranking(self):
+        self.assertEqual([name for name, _score in self.index.search('vim')],
+                         ['vim', 'vim-tiny', 'neovim'])
+
+    def test_every_word_matches(self):
+        self.assertEqual([name for name, _score in self.index.search('six python')],
+                         ['python3-six'])
+        self.assertEqual(self.index.search('vim six'), [])
+        self.assertEqual(self.index.search(' '), [])
+
+    def test_short_words_match_prefixes(self):
+        self.assertEqual({name for name, _score in self.index.search('em')}, {'emacs'})
+        self.assertEqual(self.index.search('ma'), [])
+
+    def test_round_trip(self):
+        self.index.save(self.path)
+        loaded = PackageSearchIndex.load(self.path)
+        self.assertEqual(len(loaded), len(NAMES))
+        for query in ('py', 'python', 'thon3', 'vim', 'six python', 'macs', 'nothing'):
+            self.assertEqual(loaded.search(query, limit=None), self.index.search(query, None))
+        self.assertEqual(loaded.prefix('python'), self.index.prefix('python'))
+
+    def test_empty_round_trip(self):
+        PackageSearchIndex.from_names([]).save(self.path)
+        loaded = PackageSearchIndex.load(self.path)
+        self.assertEqual(len(loaded), 0)
+        self.assertEqual(loaded.search('vim'), [])
+
+    def test_truncated_file(self):
+        self.index.save(self.path)
+        with open(self.path, 'rb') as infile:
+            data = infile.read()
+        with open(self.path, 'wb') as outfile:
+            outfile.write(data[:-4])
+        with self.assertRaises(SearchIndexError):
+            PackageSearchIndex.load(self.path)
+
+    def test_not_an_index(self):
+        with open(self.path, 'wb') as outfile:
+            outfile.write(b'Package: vim\n' * 4)
+        with self.assertRaises(SearchIndexError):
+            PackageSearchIndex.load(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
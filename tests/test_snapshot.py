@@ -0,0 +1,101 @@
+import os
+import os.path
+import tempfile
+import unittest
+
+from appleseed import AlpineIndexFile
+from appleseed.snapshot import (Snapshot, SnapshotError, SnapshotWriter, file_sha256,
+                                open_snapshot, snapshot_path)
+
+PARAGRAPHS = [
+    {'Package': 'vim', 'Version': '2:9.0.1378-2', 'Section': 'editors',
+     'Description': 'Vi IMproved\n ' + 'enhanced vi editor ' * 20},
+    {'Package': 'vim-tiny', 'Version': '2:9.0.1378-2', 'Section': 'editors',
+     'Maintainer': 'Debian Vim Maintainers <team+vim@tracker.debian.org>'},
+    {'Package': 'fonts-ipafont', 'Section': 'fonts', 'Description': 'Japanese 明朝'},
+    {'Package': 'empty', 'Version': ''},
+]
+
+APKINDEX = ('P:musl\nV:1.2.4-r2\nT:the musl c library\n\n'
+            'P:busybox\nV:1.36.1-r5\nD:so:libc.musl-x86_64.so.1\n\n')
+
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._dir.cleanup)
+        self.path = os.path.join(self._dir.name, 'packages.snap')
+
+    def _save(self, paragraphs):
+        with SnapshotWriter(self._dir.name) as writer:
+            for paragraph in paragraphs:
+                writer.add(paragraph)
+            self.assertEqual(len(writer), len(paragraphs))
+            writer.save(self.path)
+
+    def test_round_trip(self):
+        self._save(PARAGRAPHS)
+        with Snapshot(self.path) as snapshot:
+            self.assertEqual(len(snapshot), len(PARAGRAPHS))
+            self.assertEqual([dict(record) for record in snapshot], PARAGRAPHS)
+
+            record = snapshot[1]
+            self.assertEqual(record['PACKAGE'], 'vim-tiny')
+            self.assertIn('maintainer', record)
+            self.assertNotIn('Description', record)
+            self.assertNotIn('Homepage', record)
+            with self.assertRaises(KeyError):
+                record['Description']  # pylint: disable=pointless-statement
+            with self.assertRaises(IndexError):
+                snapshot[len(PARAGRAPHS)]  # pylint: disable=expression-not-assigned
+
+    def test_empty(self):
+        self._save([])
+        with Snapshot(self.path) as snapshot:
+            self.assertEqual(list(snapshot), [])
+
+    def test_truncated(self):
+        self._save(PARAGRAPHS)
+        with open(self.path, 'rb') as infile:
+            data = infile.read()
+        with open(self.path, 'wb') as outfile:
+            outfile.write(data[:-1])
+        with self.assertRaises(SnapshotError):
+            Snapshot(self.path)
+
+    def test_not_a_snapshot(self):
+        for data in (b'', b'Package: vim\n' * 4):
+            with open(self.path, 'wb') as outfile:
+                outfile.write(data)
+            with self.assertRaises(SnapshotError):
+                Snapshot(self.path)
+
+    def test_index_file(self):
+        index_path = os.path.join(self._dir.name, 'APKINDEX')
+        with open(index_path, 'w') as outfile:
+            outfile.write(APKINDEX)
+        snapshot_dir = os.path.join(self._dir.name, 'snapshots')
+        os.mkdir(snapshot_dir)
+
+        index_file = AlpineIndexFile('alpine', '3.18', 'x86_64', index_path)
+        expected = [dict(paragraph) for paragraph in index_file.iter_paragraphs()]
+        self.assertIsNone(open_snapshot(snapshot_dir, index_path))
+
+        # The first iteration makes the snapshot, the second one reads it.
+        made = [dict(paragraph) for paragraph in index_file.iter_cached_paragraphs(snapshot_dir)]
+        self.assertTrue(os.path.exists(snapshot_path(snapshot_dir, file_sha256(index_path))))
+        read = [dict(paragraph) for paragraph in index_file.iter_cached_paragraphs(snapshot_dir)]
+        self.assertEqual(made, expected)
+        self.assertEqual(read, expected)
+
+        predicate = lambda paragraph: paragraph['package'] == 'busybox'
+        self.assertEqual([paragraph['version'] for paragraph
+                          in index_file.iter_cached_paragraphs(snapshot_dir, predicate)],
+                         ['1.36.1-r5'])
+
+        with open_snapshot(snapshot_dir, index_path) as snapshot:
+            self.assertEqual(len(snapshot), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import os.path
+import sqlite3
+import tempfile
+import unittest
+
+from appleseed.storage import SQLiteBackend
+
+
+def _document(name, description='', content_hash=None):
+    return {'package': name, 'description': description, 'content_hash': content_hash,
+            'size': len(name)}
+
+
+def _names(documents):
+    return sorted(document['package'] for document in documents)
+
+
+class SQLiteBackendTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._dir.cleanup)
+        self.path = os.path.join(self._dir.name, 'packages.db')
+        self.backend = SQLiteBackend(self.path, 'packages')
+        self.addCleanup(self.backend.close)
+
+    def _schema(self):
+        with sqlite3.connect(self.path) as conn:
+            return {name for (name, ) in conn.execute(
+                "SELECT name FROM sqlite_master WHERE name NOT LIKE 'sqlite_%'")}
+
+    def test_search_is_kept_up_to_date(self):
+        self.backend.bulk_load([_document('vim', 'editor'), _document('emacs', 'editor')])
+        self.backend.create_indexes([[('size', 1)]])
+        self.assertEqual(_names(self.backend.search('editor')), ['emacs', 'vim'])
+
+        self.backend.update([_document('nano', 'editor'), _document('vim', 'improved')],
+                            ['emacs'])
+        self.assertEqual(_names(self.backend.search('editor')), ['nano'])
+        self.assertEqual(_names(self.backend.search('improved')), ['vim'])
+
+    def test_package_names_weigh_more(self):
+        self.backend.bulk_load([_document('other', 'works with vim'), _document('vim')])
+        self.backend.create_indexes()
+        self.assertEqual([document['package'] for document in self.backend.search('vim')],
+                         ['vim', 'other'])
+
+    def test_last_document_wins(self):
+        self.backend.bulk_load([_document('vim', 'old', 'a'), _document('vim', 'new', 'b')])
+        self.backend.create_indexes()
+        self.assertEqual(self.backend.hashes(), {'vim': 'b'})
+        self.assertEqual(self.backend.search('old'), [])
+
+    def test_replace_with(self):
+        self.backend.bulk_load([_document('emacs', 'editor')])
+        self.backend.create_indexes([[('size', 1)]])
+
+        for generation in range(2):
+            staging = self.backend.staging()
+            staging.bulk_load([_document('vim', 'editor'), _document(f'gen{generation}')])
+            staging.create_indexes([[('size', 1)], [('size', -1)]])
+            self.backend.replace_with(staging)
+
+            self.assertEqual(_names(self.backend.search('editor')), ['vim'])
+            self.assertEqual(_names(self.backend.search(f'gen{generation}')),
+                             [f'gen{generation}'])
+            self.assertEqual(self._schema() & {'packages_size', 'packages_size_desc',
+                                               'packages-staging_size'},
+                             {'packages_size', 'packages_size_desc'})
+
+        # The triggers follow the renamed table.
+        self.backend.update([_document('nano', 'editor')], ['vim'])
+        self.assertEqual(_names(self.backend.search('editor')), ['nano'])
+
+
+if __name__ == '__main__':
+    unittest.main()